@@ -0,0 +1,364 @@
+"""
+聊天请求的准入控制与期限
+
+突发的大量聊天请求如果全部同时运行，会一起挤占模型 API 的并发额度和本机 CPU，结果是所有回答都变慢。
+- AdmissionController：限制同时执行的 Agent 运行数，超出的请求按到达顺序排队；
+  队列已满时立即拒绝（429 + Retry-After），排队超过 CHAT_QUEUE_TIMEOUT_SECONDS 时放弃（503 + Retry-After）
+- RateLimiter：按客户端地址的令牌桶，超出速率的请求立即返回 429 + Retry-After
+- with_deadline：给工具加上执行期限，超时作为工具错误返回给模型，模型可以换一种方式继续回答
+- run_deadline：整个运行（所有模型和工具调用）的期限，超时后停止并告知用户
+
+Flask（线程）和 ASGI（协程）两种模式共用同一个 AdmissionController。多进程部署时各工作进程分别限制，
+总并发上限为 SERVICE_WORKERS × CHAT_MAX_CONCURRENT_RUNS。
+"""
+import asyncio
+import functools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from langchain_core.runnables.config import run_in_executor
+from langchain_core.tools import StructuredTool, ToolException
+
+from metrics import Counter, Gauge, Histogram
+
+CHAT_MAX_CONCURRENT_RUNS = int(os.getenv("CHAT_MAX_CONCURRENT_RUNS", "8"))
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "16"))
+CHAT_QUEUE_TIMEOUT_SECONDS = float(os.getenv("CHAT_QUEUE_TIMEOUT_SECONDS", "15"))
+# 每个客户端每分钟的请求数和可以连续发出的请求数；速率为 0 时不限制
+CHAT_RATE_LIMIT_PER_MINUTE = float(os.getenv("CHAT_RATE_LIMIT_PER_MINUTE", "20"))
+CHAT_RATE_LIMIT_BURST = int(os.getenv("CHAT_RATE_LIMIT_BURST", "5"))
+CHAT_RUN_TIMEOUT_SECONDS = float(os.getenv("CHAT_RUN_TIMEOUT_SECONDS", "120"))
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "30"))
+
+# 各工具的默认期限（秒），可用 TOOL_TIMEOUTS="tavily_search=10,extract_webpages=60" 覆盖，其余工具用 TOOL_TIMEOUT_SECONDS
+DEFAULT_TOOL_TIMEOUTS = {
+    'read_doc_file': 10,
+    'search_notes': 10,
+    'write_file': 10,
+    'tavily_search': 20,
+    'extract_webpage_content': 30,
+    'extract_webpages': 45,
+}
+
+CHAT_ADMISSIONS = Counter(
+    'chat_admission_total',
+    '聊天请求的准入结果：admitted（直接执行）、queued（排队后执行）、rate_limited、queue_full、queue_timeout',
+    ['result'],
+)
+CHAT_RUNS_ACTIVE = Gauge('chat_runs_active', '正在执行的 Agent 运行数')
+CHAT_QUEUE_DEPTH = Gauge('chat_queue_depth', '排队等待执行的聊天请求数')
+CHAT_QUEUE_WAIT = Histogram(
+    'chat_queue_wait_seconds',
+    '排队后被执行的请求的等待时间',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30),
+)
+TOOL_TIMEOUTS = Counter(
+    'agent_tool_timeouts_total',
+    '超过期限被放弃的工具调用次数',
+    ['tool'],
+)
+CHAT_RUN_TIMEOUTS = Counter(
+    'chat_run_timeouts_total',
+    '超过 CHAT_RUN_TIMEOUT_SECONDS 被停止的运行数',
+)
+
+
+class Overloaded(Exception):
+    """请求未被接纳；reason 为 rate_limited、queue_full 或 queue_timeout，retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(int(math.ceil(retry_after)), 1)
+
+    @property
+    def status_code(self):
+        # 排队超时说明服务本身忙不过来，其余是客户端请求过多
+        return 503 if self.reason == 'queue_timeout' else 429
+
+    @property
+    def message(self):
+        return {
+            'rate_limited': '请求过于频繁',
+            'queue_full': '服务繁忙，当前排队的请求已满',
+            'queue_timeout': '服务繁忙，排队等待超时',
+        }[self.reason]
+
+
+class _Waiter:
+    """队列中的一个请求；轮到它时 granted 置为 True 并调用 notify"""
+
+    __slots__ = ('notify', 'granted')
+
+    def __init__(self, notify):
+        self.notify = notify
+        self.granted = False
+
+
+class Admission:
+    """已获得的执行名额，release() 只生效一次"""
+
+    def __init__(self, controller):
+        self._controller = controller
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(time.monotonic() - self._started)
+
+
+class AdmissionController:
+    """限制同时执行的运行数，超出时按先来先服务排队（队列有上限）"""
+
+    def __init__(self, max_concurrent=CHAT_MAX_CONCURRENT_RUNS, max_queue=CHAT_MAX_QUEUE,
+                 queue_timeout=CHAT_QUEUE_TIMEOUT_SECONDS):
+        self.max_concurrent = max(max_concurrent, 1)
+        self.max_queue = max(max_queue, 0)
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters = deque()
+        # 运行时长的指数移动平均，用于估算 Retry-After
+        self._avg_run_seconds = None
+
+    def _enter(self, waiter):
+        """有空闲名额且无人排队时直接占用（返回 True），否则入队（返回 False）；队列已满时抛出 Overloaded"""
+        with self._lock:
+            if self._active < self.max_concurrent and not self._waiters:
+                self._active += 1
+                CHAT_RUNS_ACTIVE.set(self._active)
+                return True
+            if len(self._waiters) >= self.max_queue:
+                CHAT_ADMISSIONS.labels(result='queue_full').inc()
+                raise Overloaded('queue_full', self._retry_after_locked(len(self._waiters)))
+            self._waiters.append(waiter)
+            CHAT_QUEUE_DEPTH.set(len(self._waiters))
+            return False
+
+    def _leave(self, waiter):
+        """放弃排队；放弃时恰好已轮到自己，则把名额让给下一个"""
+        with self._lock:
+            if waiter.granted:
+                self._hand_over_locked()
+                return
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+            CHAT_QUEUE_DEPTH.set(len(self._waiters))
+
+    def _release(self, seconds):
+        with self._lock:
+            if self._avg_run_seconds is None:
+                self._avg_run_seconds = seconds
+            else:
+                self._avg_run_seconds += 0.2 * (seconds - self._avg_run_seconds)
+            self._hand_over_locked()
+
+    def _hand_over_locked(self):
+        """空出的名额直接交给队首的请求（运行数不变），没有人排队时运行数减一"""
+        if self._waiters:
+            waiter = self._waiters.popleft()
+            CHAT_QUEUE_DEPTH.set(len(self._waiters))
+            waiter.granted = True
+            waiter.notify()
+            return
+        self._active -= 1
+        CHAT_RUNS_ACTIVE.set(self._active)
+
+    def _retry_after_locked(self, queued):
+        """排在 queued 个请求之后大约要等多久"""
+        average = self._avg_run_seconds or 5.0
+        return min(max(average * (queued + 1) / self.max_concurrent, 1), 60)
+
+    def _admitted(self, queued_at=None):
+        if queued_at is None:
+            CHAT_ADMISSIONS.labels(result='admitted').inc()
+        else:
+            CHAT_ADMISSIONS.labels(result='queued').inc()
+            CHAT_QUEUE_WAIT.observe(time.monotonic() - queued_at)
+        return Admission(self)
+
+    def _timed_out(self):
+        CHAT_ADMISSIONS.labels(result='queue_timeout').inc()
+        with self._lock:
+            retry_after = self._retry_after_locked(len(self._waiters))
+        return Overloaded('queue_timeout', retry_after)
+
+    def acquire(self):
+        """同步版本（Flask 请求线程）：等待执行名额，返回 Admission；无法接纳时抛出 Overloaded"""
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        if self._enter(waiter):
+            return self._admitted()
+        queued_at = time.monotonic()
+        if event.wait(self.queue_timeout):
+            return self._admitted(queued_at)
+        self._leave(waiter)
+        raise self._timed_out()
+
+    async def acquire_async(self):
+        """异步版本（ASGI）"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = _Waiter(notify)
+        if self._enter(waiter):
+            return self._admitted()
+        queued_at = time.monotonic()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._leave(waiter)
+            raise self._timed_out()
+        except asyncio.CancelledError:
+            # 排队期间客户端断开
+            self._leave(waiter)
+            raise
+        return self._admitted(queued_at)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': self._active,
+                'queued': len(self._waiters),
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'queue_timeout_seconds': self.queue_timeout,
+                'avg_run_seconds': round(self._avg_run_seconds, 3) if self._avg_run_seconds is not None else None,
+            }
+
+
+class RateLimiter:
+    """按客户端的令牌桶：每秒补充 per_minute / 60 个令牌，最多积累 burst 个，每个请求消耗一个"""
+
+    def __init__(self, per_minute=CHAT_RATE_LIMIT_PER_MINUTE, burst=CHAT_RATE_LIMIT_BURST, max_clients=10000):
+        self.rate = per_minute / 60
+        self.burst = max(burst, 1)
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # 客户端 -> (令牌数, 更新时间)
+        self._lock = threading.Lock()
+
+    def check(self, client, now=None):
+        """消耗一个令牌；令牌不足时抛出 Overloaded（retry_after 为下一个令牌到来的时间）"""
+        if self.rate <= 0:
+            return
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(tokens + (now - updated) * self.rate, self.burst)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[client] = (tokens, now)
+            # 最久没有请求的客户端的桶已经补满，丢弃不影响结果
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        if not allowed:
+            CHAT_ADMISSIONS.labels(result='rate_limited').inc()
+            raise Overloaded('rate_limited', (1 - tokens) / self.rate)
+
+    def stats(self):
+        with self._lock:
+            clients = len(self._buckets)
+        return {'per_minute': self.rate * 60, 'burst': self.burst, 'clients': clients}
+
+
+admission_controller = AdmissionController()
+rate_limiter = RateLimiter()
+
+
+# ---------- 期限 ----------
+
+def _parse_tool_timeouts(value):
+    timeouts = dict(DEFAULT_TOOL_TIMEOUTS)
+    for item in (value or '').split(','):
+        name, _, seconds = item.partition('=')
+        if name.strip() and seconds.strip():
+            timeouts[name.strip()] = float(seconds)
+    return timeouts
+
+
+_tool_timeouts = _parse_tool_timeouts(os.getenv("TOOL_TIMEOUTS"))
+
+
+def tool_timeout(name):
+    return _tool_timeouts.get(name, TOOL_TIMEOUT_SECONDS)
+
+
+async def call_with_deadline(name, seconds, awaitable):
+    """在期限内等待工具结果，超时抛出 ToolException（工具设置 handle_tool_error 后作为错误结果返回给模型）"""
+    if not seconds or seconds <= 0:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, seconds)
+    except asyncio.TimeoutError:
+        TOOL_TIMEOUTS.labels(tool=name).inc()
+        raise ToolException(f"❌ 工具 {name} 超过 {seconds:g} 秒没有完成，已放弃。请换一种方式回答，或告诉用户稍后再试。")
+
+
+def with_deadline(tool, seconds=None):
+    """返回带执行期限的工具副本（函数工具）；其他工具原样返回，需要自己调用 call_with_deadline
+
+    Agent 以异步方式调用工具：同步函数放到线程池执行，超时后不再等待（线程会继续执行到结束，
+    网页抓取等有自己的请求超时）。
+    """
+    seconds = tool_timeout(tool.name) if seconds is None else seconds
+    if not isinstance(tool, StructuredTool) or not seconds or seconds <= 0:
+        return tool
+    name = tool.name
+    if tool.coroutine is not None:
+        coroutine = tool.coroutine
+
+        @functools.wraps(coroutine)
+        async def bounded(*args, **kwargs):
+            return await call_with_deadline(name, seconds, coroutine(*args, **kwargs))
+    else:
+        func = tool.func
+
+        @functools.wraps(func)
+        async def bounded(*args, **kwargs):
+            return await call_with_deadline(name, seconds, run_in_executor(None, func, *args, **kwargs))
+    return tool.model_copy(update={'coroutine': bounded, 'handle_tool_error': True})
+
+
+class RunTimeout(Exception):
+    """整个运行超过期限"""
+
+
+async def run_deadline(stream, seconds):
+    """逐项转发异步流，总耗时超过 seconds 时停止上游并抛出 RunTimeout；seconds 不大于 0 时不限制"""
+    deadline = time.monotonic() + seconds if seconds and seconds > 0 else None
+    try:
+        while True:
+            if deadline is None:
+                item = await stream.__anext__()
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RunTimeout()
+                try:
+                    item = await asyncio.wait_for(stream.__anext__(), remaining)
+                except asyncio.TimeoutError:
+                    raise RunTimeout() from None
+            yield item
+    except StopAsyncIteration:
+        return
+    except RunTimeout:
+        CHAT_RUN_TIMEOUTS.inc()
+        raise
+    finally:
+        try:
+            await stream.aclose()
+        except RuntimeError:
+            # 再次被取消时上游的 __anext__ 可能还没结束，此时无法关闭，上游随取消一起结束
+            pass
@@ -0,0 +1,128 @@
+"""
+聊天流与工具调用指标
+
+- StreamRecorder：记录一次聊天流的首字延迟、输出速率和总时长，并维护活动流数量
+- ToolMetricsCallback：LangChain 回调，按工具统计调用耗时和错误次数
+  （工具内部捕获异常后返回的错误结果也算作错误：以 ❌ 开头的文本，或带 error 字段的字典/JSON）
+"""
+import json
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from metrics import Counter, Histogram, SSE_ACTIVE_STREAMS
+from tokenizer import estimate_tokens
+
+CHAT_TIME_TO_FIRST_TOKEN = Histogram(
+    'chat_time_to_first_token_seconds',
+    '从开始处理聊天请求到输出第一个 token 的时间',
+)
+CHAT_STREAM_DURATION = Histogram(
+    'chat_stream_duration_seconds',
+    '聊天流的总时长',
+    ['outcome'],
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+CHAT_TOKENS_PER_SECOND = Histogram(
+    'chat_tokens_per_second',
+    '首个 token 之后的输出速率（token 数为估算值）',
+    buckets=(1, 2.5, 5, 10, 20, 40, 80, 160, 320),
+)
+CHAT_OUTPUT_TOKENS = Counter(
+    'chat_output_tokens_total',
+    '输出的 token 总数（估算值）',
+)
+TOOL_DURATION = Histogram(
+    'agent_tool_duration_seconds',
+    '工具调用耗时',
+    ['tool'],
+)
+TOOL_CALLS = Counter(
+    'agent_tool_calls_total',
+    '工具调用次数，status 为 ok 或 error',
+    ['tool', 'status'],
+)
+
+
+class StreamRecorder:
+    """一次聊天流的计时器，finish() 只生效一次"""
+
+    def __init__(self, stream='chat'):
+        self._active = SSE_ACTIVE_STREAMS.labels(stream=stream)
+        self._active.inc()
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self._parts = []
+        self._finished = False
+
+    def on_text(self, text):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            CHAT_TIME_TO_FIRST_TOKEN.observe(self.first_token_at - self.started)
+        if isinstance(text, str):
+            self._parts.append(text)
+
+    def finish(self, outcome='ok'):
+        if self._finished:
+            return
+        self._finished = True
+        self._active.dec()
+        finished = time.perf_counter()
+        CHAT_STREAM_DURATION.labels(outcome=outcome).observe(finished - self.started)
+        if self.first_token_at is None:
+            return
+        tokens = estimate_tokens(''.join(self._parts))
+        CHAT_OUTPUT_TOKENS.inc(tokens)
+        elapsed = finished - self.first_token_at
+        if tokens > 1 and elapsed > 0:
+            CHAT_TOKENS_PER_SECOND.observe(tokens / elapsed)
+
+
+def is_error_result(output):
+    """判断工具返回值是否表示失败"""
+    if getattr(output, 'status', None) == 'error':
+        return True
+    content = getattr(output, 'content', output)
+    if isinstance(content, dict):
+        return bool(content.get('error')) or content.get('success') is False
+    if isinstance(content, str):
+        text = content.lstrip()
+        if text.startswith('❌'):
+            return True
+        if text.startswith('{'):
+            try:
+                return is_error_result(json.loads(text))
+            except ValueError:
+                return False
+    return False
+
+
+class ToolMetricsCallback(BaseCallbackHandler):
+    """按 run_id 记录工具调用的开始时间，结束或出错时写入指标"""
+
+    # 直接在调用线程执行，不需要调度到线程池
+    run_inline = True
+
+    def __init__(self):
+        self._started = {}
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = (serialized or {}).get('name') or kwargs.get('name') or 'unknown'
+        self._started[run_id] = (name, time.perf_counter())
+
+    def _finish(self, run_id, failed):
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        name, started_at = started
+        TOOL_DURATION.labels(tool=name).observe(time.perf_counter() - started_at)
+        TOOL_CALLS.labels(tool=name, status='error' if failed else 'ok').inc()
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._finish(run_id, is_error_result(output))
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, True)
+
+
+tool_metrics_callback = ToolMetricsCallback()
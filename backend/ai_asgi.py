@@ -0,0 +1,314 @@
+"""
+AI 聊天服务的 ASGI 版本
+
+所有请求共享 uvicorn 的一个长期事件循环，/api/chat 直接消费
+WebsiteAgent.chat_stream_async 输出 SSE，每个流只占用一个协程而不是一个线程；
+客户端断开（http.disconnect）时取消该协程，不再为没有人看的回答调用模型和工具。
+
+启动方式：
+    AI_SERVER_MODE=asgi python ai_service.py
+    或 uvicorn ai_asgi:app --host 0.0.0.0 --port 5005
+"""
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from app import commit_queue, get_agent_instance, start_warmup
+from admission import Overloaded, admission_controller, rate_limiter
+from ai_service import (
+    resolve_client, resolve_thread_id, resolve_request_id, build_status_payload, build_health_payload,
+    build_debug_payload, build_overloaded_response, debug_access_allowed, AGENT_WARMUP,
+    NO_CACHE_HEADERS, SSE_HEADERS,
+)
+from sse_framing import FrameCoalescer, coalesce_async, format_event
+from service_log import get_logger
+from metrics import CONTENT_TYPE, REGISTRY, observe_request
+
+logger = get_logger("ai_asgi")
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type, X-Thread-Id, X-Request-Id',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+}
+
+# 同步工具和模型调用所用的线程池大小（默认线程池只有 cpu+4 个线程，会限制并发流数）
+EXECUTOR_WORKERS = int(os.getenv("ASGI_EXECUTOR_WORKERS", "128"))
+
+
+def _encode_headers(headers):
+    return [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in headers.items()]
+
+
+async def _read_body(receive):
+    """读取完整的请求体"""
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def _wait_for_disconnect(receive):
+    """请求体读完后，receive() 下一次返回的只会是 http.disconnect"""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+def _release_when_done(admission_task):
+    """放弃等待中的执行名额：取消等待，若已经（或在取消生效前）获得名额则立即归还"""
+    def release(task):
+        if not task.cancelled() and task.exception() is None:
+            task.result().release()
+    admission_task.add_done_callback(release)
+    admission_task.cancel()
+
+
+async def _admit(disconnect_task):
+    """等待执行名额，返回 Admission；排队期间客户端断开时返回 None，无法接纳时抛出 Overloaded"""
+    admission_task = asyncio.ensure_future(admission_controller.acquire_async())
+    abandoned = True
+    try:
+        await asyncio.wait({admission_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+        abandoned = not admission_task.done()
+    finally:
+        if abandoned:
+            _release_when_done(admission_task)
+    return None if abandoned else admission_task.result()
+
+
+async def _reject(send, log, error):
+    log.warning("🚦 聊天请求未被接纳: %s", error.reason, fields={"retry_after": error.retry_after})
+    payload, status_code, headers = build_overloaded_response(error)
+    await _send_json(send, payload, status_code, headers)
+
+
+async def _send_json(send, data, status=200, headers=None):
+    payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': _encode_headers({
+            **CORS_HEADERS,
+            'Content-Type': 'application/json',
+            'Content-Length': str(len(payload)),
+            **(headers or {}),
+        }),
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def chat(scope, receive, send):
+    """流式聊天接口（ASGI 版）"""
+    body = await _read_body(receive)
+    if body is None:
+        return
+    try:
+        data = json.loads(body or b'{}')
+    except ValueError as e:
+        await _send_json(send, {"success": False, "error": str(e)}, 400)
+        return
+    if not isinstance(data, dict):
+        await _send_json(send, {"success": False, "error": "请求体必须是 JSON 对象"}, 400)
+        return
+
+    headers = {k.decode('latin-1').title(): v.decode('latin-1') for k, v in scope['headers']}
+    client = scope.get('client') or (None, None)
+    messages = data.get('messages', [])
+    page_path = data.get('pagePath')
+    thread_id = resolve_thread_id(data, headers)
+    request_id = resolve_request_id(headers)
+    log = logger.bind(request_id=request_id, thread_id=thread_id)
+    log.info("🔍 收到聊天请求", fields={"messages": len(messages), "page_path": page_path})
+
+    try:
+        rate_limiter.check(resolve_client(headers, client[0]))
+    except Overloaded as e:
+        await _reject(send, log, e)
+        return
+
+    # 客户端断开后 send 不会报错，需要单独监听 http.disconnect：排队时放弃等待，生成时取消生成
+    disconnect_task = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        admission = await _admit(disconnect_task)
+    except Overloaded as e:
+        disconnect_task.cancel()
+        await _reject(send, log, e)
+        return
+    except BaseException:
+        disconnect_task.cancel()
+        raise
+    if admission is None:
+        log.info("🔌 客户端在排队时断开")
+        return
+
+    async def send_event(payload):
+        await send({'type': 'http.response.body', 'body': payload.encode('utf-8'), 'more_body': True})
+
+    async def stream():
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': _encode_headers({
+                **SSE_HEADERS,
+                'Content-Type': 'text/event-stream',
+                'X-Thread-Id': thread_id,
+                'X-Request-Id': request_id,
+            }),
+        })
+        try:
+            # 首次使用时构建 Agent（或等待预热线程构建完成），放到线程池中，不阻塞事件循环上的其他流
+            agent_instance = await asyncio.get_running_loop().run_in_executor(None, get_agent_instance)
+            # 相邻的 token 按时间窗口合并成一帧，减少序列化和写调用
+            coalescer = FrameCoalescer.from_env()
+            frames = coalesce_async(agent_instance.chat_stream_async(messages, page_path, thread_id, request_id), coalescer)
+            async for frame in frames:
+                if frame:
+                    await send_event(format_event({'content': frame}))
+            log.info("📦 SSE 分帧完成", fields={"chunks": coalescer.chunks, "frames": coalescer.frames})
+            await send_event("data: [DONE]\n\n")
+        except Exception as e:
+            log.exception("❌ 聊天流出错")
+            await send_event(format_event({'error': str(e)}))
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    stream_task = asyncio.ensure_future(stream())
+    try:
+        await asyncio.wait({stream_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnect_task.cancel()
+        if not stream_task.done():
+            stream_task.cancel()
+        await asyncio.gather(stream_task, disconnect_task, return_exceptions=True)
+        admission.release()
+
+
+async def status(scope, receive, send):
+    """获取 Agent 状态"""
+    # 首次调用会构建 Agent（耗时数秒），放到线程池中执行，不阻塞事件循环上的其他流
+    data, status_code = await asyncio.get_running_loop().run_in_executor(None, build_status_payload)
+    await _send_json(send, data, status_code, NO_CACHE_HEADERS)
+
+
+async def health(scope, receive, send):
+    """健康检查"""
+    await _send_json(send, build_health_payload("asgi"))
+
+
+async def metrics(scope, receive, send):
+    """Prometheus 指标"""
+    payload = REGISTRY.render().encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': _encode_headers({'Content-Type': CONTENT_TYPE, 'Content-Length': str(len(payload))}),
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+DEBUG_PREFIX = '/api/debug/'
+
+
+async def debug_api(scope, receive, send):
+    """执行追踪与采样分析（见 ai_service.build_debug_payload）"""
+    body = await _read_body(receive)
+    if body is None:
+        return
+    headers = {k.decode('latin-1').title(): v.decode('latin-1') for k, v in scope['headers']}
+    client = scope.get('client') or (None, None)
+    if not debug_access_allowed(headers, client[0]):
+        await _send_json(send, {"success": False, "error": "无权访问调试接口"}, 403)
+        return
+    try:
+        data = json.loads(body) if body else {}
+        args = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        payload, status_code = build_debug_payload(scope['method'], scope['path'][len(DEBUG_PREFIX):], args, data)
+    except (TypeError, ValueError) as e:
+        await _send_json(send, {"success": False, "error": str(e)}, 400)
+        return
+    if not isinstance(payload, str):
+        await _send_json(send, payload, status_code, NO_CACHE_HEADERS)
+        return
+    text = payload.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status_code,
+        'headers': _encode_headers({
+            **CORS_HEADERS,
+            'Content-Type': 'text/plain; charset=utf-8',
+            'Content-Length': str(len(text)),
+        }),
+    })
+    await send({'type': 'http.response.body', 'body': text})
+
+
+ROUTES = {
+    ('POST', '/api/chat'): chat,
+    ('GET', '/api/status'): status,
+    ('GET', '/health'): health,
+    ('GET', '/metrics'): metrics,
+}
+
+
+async def lifespan(scope, receive, send):
+    """启动时扩大默认线程池，关闭时释放"""
+    executor = None
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix="agent")
+            asyncio.get_running_loop().set_default_executor(executor)
+            # 发布上次退出前残留的暂存文件并启动发布线程（pre-fork 工作进程中为该进程自己的目录）
+            commit_queue.start()
+            if AGENT_WARMUP:
+                # 在后台线程中构建 Agent，不阻塞服务启动
+                start_warmup()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if executor is not None:
+                executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI 入口"""
+    if scope['type'] == 'lifespan':
+        await lifespan(scope, receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    method = scope['method']
+    path = scope['path']
+    if method == 'OPTIONS':
+        await send({'type': 'http.response.start', 'status': 204, 'headers': _encode_headers(CORS_HEADERS)})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    handler = ROUTES.get((method, path))
+    endpoint = path
+    if handler is None and path.startswith(DEBUG_PREFIX):
+        handler = debug_api
+        endpoint = DEBUG_PREFIX + '<path:subpath>'
+    if handler is None:
+        await _send_json(send, {"success": False, "error": "Not Found"}, 404)
+        return
+
+    # 与 Flask 模式一致：耗时统计到响应头发出为止
+    started = time.perf_counter()
+
+    async def timed_send(message):
+        if message['type'] == 'http.response.start':
+            observe_request(endpoint, method, message['status'], time.perf_counter() - started)
+        await send(message)
+
+    await handler(scope, receive, timed_send)
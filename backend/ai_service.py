@@ -2,14 +2,31 @@ from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 import json
 import datetime
+import hmac
+import ipaddress
 import os
+import re
+import uuid
 from typing import List, Dict, Any, Generator
 
 # 🎯 导入我们的 Agent
-from app import chat_with_agent, get_agent_instance
+from app import chat_with_agent, commit_queue, get_agent_instance, agent_ready, start_warmup
+from search_cache import search_cache
+from answer_cache import answer_cache
+from cancellation import run_registry, socket_disconnected
+from admission import Overloaded, admission_controller, rate_limiter
+from sse_framing import FrameCoalescer, format_event
+from service_log import configure_logging, get_logger, logging_stats
+from metrics import init_metrics
+from prefork import SERVICE_WORKERS, worker_index
+from tracing import collapsed_stacks, profiler_control, trace_store
+
+configure_logging("ai")
+logger = get_logger("ai_service")
 
 app = Flask(__name__)
 CORS(app)  # 允许前端跨域请求
+init_metrics(app)  # 请求耗时统计 + /metrics
 
 
 
@@ -21,81 +38,152 @@ def build_system_prompt(pagePath):
     prompt += "\n\n用户问题：\n"
     return prompt
 
+def parse_trusted_proxies(value):
+    """解析可信代理列表（逗号分隔的地址或网段，如 "127.0.0.1,10.0.0.0/8"）"""
+    networks = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(item, strict=False))
+        except ValueError:
+            logger.warning("⚠️ 忽略无效的 TRUSTED_PROXIES 项: %s", item)
+    return networks
+
+# 可信的反向代理；只有直接连接来自这些地址时才采用 X-Forwarded-For，未设置时一律使用直接连接的地址
+TRUSTED_PROXIES = parse_trusted_proxies(os.getenv("TRUSTED_PROXIES", ""))
+
+def is_trusted_proxy(address):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+def resolve_client(headers, remote_addr):
+    """客户端地址（限流的依据）
+
+    直接连接来自可信代理时，从右往左跳过 X-Forwarded-For 中的可信代理，取第一个不可信的地址；
+    其余情况使用直接连接的地址，客户端自己写的 X-Forwarded-For 不起作用。
+    """
+    client = remote_addr
+    if client and is_trusted_proxy(client):
+        for hop in reversed(headers.get('X-Forwarded-For', '').split(',')):
+            hop = hop.strip()
+            if not hop:
+                continue
+            client = hop
+            if not is_trusted_proxy(hop):
+                break
+    return client or 'unknown'
+
+def resolve_thread_id(data, headers):
+    """确定请求所属的会话线程：使用客户端提供的 threadId，没有时新建一个随机会话
+
+    新会话的 ID 通过 X-Thread-Id 响应头返回，客户端带上它继续同一会话；
+    不按地址推断会话，避免同一出口（NAT、代理）后的用户共享历史，或伪造地址读取他人的会话。
+    """
+    thread_id = data.get('threadId') or headers.get('X-Thread-Id')
+    if thread_id:
+        # 只保留安全字符并限制长度，防止构造异常的线程 ID
+        thread_id = re.sub(r'[^A-Za-z0-9_.:-]', '', str(thread_id))[:128]
+    if not thread_id:
+        thread_id = f"anon:{uuid.uuid4().hex}"
+    return thread_id
+
+def build_overloaded_response(error):
+    """请求未被接纳时的响应，返回 (数据, HTTP 状态码, 响应头)"""
+    return {
+        "success": False,
+        "error": error.message,
+        "reason": error.reason,
+        "retryAfter": error.retry_after,
+    }, error.status_code, {
+        'Retry-After': str(error.retry_after),
+        'Access-Control-Expose-Headers': 'Retry-After',
+    }
+
+def resolve_request_id(headers):
+    """请求 ID：沿用上游（如网关）传入的 X-Request-Id，否则新生成一个，用于关联这次请求的全部日志"""
+    request_id = re.sub(r'[^A-Za-z0-9_.:-]', '', headers.get('X-Request-Id', ''))[:64]
+    return request_id or uuid.uuid4().hex[:12]
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """流式聊天接口"""
     try:
         data = request.json
+        if not isinstance(data, dict):
+            return jsonify({"success": False, "error": "请求体必须是 JSON 对象"}), 400
         messages = data.get('messages', [])
         pagePath = data.get('pagePath')  # 🔑 统一字段名为pagePath
-        
-        print(f"🔍 接收到的请求数据:")
-        print(f"  - messages数量: {len(messages)}")
-        print(f"  - pagePath: {repr(pagePath)}")  # 使用repr显示更详细信息
-        print(f"  - pagePath类型: {type(pagePath)}")
-        print(f"  - pagePath是否为None: {pagePath is None}")
-        print(f"  - pagePath是否为空字符串: {pagePath == ''}")
+        threadId = resolve_thread_id(data, request.headers)
+        requestId = resolve_request_id(request.headers)
+        log = logger.bind(request_id=requestId, thread_id=threadId)
+        log.info("🔍 收到聊天请求", fields={"messages": len(messages), "page_path": pagePath})
+        # 先按客户端限流，再等待执行名额（排队有上限），无法接纳时立即返回 429 / 503
+        try:
+            rate_limiter.check(resolve_client(request.headers, request.remote_addr))
+            admission = admission_controller.acquire()
+        except Overloaded as e:
+            log.warning("🚦 聊天请求未被接纳: %s", e.reason, fields={"retry_after": e.retry_after})
+            payload, status_code, headers = build_overloaded_response(e)
+            return jsonify(payload), status_code, headers
+
+        # 开发服务器提供连接的套接字：等待模型和工具期间也能发现客户端已断开，及时取消本轮运行
+        client_socket = request.environ.get('werkzeug.socket')
+        is_disconnected = (lambda: socket_disconnected(client_socket)) if client_socket is not None else None
         
         def generate():
             try:
-                print(f"🚀 调用call_ai_stream，传递pagePath: {repr(pagePath)}")
-                for chunk in call_ai_stream(messages, pagePath):  # 传递pagePath
+                # 相邻的 token 按时间窗口合并成一帧，减少序列化和写调用
+                coalescer = FrameCoalescer.from_env()
+                for chunk in call_ai_stream(messages, pagePath, threadId, coalescer, requestId, is_disconnected):  # 传递pagePath和会话ID
                     # 确保每个chunk都是字符串格式
                     if chunk:
-                        yield f"data: {json.dumps({'content': chunk})}\n\n"
+                        yield format_event({'content': chunk})
+                if is_disconnected is not None and is_disconnected():
+                    return
+                log.info("📦 SSE 分帧完成", fields={"chunks": coalescer.chunks, "frames": coalescer.frames})
                 yield "data: [DONE]\n\n"
             except Exception as e:
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
+                yield format_event({'error': str(e)})
         
-        return Response(
+        response = Response(
             generate(),
             mimetype='text/event-stream',  # ✅ 修复：使用正确的MIME类型
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'X-Accel-Buffering': 'no',  # ✅ 禁用nginx缓冲
-            }
+            headers={**SSE_HEADERS, 'X-Thread-Id': threadId, 'X-Request-Id': requestId}
         )
+        # 流结束（包括客户端断开）后归还执行名额
+        response.call_on_close(admission.release)
+        return response
             
     except Exception as e:
+        logger.exception("❌ 处理聊天请求失败")
         return jsonify({
             "success": False,
             "error": str(e)
         }), 500
 
-def call_ai_stream(messages, pagePath):
-    """调用 Agent - 流式版本"""
+def call_ai_stream(messages, pagePath, threadId=None, coalescer=None, requestId=None, is_disconnected=None):
+    """调用 Agent - 流式版本；coalescer 用于把相邻的 token 合并成一帧，is_disconnected 用于发现客户端断开"""
     try:
         # 🎯 使用我们构建的 Agent 替代原生 API 调用
-        print(f"🔄 call_ai_stream 接收到参数:")
-        print(f"  - messages数量: {len(messages)}")
-        print(f"  - pagePath: {repr(pagePath)}")
-        
-        # 记录页面路径信息（用于调试）
-        if pagePath:
-            print(f"📄 用户页面路径：{pagePath}")
-        else:
-            print(f"⚠️ 没有接收到页面路径信息")
-        
-        # 调用 app.py 中的 Agent
-        print(f"🎯 调用chat_with_agent，传递pagePath: {repr(pagePath)}")
-        for chunk in chat_with_agent(messages, pagePath):
+        for chunk in chat_with_agent(messages, pagePath, threadId, coalescer, requestId, is_disconnected):
             yield chunk
             
     except Exception as e:
         error_msg = f"❌ Agent 调用失败：{str(e)}"
-        print(error_msg)
+        logger.exception(error_msg, fields={"request_id": requestId or "-"})
         yield error_msg
 
 
-@app.route('/api/status', methods=['GET'])
-def status():
-    """获取 Agent 状态"""
+def build_status_payload():
+    """构建 Agent 状态信息，返回 (数据, HTTP 状态码)"""
     try:
         agent_instance = get_agent_instance()
-        response_data = {
+        return {
             "provider": "LangGraph Agent + 通义千问",
             "configured": True,
             "agent_type": "LangGraph ReAct Agent",
@@ -106,44 +194,181 @@ def status():
                 "✍️ 文件创建和修改", 
                 "🔍 页面路径分析",
                 "🌊 流式输出体验",
-                "💾 对话记忆功能"
-            ]
-        }
-        
-        response = jsonify(response_data)
-        # 添加防缓存头
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
-        return response
-        
+                "💾 对话记忆功能（按会话隔离）"
+            ],
+            "checkpoints": agent_instance.checkpointer.stats(),
+            "search_cache": search_cache.stats(),
+            "answer_cache": answer_cache.stats(),
+            "runs": run_registry.stats(),
+            "admission": admission_controller.stats(),
+            "rate_limit": rate_limiter.stats(),
+            "logging": logging_stats()
+        }, 200
     except Exception as e:
-        response_data = {
+        return {
             "provider": "Agent 初始化失败",
             "configured": False,
             "error": str(e)
-        }
-        response = jsonify(response_data)
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
-        return response, 500
+        }, 500
 
-@app.route('/health', methods=['GET'])
-def health():
-    """健康检查"""
-    return jsonify({
+# 防缓存响应头
+NO_CACHE_HEADERS = {
+    'Cache-Control': 'no-cache, no-store, must-revalidate',
+    'Pragma': 'no-cache',
+    'Expires': '0',
+}
+
+# SSE 流式响应头
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type',
+    'X-Accel-Buffering': 'no',  # ✅ 禁用nginx缓冲
+    'Access-Control-Expose-Headers': 'X-Thread-Id, X-Request-Id',
+}
+
+def build_health_payload(server_mode):
+    """构建健康检查信息"""
+    return {
         "service": "LangGraph AI Agent Service",
         "status": "healthy",
         "port": 5005,
         "architecture": "app.py (LangGraph Agent) + ai_service.py (Flask API)",
-        "agent_status": "active"
-    })
+        "server_mode": server_mode,
+        # 多进程部署时标明由哪个工作进程响应（指标和调试数据都按进程统计）
+        "worker": worker_index(),
+        "pid": os.getpid(),
+        # Agent 在首次使用（或后台预热）时才构建
+        "agent_status": "active" if agent_ready() else "pending"
+    }
+
+# 启动后在后台预先构建 Agent，设为 0 时推迟到第一个聊天请求
+AGENT_WARMUP = os.getenv("AGENT_WARMUP", "1") != "0"
+
+@app.route('/api/status', methods=['GET'])
+def status():
+    """获取 Agent 状态"""
+    response_data, status_code = build_status_payload()
+    response = jsonify(response_data)
+    # 添加防缓存头
+    response.headers.update(NO_CACHE_HEADERS)
+    return response, status_code
+
+@app.route('/health', methods=['GET'])
+def health():
+    """健康检查"""
+    return jsonify(build_health_payload("flask"))
+
+# 调试接口的访问令牌；未设置时只允许本机访问
+DEBUG_API_TOKEN = os.getenv("DEBUG_API_TOKEN", "")
+
+def debug_access_allowed(headers, remote_addr):
+    if DEBUG_API_TOKEN:
+        return hmac.compare_digest(headers.get('X-Debug-Token', ''), DEBUG_API_TOKEN)
+    return remote_addr in ('127.0.0.1', '::1')
+
+def build_debug_payload(method, subpath, args, data):
+    """调试接口（Flask 和 ASGI 共用），返回 (数据, HTTP 状态码)；数据为字符串时按纯文本返回
+
+    GET  traces?limit=50              最近请求的摘要
+    GET  traces/<requestId>           单个请求的时间线
+    GET  traces/<requestId>/profile   采样分析结果（折叠栈）
+    GET  profiler                     采样分析器状态
+    POST profiler                     {"count": 1, "threadId": "...", "intervalMs": 5} 开启；{"count": 0} 关闭
+    """
+    if not isinstance(data, dict):
+        raise ValueError("请求体必须是 JSON 对象")
+    parts = [part for part in subpath.split('/') if part]
+    if parts == ['traces'] and method == 'GET':
+        limit = min(max(int(args.get('limit', 50)), 1), trace_store.max_traces)
+        return {"success": True, "traces": trace_store.recent(limit)}, 200
+    if len(parts) in (2, 3) and parts[0] == 'traces' and method == 'GET':
+        trace = trace_store.get(parts[1])
+        if trace is None:
+            return {"success": False, "error": "追踪记录不存在或已被淘汰"}, 404
+        if len(parts) == 2:
+            return {"success": True, "trace": trace.to_dict()}, 200
+        if parts[2] == 'profile':
+            if trace.profile is None:
+                return {"success": False, "error": "该请求没有采样分析数据"}, 404
+            return collapsed_stacks(trace.profile), 200
+    if parts == ['profiler']:
+        if method == 'POST':
+            profiler_control.arm(
+                count=data.get('count', 1),
+                thread_id=data.get('threadId'),
+                interval_ms=data.get('intervalMs', 5),
+            )
+        return {"success": True, "profiler": profiler_control.status()}, 200
+    return {"success": False, "error": "Not Found"}, 404
+
+@app.route('/api/debug/<path:subpath>', methods=['GET', 'POST'])
+def debug_api(subpath):
+    """执行追踪与采样分析"""
+    if not debug_access_allowed(request.headers, request.remote_addr):
+        return jsonify({"success": False, "error": "无权访问调试接口"}), 403
+    try:
+        payload, status_code = build_debug_payload(
+            request.method, subpath, request.args, request.get_json(silent=True) or {}
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    if isinstance(payload, str):
+        return Response(payload, status=status_code, mimetype='text/plain')
+    response = jsonify(payload)
+    response.headers.update(NO_CACHE_HEADERS)
+    return response, status_code
+
+def run_prefork_server(asgi):
+    """生产模式：SERVICE_WORKERS 个 pre-fork 工作进程共用端口，对话检查点放在共享的 SQLite 中"""
+    import prefork
+    if asgi:
+        try:
+            import uvicorn  # noqa: F401
+        except ImportError:
+            logger.warning("⚠️ 未安装 uvicorn，工作进程使用 Flask")
+            asgi = False
+    serve = prefork.asgi_server("ai_asgi:app", log_level="info") if asgi else prefork.wsgi_server(app)
+    # 主进程只在 fork 之前发布各暂存目录的残留文件，不启动发布线程；
+    # 也不更新搜索索引（SQLite 连接不能跨 fork 使用），发布的文件由文件服务的监听同步到索引
+    commit_queue.recover(notify=False)
+
+    def on_worker_start(index):
+        # 每个工作进程使用自己的暂存目录和发布线程，并发布该序号上次退出前残留的暂存文件
+        commit_queue.start()
+        # ASGI 模式的预热在 ai_asgi 的 lifespan 中进行
+        if AGENT_WARMUP and not asgi:
+            start_warmup()
+    logger.info("⚡ 运行模式: %s × %d 个工作进程", "ASGI" if asgi else "Flask", SERVICE_WORKERS)
+    prefork.run(serve, '0.0.0.0', 5005, on_worker_start=on_worker_start)
+
+def run_asgi_server():
+    """以 ASGI 模式启动（单个事件循环承载所有 SSE 流），缺少 uvicorn 时返回 False"""
+    try:
+        import uvicorn
+    except ImportError:
+        logger.warning("⚠️ 未安装 uvicorn，回退到 Flask 模式")
+        return False
+    logger.info("⚡ 运行模式: ASGI (uvicorn + 共享事件循环)")
+    uvicorn.run("ai_asgi:app", host='0.0.0.0', port=5005, log_level="info")
+    return True
 
 if __name__ == '__main__':
-    print("🤖 LangGraph AI Agent 服务启动中...")
-    print("📍 服务地址: http://localhost:5005")
-    print("🏗️ 架构: app.py (LangGraph Agent) + ai_service.py (Flask API)")
-    print("🔧 功能: 智能 Agent 对话 (流式) + 工具调用")
-    print("🛠️ 工具: 文档读取、文件写入、页面分析")
-    app.run(debug=True, host='0.0.0.0', port=5005)
\ No newline at end of file
+    logger.info("🤖 LangGraph AI Agent 服务启动中...")
+    logger.info("📍 服务地址: http://localhost:5005")
+    logger.info("🏗️ 架构: app.py (LangGraph Agent) + ai_service.py (Flask API)")
+    logger.info("🔧 功能: 智能 Agent 对话 (流式) + 工具调用")
+    logger.info("🛠️ 工具: 文档读取、文件写入、页面分析")
+    # AI_SERVER_MODE=asgi 时使用 ASGI 模式，否则使用 Flask；SERVICE_WORKERS > 1 时启动多个工作进程
+    asgi_mode = os.getenv("AI_SERVER_MODE", "flask").lower() == "asgi"
+    if SERVICE_WORKERS > 1:
+        run_prefork_server(asgi_mode)
+    elif not asgi_mode or not run_asgi_server():
+        logger.info("🌶️ 运行模式: Flask")
+        # debug 模式下 werkzeug 的父进程只负责重载，只在实际处理请求的子进程中启动后台任务
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            commit_queue.start()
+            if AGENT_WARMUP:
+                start_warmup(port=5005)
+        app.run(debug=True, host='0.0.0.0', port=5005)
\ No newline at end of file
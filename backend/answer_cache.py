@@ -0,0 +1,118 @@
+"""
+回答缓存（默认关闭，ANSWER_CACHE_ENABLED=1 开启）
+
+很多用户会在同一篇热门笔记上问同样的问题。缓存键为 (归一化的问题, 文档路径, 文档内容哈希)：
+- 文档内容变化后哈希随之变化，旧回答不会再命中，并在下次查询该文档时被清理
+- 只缓存对话的第一个问题，且该会话此前没有历史：后续问题往往依赖上下文
+- 只缓存只读取笔记（read_doc_file / search_notes）的回答：写文件等有副作用的回答、
+  依赖联网搜索和网页内容的回答不缓存
+- LRU + TTL，条目数有上限
+
+命中时回答按正常的流式输出路径发给前端（同样的 SSE 帧格式），并写入会话历史，追问时上下文完整。
+缓存在进程内，多进程部署时各工作进程各自缓存。
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from doc_cache import document_cache, resolve_doc_path
+from metrics import Counter
+from search_cache import normalize_query
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "0") == "1"
+
+# 这些工具只读取笔记，调用过它们的回答可以缓存
+CACHEABLE_TOOLS = frozenset({'read_doc_file', 'search_notes'})
+
+ANSWER_CACHE_REQUESTS = Counter(
+    'chat_answer_cache_total',
+    '回答缓存的查询结果：hit、miss、stored（写入）或 skipped（回答不可缓存）',
+    ['result'],
+)
+
+
+class AnswerCache:
+    """按文档版本失效的回答缓存"""
+
+    def __init__(self, max_entries=256, ttl_seconds=24 * 3600, max_answer_chars=20000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_answer_chars = max_answer_chars
+        # 键 -> (过期时间, 回答)
+        self._entries = OrderedDict()
+        # 文档路径 -> 最近见到的内容哈希，哈希变化时清理该文档修改前的回答
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key_for(self, question, page_path):
+        """返回缓存键；文档不存在或无法读取时返回 None（不缓存）"""
+        if not page_path or not question:
+            return None
+        try:
+            doc = document_cache.get(resolve_doc_path(page_path))
+        except (OSError, UnicodeDecodeError):
+            return None
+        return normalize_query(question), doc.path, doc.content_hash
+
+    def _purge_versions(self, doc_path, content_hash):
+        """文档内容已变化：删除该文档旧版本上的全部回答"""
+        previous = self._versions.get(doc_path)
+        self._versions[doc_path] = content_hash
+        if previous is None or previous == content_hash:
+            return
+        for key in [k for k in self._entries if k[1] == doc_path and k[2] != content_hash]:
+            del self._entries[key]
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            self._purge_versions(key[1], key[2])
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                ANSWER_CACHE_REQUESTS.labels(result='hit').inc()
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+        ANSWER_CACHE_REQUESTS.labels(result='miss').inc()
+        return None
+
+    def put(self, key, answer):
+        if not answer or len(answer) > self.max_answer_chars:
+            ANSWER_CACHE_REQUESTS.labels(result='skipped').inc()
+            return
+        with self._lock:
+            self._purge_versions(key[1], key[2])
+            self._entries[key] = (time.time() + self.ttl_seconds, answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        ANSWER_CACHE_REQUESTS.labels(result='stored').inc()
+
+    def skip(self):
+        """记录一次不可缓存的回答"""
+        ANSWER_CACHE_REQUESTS.labels(result='skipped').inc()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'enabled': ANSWER_CACHE_ENABLED,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+answer_cache = AnswerCache(
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "256")),
+    ttl_seconds=int(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600))),
+)
@@ -1,22 +1,28 @@
 import os 
 import sys
 import asyncio
-import requests
+import threading
 import time
-from bs4 import BeautifulSoup
 import json
+import logging
+import socket
+import uuid
 from typing import List, Dict, Any, Generator
-from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
-from langchain_tavily import TavilySearch
-from tavily import TavilyClient
-from langchain.agents import initialize_agent, Tool
+# langgraph、通义千问、Tavily、requests/lxml 等较重的依赖在 build_agent() 和工具内部按需导入，
+# 导入本模块（例如只为了响应 /health）不需要付出这些开销
 from langchain_core.tools import tool
-from langchain.schema import HumanMessage
-from langgraph.prebuilt import create_react_agent
-from langchain_community.chat_models.tongyi import ChatTongyi
-from langgraph.checkpoint.memory import MemorySaver
-import os
+from langchain_core.runnables import RunnableConfig
 from dotenv import load_dotenv
+from doc_cache import document_cache, resolve_doc_path, select_sections
+from search_index import BASE_DIR, WORKSPACE_ROOTS, get_search_index
+from commit_queue import CommitQueue
+from sse_framing import FrameCoalescer, coalesce_threadsafe
+from service_log import get_logger, RateSampler
+from agent_metrics import StreamRecorder, tool_metrics_callback
+from tracing import TraceCallback, profiler_control, trace_store
+from answer_cache import ANSWER_CACHE_ENABLED, CACHEABLE_TOOLS, answer_cache
+from cancellation import run_registry, token_from_config
+from admission import CHAT_RUN_TIMEOUT_SECONDS, RunTimeout, run_deadline, tool_timeout, with_deadline
 
 
 
@@ -25,119 +31,82 @@ from dotenv import load_dotenv
 # 加载环境变量
 load_dotenv()
 
-# 初始化模型
-llm = ChatTongyi(api_key=os.getenv("DASHSCOPE_API_KEY"), model_name="qwen-max")
-tavily_client = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+logger = get_logger("agent")
+
+# read_doc_file 默认返回的最大 token 数
+DOC_READ_MAX_TOKENS = int(os.getenv("DOC_READ_MAX_TOKENS", "2000"))
 
 @tool
-def read_doc_file(file_path: str):
-    """读取用户当前观看文档的完整路径。"""
-    import os
-    import urllib.parse
+def read_doc_file(file_path: str, question: str = "", heading: str = "", full: bool = False):
+    """读取用户当前观看的文档。
+    file_path: 文档路径；question: 用户的问题，用于只返回相关章节；
+    heading: 只返回指定标题下的章节；full: 为 True 时返回完整文档（仅在确实需要全文时使用）。"""
+    full_path = resolve_doc_path(file_path)
+    logger.debug("当前用户浏览的文档完整路径：%s", full_path)
     
-    # URL 解码
     try:
-        decoded_path = urllib.parse.unquote(file_path)
+        doc = document_cache.get(full_path)
+    except FileNotFoundError:
+        return f"❌ 文件未找到：{full_path}"
     except Exception as e:
-        print(f"URL解码失败: {e}")
-        decoded_path = file_path
-    
-    # 去除首尾空格
-    decoded_path = decoded_path.strip()
-    
-    # 处理不同的路径格式，提取实际文档路径
-    if decoded_path.startswith('/docs/'):
-        doc_path = decoded_path[6:]  # 去掉 '/docs/'
-    elif decoded_path.startswith('docs/'):
-        doc_path = decoded_path[5:]  # 去掉 'docs/'
-    else:
-        doc_path = decoded_path  # 直接是文件名
-    
-    # 去除可能的尾部斜杠
-    doc_path = doc_path.rstrip('/')
-    
-    # 构建完整路径
-    full_path = "../docs/" + doc_path
-    # 如果没有扩展名，添加 .md
-    if not full_path.endswith('.md'):
-        full_path += '.md'
-    
-    print(f"当前用户浏览的文档完整路径：{full_path}")
-    
+        return f"❌ 读取文件时出错：{str(e)}"
+
+    if full or doc.tokens <= DOC_READ_MAX_TOKENS:
+        return f"文件内容：\n\n{doc.content}"
+
+    texts, partial = select_sections(doc, question=question, heading=heading, max_tokens=DOC_READ_MAX_TOKENS)
+    if heading and not texts:
+        return f"未找到标题“{heading}”。文档大纲：\n" + "\n".join(doc.outline())
+    result = "文件内容（节选）：\n\n" + "\n\n".join(texts)
+    if partial:
+        result += "\n\n文档大纲（可通过 heading 参数读取其他章节，或 full=True 读取全文）：\n" + "\n".join(doc.outline())
+    return result
+
+@tool
+def search_notes(query: str, limit: int = 5):
+    """在知识库（docs 和 blog 中的笔记）里全文搜索，返回最相关的文档路径和摘要。"""
     try:
-        with open(full_path, "r") as f:
-            content = f.read()
-            return f"文件内容：\n\n{content}"
-    except FileNotFoundError:
-        return f"文件未找到：{full_path}"
+        results = get_search_index().search(query, limit=min(max(int(limit), 1), 20))
     except Exception as e:
-        return f"读取文件时出错：{str(e)}"
+        return f"❌ 搜索知识库时出错：{str(e)}"
+    if not results:
+        return f"知识库中没有找到与“{query}”相关的笔记"
+    lines = [f"知识库中与“{query}”相关的笔记："]
+    for i, item in enumerate(results, 1):
+        lines.append(f"{i}. [{item['title']}] {item['workspace']}/{item['path']}\n   {item['snippet']}")
+    lines.append("（docs 中的笔记可以用 read_doc_file 读取详细内容）")
+    return "\n".join(lines)
+
+def _on_files_committed(paths):
+    index = get_search_index()
+    for path in paths:
+        index.update_path('docs', path)
+
+# Agent 写入的文件先暂存，本轮对话结束后统一发布到 docs/（避免回复过程中触发页面热更新）
+commit_queue = CommitQueue(
+    staging_dir=os.path.join(BASE_DIR, "temp_docs"),
+    target_dir=WORKSPACE_ROOTS['docs'],
+    on_commit=_on_files_committed,
+    max_delay=float(os.getenv("WRITE_COMMIT_MAX_DELAY", "60")),
+)
 
 @tool
-def write_file(file_name: str, content: str):
+def write_file(file_name: str, content: str, config: RunnableConfig):
     """创建或修改Markdown文件"""
-    import os
-    import threading
-    import time
-    
     try:
         # 确保文件名有.md扩展名
         if not file_name.endswith('.md'):
             file_name += '.md'
         
-        # 创建临时目录
-        temp_dir = "../temp_docs"
-        if not os.path.exists(temp_dir):
-            os.makedirs(temp_dir, exist_ok=True)
-        
-        # 先写入临时目录
-        temp_path = os.path.join(temp_dir, file_name)
-        
-        # 确保临时目录的子目录存在
-        temp_dir_path = os.path.dirname(temp_path)
-        if temp_dir_path and temp_dir_path != temp_dir and not os.path.exists(temp_dir_path):
-            os.makedirs(temp_dir_path, exist_ok=True)
-            print(f"📁 创建临时目录: {temp_dir_path}")
-        
-        # 写入临时文件
-        with open(temp_path, 'w', encoding='utf-8') as f:
-            f.write(content)
-        
-        print(f"📝 文件已写入临时目录: {temp_path}")
-        
-        # 定义延迟移动函数
-        def delayed_move():
-            try:
-                # 等待8秒，确保AI回复完成
-                time.sleep(8)
-                
-                # 构建最终路径
-                final_path = os.path.join("../docs", file_name)
-                final_dir_path = os.path.dirname(final_path)
-                
-                # 确保最终目录存在
-                if final_dir_path and not os.path.exists(final_dir_path):
-                    os.makedirs(final_dir_path, exist_ok=True)
-                    print(f"📁 创建最终目录: {final_dir_path}")
-                
-                # 移动文件到最终位置
-                import shutil
-                shutil.move(temp_path, final_path)
-                print(f"✅ 文件已移动到最终位置: {final_path}")
-                
-            except Exception as e:
-                print(f"❌ 延迟移动文件时出错: {str(e)}")
-        
-        # 启动后台线程进行延迟移动
-        move_thread = threading.Thread(target=delayed_move, daemon=True)
-        move_thread.start()
+        thread_id = config.get("configurable", {}).get("thread_id") or DEFAULT_THREAD_ID
+        size = commit_queue.stage(thread_id, file_name, content)
+        logger.info("📝 文件已暂存: %s", file_name, fields={"thread_id": thread_id})
         
-        # 立即返回成功信息（此时文件还在临时目录）
         final_path = os.path.join("../docs", file_name)
-        temp_file_size = os.path.getsize(temp_path)
-        
-        return f"✅ 文件创建成功！\n📄 文件名: {file_name}\n📍 路径: {final_path}\n📊 大小: {temp_file_size} 字节\n💾 编码: UTF-8\n\n💡 提示：文件将在几秒后出现在文档目录中，避免打断当前对话。"
+        return f"✅ 文件创建成功！\n📄 文件名: {file_name}\n📍 路径: {final_path}\n📊 大小: {size} 字节\n💾 编码: UTF-8\n\n💡 提示：文件将在本轮回复结束后出现在文档目录中，避免打断当前对话。"
         
+    except ValueError as e:
+        return f"❌ {str(e)}"
     except PermissionError:
         return f"❌ 权限错误：无法写入文件 {file_name}，请检查文件权限"
     except FileNotFoundError:
@@ -149,50 +118,26 @@ def write_file(file_name: str, content: str):
 
 
 @tool
-def extract_webpage_content(url):
+def extract_webpage_content(url, config: RunnableConfig):
     """
     提取网页内容的工具函数
     """
-    try:
-        # 设置请求头
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'zh-CN,zh;q=0.9',
-            'Connection': 'keep-alive'
-        }
-        
-        # 发送请求
-        response = requests.get(url, headers=headers, allow_redirects=True, timeout=15)
-        response.raise_for_status()
-        
-        # 解析HTML
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # 移除无用标签
-        for tag in soup(["script", "style", "nav", "footer", "header"]):
-            tag.decompose()
-        
-        # 提取文本内容
-        text_content = soup.get_text()
-        lines = (line.strip() for line in text_content.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        content = ' '.join(chunk for chunk in chunks if chunk)
-        
-        return content
-        
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e),
-            'url': url
-        }
+    import web_extract
 
+    # 客户端断开、本轮运行被取消时中止下载
+    return web_extract.extract_webpage_content(url, cancel_token=token_from_config(config))
 
-search = TavilySearch(max_results=2)
 
-# 初始化内存和工具
-memory = MemorySaver()
+@tool
+async def extract_webpages(urls: List[str], config: RunnableConfig):
+    """同时提取多个网页的内容（用户一次给出多个网址时使用），按完成顺序返回每个网址的结果"""
+    import web_extract
+
+    results = []
+    async for result in web_extract.extract_many(urls, cancel_token=token_from_config(config)):
+        results.append(result)
+    return results
+
 
 # 更新提示词，减少对页面上下文的过度关注
 prompt = """
@@ -203,26 +148,63 @@ prompt = """
 2. ✍️ 创建和修改文件（当用户需要时）
 3. 🌐 提取和分析网页内容（当用户询问某个网址的内容时）
 4. 🔍 搜索互联网信息
-5. 💬 进行自然、友好的对话
-6. 💡 提供有用的建议和信息
+5. 🗂️ 搜索知识库中的笔记
+6. 💬 进行自然、友好的对话
+7. 💡 提供有用的建议和信息
 
 请自然地与用户对话，根据用户的具体需求来决定是否使用工具：
-- 只有当用户明确询问文档内容或需要查看特定文件时，才使用 read_doc_file 工具
+- 只有当用户明确询问文档内容或需要查看特定文件时，才使用 read_doc_file 工具（传入用户的问题以只读取相关章节）
 - 只有当用户明确要求创建或修改文件时，才使用 write_file 工具
-- 当用户询问某个具体网址的内容时，使用 extract_webpage_content 工具
+- 当用户询问某个具体网址的内容时，使用 extract_webpage_content 工具；同时给出多个网址时，使用 extract_webpages 工具一次性提取
 - 当用户需要搜索信息时，使用 search 工具
+- 当用户询问知识库/笔记里有没有某方面的内容时，使用 search_notes 工具
 - 对于一般性的问候、闲聊或咨询，请直接友好地回应
 
 保持对话自然流畅，不要主动提及技术细节或页面信息，除非用户特别询问。
 """
 
-tools = [read_doc_file, write_file, search, extract_webpage_content]
-agent = create_react_agent(llm, tools, checkpointer=memory, prompt=prompt)
+def create_chat_model():
+    """构建对话模型（离线基准测试在 benchmarks/fake_ai_service.py 中替换为 FakeChatModel）"""
+    from langchain_community.chat_models.tongyi import ChatTongyi
+    return ChatTongyi(api_key=os.getenv("DASHSCOPE_API_KEY"), model_name="qwen-max")
+
+def build_agent():
+    """构建模型、工具和 ReAct Agent，返回 (agent, checkpointer)；首次使用时才调用"""
+    from langgraph.prebuilt import create_react_agent
+    from checkpoint_store import create_checkpointer
+    from search_cache import create_cached_search
+    from history_compaction import HISTORY_COMPACTION, CompactedAgentState, HistoryCompactor, with_summary
 
-# 全局配置
-config = {"configurable": {"thread_id": "unique_thread_id"}}
+    llm = create_chat_model()
+    # 相同/近似的查询在 TTL 内直接复用结果，并发的相同查询只请求一次
+    search = create_cached_search(max_results=2, deadline=tool_timeout('tavily_search'))
+    # 按会话隔离的对话记忆，容量/TTL 有上限，可选 SQLite 落盘
+    memory = create_checkpointer()
+    # 每个工具有执行期限，超时作为工具错误返回给模型（搜索工具自带期限，原样返回）
+    tools = [with_deadline(t) for t in (read_doc_file, search_notes, write_file, search, extract_webpage_content, extract_webpages)]
+    if not HISTORY_COMPACTION:
+        return create_react_agent(llm, tools, checkpointer=memory, prompt=prompt), memory
+    # 每次调用模型前截断陈旧的工具输出，超出预算时把较早的轮次压缩成摘要（放进系统提示）
+    agent = create_react_agent(
+        llm, tools, checkpointer=memory,
+        prompt=with_summary(prompt),
+        pre_model_hook=HistoryCompactor(summarizer=llm),
+        state_schema=CompactedAgentState,
+    )
+    return agent, memory
 
-from typing import List, Dict
+# 未提供会话 ID 时使用的默认线程
+DEFAULT_THREAD_ID = "default"
+
+def build_thread_config(thread_id: str = None, request_id: str = None) -> Dict:
+    """为指定会话构建 LangGraph 配置（附带工具调用指标回调）；request_id 供历史压缩等步骤关联执行追踪"""
+    configurable = {"thread_id": thread_id or DEFAULT_THREAD_ID}
+    if request_id:
+        configurable["request_id"] = request_id
+    return {
+        "configurable": configurable,
+        "callbacks": [tool_metrics_callback],
+    }
 
 class WebsiteAgent:
     """网站智能助手包装类"""
@@ -231,20 +213,33 @@ class WebsiteAgent:
         """
         初始化智能助手
         
-        Args:
+        Attributes:
             agent: 智能助手实例
-            config: 配置对象
+            checkpointer: 会话检查点存储
         """
-        self.agent = agent
-        self.config = config
+        self.agent, self.checkpointer = build_agent()
     
-    async def chat_stream_async(self, messages: List[Dict], page_path: str = None):
-        """异步流式聊天接口"""
+    async def chat_stream_async(self, messages: List[Dict], page_path: str = None, thread_id: str = None,
+                                request_id: str = None):
+        """异步流式聊天接口，thread_id 用于隔离不同客户端的对话历史，request_id 用于关联日志和执行追踪"""
+        request_id = request_id or uuid.uuid4().hex[:12]
+        log = logger.bind(request_id=request_id, thread_id=thread_id or DEFAULT_THREAD_ID)
+        # 逐块的调试日志按请求限速，避免刷屏
+        sampler = RateSampler()
+        recorder = StreamRecorder()
+        trace = trace_store.start(request_id, thread_id or DEFAULT_THREAD_ID,
+                                  str(messages[-1].get("content", "")) if messages else "")
+        profiler = profiler_control.claim(thread_id or DEFAULT_THREAD_ID)
+        # 工具通过 config 中的 request_id 找到本次运行的取消标记
+        cancel_token = run_registry.start(request_id)
+        # 客户端中途断开时生成器被关闭（或协程被取消），状态保持 aborted
+        status = 'aborted'
         try:
             # 检查消息列表是否为空
             if not messages:
                 error_msg = "❌ 消息列表为空"
-                print(error_msg)
+                status = 'error'
+                log.warning(error_msg)
                 yield error_msg
                 return
             
@@ -258,127 +253,219 @@ class WebsiteAgent:
                 user_input_with_context = user_input
             
             # 记录请求信息
-            print(f"🤖 Agent 处理请求：{user_input[:50]}...")
-            
-            if page_path:
-                print(f"📍 文档路径：{page_path}")
+            log.info("🤖 Agent 处理请求：%s...", user_input[:50], fields={"page_path": page_path})
     
             input_message = {
                 "role": "user",
                 "content": user_input_with_context,
             }
     
-            print("🔄 开始流式处理...")
             has_output = False
-            tool_called = set()  # 记录已调用的工具，避免重复提示
+            chunk_count = 0
+            started = time.perf_counter()
+            config = build_thread_config(thread_id, request_id)
+            config["callbacks"] = config["callbacks"] + [TraceCallback(trace)]
+
+            # 回答缓存只用于对话的第一个问题（请求中只有这一条消息，会话也没有历史）
+            cache_key = answer_cache.key_for(user_input, page_path) if ANSWER_CACHE_ENABLED and len(messages) == 1 else None
+            if cache_key is not None and (await self.agent.aget_state(config)).values.get("messages"):
+                cache_key = None
+            if cache_key is not None:
+                cached = answer_cache.get(cache_key)
+                if cached is not None:
+                    trace.event('answer_cache', result='hit')
+                    log.info("♻️ 命中回答缓存", fields={"page_path": page_path})
+                    # 写入会话历史，追问时模型能看到这轮问答
+                    await self.agent.aupdate_state(
+                        config,
+                        {"messages": [input_message, {"role": "assistant", "content": cached}]},
+                        as_node="agent",
+                    )
+                    recorder.on_text(cached)
+                    has_output = True
+                    yield cached
+                    status = 'ok'
+                    return
+            answer_parts = []
+            tools_used = set()
             
-            async for chunk_data in self.agent.astream(
+            # 整个运行（全部模型和工具调用）超过期限时停止
+            async for chunk_data in run_deadline(self.agent.astream(
                 {"messages": [input_message]}, 
-                self.config,
+                config,
                 stream_mode="messages"
-            ):
+            ), CHAT_RUN_TIMEOUT_SECONDS):
                 try:
                     # chunk_data 是一个元组：(message, metadata)
                     if isinstance(chunk_data, tuple) and len(chunk_data) == 2:
                         message, metadata = chunk_data
-                        print(f"📦 收到消息: {type(message).__name__}, 元数据: {metadata.get('langgraph_node', 'unknown')}")
                     else:
                         # 如果不是元组，直接当作消息处理
-                        message = chunk_data
-                        print(f"📦 收到消息: {type(message).__name__}")
+                        message, metadata = chunk_data, {}
                     
                     message_type = type(message).__name__
-
+                    log.sampled(sampler, logging.DEBUG, "📦 收到消息: %s, 节点: %s",
+                                message_type, metadata.get('langgraph_node', 'unknown'))
 
                     # 处理AI消息 - 包括AIMessage和AIMessageChunk
                     if message_type in ["AIMessage", "AIMessageChunk"]:
                         if hasattr(message, 'content') and message.content:
-                            print(f"📤 AI回复内容: {repr(message.content)}")
+                            log.sampled(sampler, logging.DEBUG, "📤 AI回复内容: %r", message.content)
+                            if not has_output:
+                                trace.event('first_token', node=metadata.get('langgraph_node'))
+                            recorder.on_text(message.content)
+                            if cache_key is not None:
+                                answer_parts.append(message.content)
                             yield message.content
                             has_output = True
-                        else:
-                            print(f"📤 AI消息无内容: {message}")
+                            chunk_count += 1
                     
                     # 静默处理工具调用 - 不输出任何信息
                     if hasattr(message, 'tool_calls') and message.tool_calls:
                         for tool_call in message.tool_calls:
-                            tool_name = tool_call.get('name', '未知工具')
-                            print(f"🔧 工具调用: {tool_name} (静默处理)")
+                            tools_used.add(tool_call.get('name'))
+                            log.info("🔧 工具调用: %s", tool_call.get('name', '未知工具'))
+                            trace.event('tool_requested', tool=tool_call.get('name'),
+                                        step=metadata.get('langgraph_step'))
                     
                     # 静默跳过工具调用结果
                     if message_type == "ToolMessage":
-                        print(f"🔧 工具调用完成 (静默跳过)")
+                        log.debug("🔧 工具调用完成: %s", getattr(message, 'name', ''))
                         continue
                     
                     # 静默跳过无效的工具调用片段
                     if hasattr(message, 'invalid_tool_calls') and message.invalid_tool_calls:
-                        print("⏭️ 跳过无效工具调用片段 (静默)")
+                        log.sampled(sampler, logging.DEBUG, "⏭️ 跳过无效工具调用片段")
                         continue
                     
                 except Exception as chunk_error:
                     # 处理单个chunk的错误，但不中断整个流程
-                    print(f"⚠️ 处理chunk时出错: {chunk_error}")
+                    log.warning("⚠️ 处理chunk时出错: %s", chunk_error)
                     continue
             
-            print("✅ 流式处理完成")
+            status = 'ok'
+            if cache_key is not None:
+                if has_output and tools_used <= CACHEABLE_TOOLS:
+                    answer_cache.put(cache_key, ''.join(answer_parts))
+                else:
+                    answer_cache.skip()
+            log.info("✅ 流式处理完成", fields={
+                "chunks": chunk_count,
+                "duration_ms": round((time.perf_counter() - started) * 1000),
+                "prompt_tokens_saved": trace.prompt_tokens_saved(),
+            })
             
             # 如果没有输出，提供默认响应
             if not has_output:
-                print("⚠️ 没有收到任何有效输出，提供默认响应")
+                log.warning("⚠️ 没有收到任何有效输出，提供默认响应")
                 default_response = "你好！我收到了你的消息。有什么可以帮助你的吗？"
                 yield default_response
                 
+        except RunTimeout:
+            status = 'timeout'
+            trace.event('timeout', seconds=CHAT_RUN_TIMEOUT_SECONDS)
+            log.warning("⏱️ 运行超过 %gs，已停止", CHAT_RUN_TIMEOUT_SECONDS)
+            yield f"\n\n⏱️ 抱歉，这个问题处理时间过长（超过 {CHAT_RUN_TIMEOUT_SECONDS:g} 秒），已停止。可以把问题拆小一些再试。"
         except Exception as e:
             error_msg = f"❌ Agent 执行错误：{str(e)}"
-            print(error_msg)
-            import traceback
-            print(f"🔍 详细错误信息：{traceback.format_exc()}")
+            status = 'error'
+            trace.event('error', error=str(e)[:200])
+            log.exception(error_msg)
             yield error_msg
+        finally:
+            recorder.finish(status)
+            # 被中止时取消进行中的工具请求，并记录取消时所处的阶段和估算节省的模型时间
+            cancelled = run_registry.finish(request_id, cancel_token, trace, status)
+            if cancelled is not None:
+                trace.event('cancelled', **cancelled)
+                log.info("🛑 客户端已断开，运行已取消", fields=cancelled)
+            if profiler is not None:
+                # 不在共享的事件循环上等待采样线程退出，结果稍后由采样线程写入
+                profiler.stop(on_done=lambda profile: setattr(trace, 'profile', profile))
+            trace.finish(status)
+            # 本轮回复结束（包括出错或客户端断开），发布暂存的文件
+            commit_queue.flush(thread_id or DEFAULT_THREAD_ID)
 
     
-    def chat_stream(self, messages: List[Dict], page_path: str = None) -> Generator[str, None, None]:
-        """同步包装器"""
-        print(f"🔄 chat_stream 接收到参数:")
-        print(f"  - messages数量: {len(messages)}")
-        print(f"  - page_path: {repr(page_path)}")
-        
-        import asyncio
-        
-        async def async_generator():
-            async for chunk in self.chat_stream_async(messages, page_path):
-                yield chunk
-        
-        # 运行异步生成器
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+    def chat_stream(self, messages: List[Dict], page_path: str = None, thread_id: str = None,
+                    coalescer: FrameCoalescer = None, request_id: str = None,
+                    is_disconnected=None) -> Generator[str, None, None]:
+        """同步包装器；传入 coalescer 时产出按时间窗口合并后的文本帧，
+        同时传入 is_disconnected 时在客户端断开后立即停止，不必等到下一次写入失败"""
+        # 在共享的后台事件循环中驱动异步生成器，而不是每个请求新建一个事件循环
+        loop = get_background_loop()
+        async_gen = self.chat_stream_async(messages, page_path, thread_id, request_id)
+        if coalescer is not None:
+            yield from coalesce_threadsafe(async_gen, loop, coalescer, is_disconnected)
+            return
         try:
-            async_gen = async_generator()
             while True:
                 try:
-                    chunk = loop.run_until_complete(async_gen.__anext__())
+                    chunk = asyncio.run_coroutine_threadsafe(async_gen.__anext__(), loop).result()
                     yield chunk
                 except StopAsyncIteration:
                     break
         finally:
-            loop.close()
+            asyncio.run_coroutine_threadsafe(async_gen.aclose(), loop).result()
     
 
-# 全局 Agent 实例
+# 同步调用方（Flask）共享的后台事件循环
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    """获取在守护线程中常驻运行的事件循环"""
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="agent-loop", daemon=True).start()
+            _background_loop = loop
+    return _background_loop
+
+# 全局 Agent 实例（首次使用时构建）
 _agent_instance = None
+_agent_instance_lock = threading.Lock()
 
 def get_agent_instance() -> WebsiteAgent:
-    """获取 Agent 单例实例"""
+    """获取 Agent 单例实例；并发的首次调用只构建一次"""
     global _agent_instance
     if _agent_instance is None:
-        _agent_instance = WebsiteAgent()
+        with _agent_instance_lock:
+            if _agent_instance is None:
+                started = time.perf_counter()
+                _agent_instance = WebsiteAgent()
+                logger.info("🤖 Agent 初始化完成，耗时 %.2fs", time.perf_counter() - started)
     return _agent_instance
 
-def chat_with_agent(messages: List[Dict], page_path: str = None) -> Generator[str, None, None]:
+def agent_ready() -> bool:
+    return _agent_instance is not None
+
+def start_warmup(port: int = None, timeout: float = 30.0):
+    """后台预热：等服务端口可以连接后构建 Agent 并加载网页提取依赖，首个聊天请求不再承担初始化开销"""
+    def run():
+        if port:
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+        try:
+            get_agent_instance()
+            import web_extract  # noqa: F401
+        except Exception as e:
+            logger.warning("⚠️ Agent 预热失败，将在首次请求时重试: %s", e)
+
+    thread = threading.Thread(target=run, name="agent-warmup", daemon=True)
+    thread.start()
+    return thread
+
+def chat_with_agent(messages: List[Dict], page_path: str = None, thread_id: str = None,
+                    coalescer: FrameCoalescer = None, request_id: str = None,
+                    is_disconnected=None) -> Generator[str, None, None]:
     """与 Agent 聊天的便捷接口"""
-    print(f"🎯 chat_with_agent 接收到参数:")
-    print(f"  - messages数量: {len(messages)}")
-    print(f"  - page_path: {repr(page_path)}")
-    
     agent_instance = get_agent_instance()
-    return agent_instance.chat_stream(messages, page_path)
+    return agent_instance.chat_stream(messages, page_path, thread_id, coalescer, request_id, is_disconnected)
 
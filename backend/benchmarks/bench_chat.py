@@ -0,0 +1,293 @@
+"""
+聊天接口压测（离线）
+
+在子进程中启动 fake_ai_service.py（FakeChatModel；搜索和网页由本进程内的 FixtureServer 提供），
+按给定的并发数驱动 /api/chat，每个并发级别统计：
+- 首字延迟（请求发出到收到第一帧内容）和完整回答的耗时
+- 吞吐：每秒完成的请求数、每秒输出的字符数
+- 被拒绝（429 / 503）和出错的请求数
+- 服务进程的常驻内存（起始 / 峰值 / 结束）和每个请求消耗的 CPU 时间
+- FixtureServer 收到的搜索和网页请求数（缓存和单飞的效果）
+
+每个虚拟客户端带不同的 X-Forwarded-For（默认 TRUSTED_PROXIES=127.0.0.1，服务才会采用），每个请求使用新的会话。
+所有请求都来自本机，所以默认关闭按地址限流（CHAT_RATE_LIMIT_PER_MINUTE=0）；其余服务配置（CHAT_MAX_CONCURRENT_RUNS、
+SSE_COALESCE_MS 等）照常从环境变量读取，导出后即可测量对应的效果。
+问题默认各不相同（搜索缓存不会命中），--distinct-questions N 时在 N 个问题中循环。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_chat.py [--mode flask|asgi] [--concurrency 1,8,32] [--requests-per-client 4]
+        [--scenario mixed] [--tokens-per-second 50] [--first-token-ms 300] [--output results.json]
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from fakes import SCENARIOS, TOPICS, FixtureServer, generate_workspace, workspace_paths  # noqa: E402
+from report import DEFAULT_RESULTS_DIR, MemorySampler, process_cpu_seconds, save_results, summarize  # noqa: E402
+
+QUESTION_TEMPLATES = ["如何优化{}中的{}", "{}和{}有什么区别", "介绍一下{}里的{}", "{}遇到{}问题怎么办"]
+
+# 影响压测结果的服务端配置，随结果一起记录
+SERVICE_ENV = (
+    'CHAT_MAX_CONCURRENT_RUNS', 'CHAT_MAX_QUEUE', 'CHAT_QUEUE_TIMEOUT_SECONDS', 'CHAT_RATE_LIMIT_PER_MINUTE',
+    'CHAT_RATE_LIMIT_BURST', 'TRUSTED_PROXIES', 'SSE_COALESCE_MS', 'HISTORY_COMPACTION', 'ANSWER_CACHE_ENABLED',
+    'SEARCH_CACHE_TTL_SECONDS', 'ASGI_EXECUTOR_WORKERS', 'WEB_FETCH_CONCURRENCY',
+)
+
+
+def make_question(index, distinct):
+    k = index % distinct if distinct else index
+    template = QUESTION_TEMPLATES[k % len(QUESTION_TEMPLATES)]
+    question = template.format(TOPICS[k % len(TOPICS)], TOPICS[(k * 7 + 3) % len(TOPICS)])
+    return question if distinct else f"{question}（#{index}）"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def service_env():
+    env = dict(os.environ)
+    env.setdefault('LOG_LEVEL', 'WARNING')
+    env.setdefault('CHAT_RATE_LIMIT_PER_MINUTE', '0')
+    env.setdefault('TRUSTED_PROXIES', '127.0.0.1')
+    return env
+
+
+def start_service(args, env, port, fixtures_url, workspace, log):
+    """启动 fake_ai_service.py，等到 /health 可以访问；返回子进程"""
+    command = [
+        sys.executable, '-W', 'ignore', os.path.join(BENCH_DIR, 'fake_ai_service.py'),
+        '--port', str(port), '--mode', args.mode, '--scenario', args.scenario,
+        '--tokens-per-second', str(args.tokens_per_second), '--first-token-ms', str(args.first_token_ms),
+        '--answer-tokens', str(args.answer_tokens), '--tool-call-ms', str(args.tool_call_ms),
+        '--fixtures-url', fixtures_url, '--workspace', workspace,
+    ]
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.PIPE,
+                               stderr=log, text=True)
+    ready = process.stdout.readline()
+    # 服务日志也写在标准输出上，持续读走，避免管道写满后阻塞服务
+    threading.Thread(target=lambda: [log.write(line) for line in process.stdout], daemon=True).start()
+    if not ready:
+        raise RuntimeError(f"服务启动失败，日志见 {log.name}")
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/health')
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"服务没有在 30 秒内开始监听，日志见 {log.name}")
+
+
+def get_json(port, path):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    connection.request('GET', path)
+    return json.loads(connection.getresponse().read())
+
+
+def chat_request(port, payload, client, timeout):
+    """发出一个聊天请求并读完 SSE 流，返回状态码、首字延迟、耗时、字符数和帧数"""
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    headers = {'Content-Type': 'application/json', 'X-Forwarded-For': client}
+    result = {'status': 0, 'ttft_ms': None, 'chars': 0, 'frames': 0, 'done': False, 'error': None}
+    started = time.perf_counter()
+    try:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+        connection.request('POST', '/api/chat', body, headers)
+        response = connection.getresponse()
+        result['status'] = response.status
+        if response.status != 200:
+            response.read()
+        else:
+            while True:
+                line = response.readline()
+                if not line:
+                    break
+                if not line.startswith(b'data: '):
+                    continue
+                data = line[6:].strip()
+                if data == b'[DONE]':
+                    result['done'] = True
+                    break
+                event = json.loads(data)
+                if 'error' in event:
+                    result['error'] = event['error']
+                    continue
+                content = event.get('content') or ''
+                if content and result['ttft_ms'] is None:
+                    result['ttft_ms'] = (time.perf_counter() - started) * 1000
+                result['chars'] += len(content)
+                result['frames'] += 1
+        connection.close()
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['latency_ms'] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def run_level(port, pid, fixtures, concurrency, args, notes, offset):
+    """以 concurrency 个虚拟客户端发出 concurrency × requests_per_client 个请求"""
+    total = concurrency * args.requests_per_client
+    counter = itertools.count()
+    lock = threading.Lock()
+    results = []
+
+    def client_loop(client_index):
+        client = f"10.{client_index // 65536 % 256}.{client_index // 256 % 256}.{client_index % 256}"
+        while True:
+            with lock:
+                index = next(counter)
+            if index >= total:
+                return
+            request_index = offset + index
+            payload = {
+                'messages': [{'role': 'user', 'content': make_question(request_index, args.distinct_questions)}],
+                'pagePath': '/docs/' + notes[request_index * 7919 % len(notes)][:-3],
+                'threadId': f"bench-{concurrency}-{request_index}",
+            }
+            result = chat_request(port, payload, client, args.timeout)
+            with lock:
+                results.append(result)
+
+    fixture_before = dict(fixtures.counts)
+    cpu_before = process_cpu_seconds(pid)
+    with MemorySampler(pid) as memory:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(client_loop, range(concurrency)))
+        wall = time.perf_counter() - started
+    cpu_after = process_cpu_seconds(pid)
+
+    completed = [r for r in results if r['status'] == 200 and r['done']]
+    rejected = {}
+    for r in results:
+        if r['status'] in (429, 503):
+            rejected[str(r['status'])] = rejected.get(str(r['status']), 0) + 1
+    errors = [r for r in results if r not in completed and r['status'] not in (429, 503)]
+    cpu = (cpu_after - cpu_before) if cpu_before is not None and cpu_after is not None else None
+    return {
+        'concurrency': concurrency,
+        'requests': total,
+        'completed': len(completed),
+        'rejected': rejected,
+        'errors': len(errors),
+        'error_samples': sorted({r['error'] or f"HTTP {r['status']}" for r in errors})[:5],
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(len(completed) / wall, 3) if wall else 0,
+        'output_chars_per_second': round(sum(r['chars'] for r in completed) / wall, 1) if wall else 0,
+        'ttft_ms': summarize([r['ttft_ms'] for r in completed if r['ttft_ms'] is not None]),
+        'latency_ms': summarize([r['latency_ms'] for r in completed]),
+        'rejected_latency_ms': summarize([r['latency_ms'] for r in results if r['status'] in (429, 503)]),
+        'frames_per_answer': round(sum(r['frames'] for r in completed) / len(completed), 1) if completed else 0,
+        'server': {
+            **memory.to_dict(),
+            'cpu_seconds': round(cpu, 3) if cpu is not None else None,
+            'cpu_ms_per_request': round(cpu * 1000 / len(results), 2) if cpu is not None and results else None,
+        },
+        'fixtures': {kind: fixtures.counts[kind] - fixture_before[kind] for kind in fixtures.counts},
+    }
+
+
+def print_level(level):
+    ttft, latency = level['ttft_ms'], level['latency_ms']
+    rejected = sum(level['rejected'].values())
+    print(f"{level['concurrency']:>6}{level['requests']:>8}{level['completed']:>8}{rejected:>8}{level['errors']:>8}"
+          f"{level['throughput_rps']:>10.2f}{level['output_chars_per_second']:>10.0f}"
+          f"{ttft.get('p50', 0):>10.0f}{ttft.get('p95', 0):>10.0f}"
+          f"{latency.get('p50', 0):>10.0f}{latency.get('p95', 0):>10.0f}"
+          f"{level['server']['rss_peak_mb'] or 0:>10.1f}{level['server']['cpu_ms_per_request'] or 0:>10.1f}")
+    for sample in level['error_samples']:
+        print(f"        ⚠️ {sample}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=('flask', 'asgi'), default='flask')
+    parser.add_argument('--concurrency', default='1,8,32', help='逗号分隔的并发数，依次测量')
+    parser.add_argument('--requests-per-client', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=3, help='正式测量前的预热请求数（不计入结果）')
+    parser.add_argument('--scenario', choices=SCENARIOS, default='mixed')
+    parser.add_argument('--tokens-per-second', type=float, default=50)
+    parser.add_argument('--first-token-ms', type=float, default=300)
+    parser.add_argument('--answer-tokens', type=int, default=120)
+    parser.add_argument('--tool-call-ms', type=float, default=200)
+    parser.add_argument('--search-latency-ms', type=float, default=150)
+    parser.add_argument('--page-latency-ms', type=float, default=80)
+    parser.add_argument('--sites', type=int, default=8, help='搜索结果中的网页分布在多少个站点上')
+    parser.add_argument('--notes', type=int, default=500, help='生成的笔记数（notes 场景读取和搜索）')
+    parser.add_argument('--distinct-questions', type=int, default=0, help='大于 0 时在这么多个问题中循环')
+    parser.add_argument('--timeout', type=float, default=180, help='单个请求的客户端超时（秒）')
+    parser.add_argument('--output', help=f'结果文件，默认写到 {DEFAULT_RESULTS_DIR}')
+    args = parser.parse_args()
+    levels = [int(value) for value in args.concurrency.split(',') if value.strip()]
+
+    work_dir = tempfile.mkdtemp(prefix='bench-chat-')
+    workspace = os.path.join(work_dir, 'workspace')
+    generate_workspace(workspace, args.notes)
+    notes = list(workspace_paths(args.notes))
+    fixtures = FixtureServer(search_latency_ms=args.search_latency_ms, page_latency_ms=args.page_latency_ms,
+                             sites=args.sites).start()
+    port = free_port()
+    log = open(os.path.join(work_dir, 'service.log'), 'w')
+    env = service_env()
+    process = start_service(args, env, port, fixtures.url, workspace, log)
+    try:
+        for index in range(args.warmup):
+            chat_request(port, {
+                'messages': [{'role': 'user', 'content': f"预热 {index}"}],
+                'pagePath': '/docs/' + notes[0][:-3],
+                'threadId': f"bench-warmup-{index}",
+            }, '10.255.255.255', args.timeout)
+
+        print(f"模式 {args.mode}，场景 {args.scenario}，每个客户端 {args.requests_per_client} 个请求，"
+              f"模型 {args.tokens_per_second:g} token/s、首字 {args.first_token_ms:g}ms、"
+              f"回答 {args.answer_tokens} token")
+        print(f"{'并发':>6}{'请求':>8}{'完成':>8}{'拒绝':>8}{'错误':>8}{'req/s':>10}{'字符/s':>10}"
+              f"{'首字p50':>10}{'首字p95':>10}{'耗时p50':>10}{'耗时p95':>10}{'RSS峰值MB':>10}{'CPU ms/请求':>10}")
+        results = {}
+        offset = 0
+        for concurrency in levels:
+            level = run_level(port, process.pid, fixtures, concurrency, args, notes, offset)
+            offset += level['requests']
+            results[f"concurrency={concurrency}"] = level
+            print_level(level)
+        status = get_json(port, '/api/status')
+        results['service_status'] = {key: status.get(key) for key in
+                                     ('checkpoints', 'search_cache', 'answer_cache', 'runs', 'admission')}
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        fixtures.stop()
+        log.close()
+
+    config = {key: value for key, value in vars(args).items() if key != 'output'}
+    config['sites'] = fixtures.sites
+    config['service_env'] = {key: env[key] for key in SERVICE_ENV if key in env}
+    path = save_results('chat', config, results, args.output)
+    print(f"\n结果已写入 {path}（服务日志 {log.name}）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+网页正文提取基准测试
+
+对比旧实现（BeautifulSoup html.parser + get_text）与 html_extract 各解析后端的
+提取耗时和输出大小。样本为 fixtures/ 下保存的 HTML，外加一个生成的大页面。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_extract.py [--repeat 20] [--large-kb 3000]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+import html_extract  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def legacy_html_to_text(html):
+    """改造前 extract_webpage_content 的提取逻辑"""
+    soup = BeautifulSoup(html, 'html.parser')
+    for tag in soup(["script", "style", "nav", "footer", "header"]):
+        tag.decompose()
+    text_content = soup.get_text()
+    lines = (line.strip() for line in text_content.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return ' '.join(chunk for chunk in chunks if chunk)
+
+
+def generate_large_page(target_kb):
+    """生成一个带大量导航、评论和正文段落的页面"""
+    parts = ['<html><head><meta charset="utf-8"><title>large</title></head><body>']
+    parts.append('<nav>' + ''.join(f'<a href="/c/{i}">栏目 {i}</a>' for i in range(200)) + '</nav>')
+    parts.append('<article class="content">')
+    paragraph = ('这是一段用于基准测试的正文内容，包含中文标点，也包含 English words, numbers 12345 '
+                 '以及一些 <a href="#">链接</a>，用来模拟真实文章中的段落结构。')
+    size = 0
+    i = 0
+    while size < target_kb * 1024 * 0.7:
+        parts.append(f'<h2>第 {i} 节</h2><p>{paragraph * 3}</p>')
+        size += len(parts[-1].encode('utf-8'))
+        i += 1
+    parts.append('</article><div class="comment-list">')
+    while size < target_kb * 1024:
+        parts.append(f'<div class="comment"><a href="/u/{i}">用户{i}</a>：评论内容 {i}</div>')
+        size += len(parts[-1].encode('utf-8'))
+        i += 1
+    parts.append('</div></body></html>')
+    return ''.join(parts)
+
+
+def load_samples(large_kb):
+    samples = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            samples.append((os.path.basename(path), f.read()))
+    samples.append((f'generated_{large_kb}kb.html', generate_large_page(large_kb)))
+    return samples
+
+
+def measure(func, html, repeat):
+    best = float('inf')
+    output = ''
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = func(html)
+        best = min(best, time.perf_counter() - started)
+    return best, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--large-kb', type=int, default=3000)
+    args = parser.parse_args()
+
+    extractors = [('legacy', legacy_html_to_text)]
+    for name in html_extract.BACKENDS:
+        backend = html_extract.get_backend(name)
+        extractors.append((name, lambda html, backend=backend: html_extract.extract_main_text(html, backend)))
+
+    print(f"{'样本':<28}{'大小KB':>8}  {'实现':<12}{'耗时ms':>10}{'输出字符':>10}")
+    for sample_name, html in load_samples(args.large_kb):
+        # 大页面只跑少量轮次
+        repeat = args.repeat if len(html) < 512 * 1024 else max(args.repeat // 5, 1)
+        for name, func in extractors:
+            seconds, output = measure(func, html, repeat)
+            print(f"{sample_name:<28}{len(html.encode('utf-8')) / 1024:>8.1f}  {name:<12}"
+                  f"{seconds * 1000:>10.2f}{len(output):>10}")
+
+
+if __name__ == '__main__':
+    main()
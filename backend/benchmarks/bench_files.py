@@ -0,0 +1,278 @@
+"""
+文件服务基准测试（离线）
+
+在生成的工作区（默认 1k、10k、100k 篇笔记，见 fakes.generate_workspace）上逐个测量 file_service.py 的接口：
+- 启动：搜索索引首次全量构建、无变化时的对账、文件监听启动（inotify 为每个目录添加监听）
+- /api/files/tree：首次构建、缓存失效后重建、缓存命中、ETag 协商（304）、只展开一层、子目录
+- /api/files/read（全文 / 按行 / 按字节）、/api/files/raw（全文 / Range）
+- /api/files/write、patch、create、rename、delete、batch（并行读取 / 原子写入）
+- /api/files/search、/api/files/events（磁盘上的修改到推送给订阅者的延迟，含去抖时间）、/health
+
+进程内用 Flask 测试客户端调用（不含网络开销）。file_service 的工作区、文件树缓存、搜索索引和
+批处理备份目录改为指向生成的目录；写操作只改动 zz-bench/ 下的临时文件，结束后删除，工作区可以复用。
+生成的工作区保存在 --workdir 中，参数相同时直接复用（100k 篇首次生成约需一分钟）。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_files.py [--sizes 1000,10000,100000] [--repeat 30] [--output results.json]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+# 单进程：不使用跨进程的变化记录
+os.environ['SERVICE_WORKERS'] = '1'
+
+import file_service  # noqa: E402
+import search_index  # noqa: E402
+from file_tree import FileTreeCache  # noqa: E402
+from file_watcher import FileWatcher  # noqa: E402
+from fakes import TOPICS, generate_workspace, workspace_paths  # noqa: E402
+from report import DEFAULT_RESULTS_DIR, process_memory, save_results, summarize  # noqa: E402
+
+SCRATCH_DIR = 'zz-bench'
+
+
+def use_workspace(root):
+    """把 file_service 指向生成的工作区，返回新的（空的）搜索索引"""
+    roots = {'docs': os.path.join(root, 'docs'), 'blog': os.path.join(root, 'blog')}
+    file_service.DOCS_ROOT, file_service.BLOG_ROOT = roots['docs'], roots['blog']
+    template = file_service.file_tree_cache
+    file_service.file_tree_cache = FileTreeCache(roots, ttl=template.ttl, max_snapshots=template.max_snapshots)
+    file_service.BATCH_BACKUP_DIR = os.path.join(root, 'batch')
+    index_path = os.path.join(root, 'search_index.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(index_path + suffix):
+            os.remove(index_path + suffix)
+    index = search_index.SearchIndex(roots=roots, index_path=index_path)
+    search_index._search_index = index
+    return index
+
+
+class Recorder:
+    """按用例收集每次调用的耗时和响应大小"""
+
+    def __init__(self):
+        self.cases = {}
+
+    def measure(self, name, call, repeat):
+        latencies, sizes, errors = [], [], []
+        for i in range(repeat):
+            started = time.perf_counter()
+            response = call(i)
+            latencies.append((time.perf_counter() - started) * 1000)
+            sizes.append(len(response.get_data()))
+            if response.status_code >= 400:
+                errors.append(f"HTTP {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        total = sum(latencies) / 1000
+        self.cases[name] = {
+            'latency_ms': summarize(latencies, digits=3),
+            'ops_per_second': round(repeat / total, 1) if total else None,
+            'response_bytes': round(sum(sizes) / len(sizes)) if sizes else 0,
+            'errors': len(errors),
+        }
+        if errors:
+            self.cases[name]['error_samples'] = sorted(set(errors))[:3]
+        return self.cases[name]
+
+
+def bench_tree(client, recorder, repeat):
+    tree_url = '/api/files/tree?workspace=docs'
+    recorder.measure('tree_cold', lambda i: client.get(tree_url), 1)
+
+    def rebuild(i):
+        file_service.file_tree_cache.invalidate('docs')
+        return client.get(tree_url)
+
+    recorder.measure('tree_rebuild', rebuild, max(repeat // 5, 3))
+    recorder.measure('tree_warm', lambda i: client.get(tree_url), repeat)
+    etag = client.get(tree_url).headers['ETag']
+    recorder.measure('tree_not_modified', lambda i: client.get(tree_url, headers={'If-None-Match': etag}), repeat)
+    recorder.measure('tree_depth1', lambda i: client.get(tree_url + '&depth=1'), repeat)
+    recorder.measure('tree_subdir', lambda i: client.get(tree_url + '&path=section-000'), repeat)
+    tree = client.get(tree_url).get_json()['tree']
+    return {'tree_bytes': recorder.cases['tree_warm']['response_bytes'], 'tree_top_level': len(tree)}
+
+
+def bench_reads(client, recorder, repeat, paths, rng):
+    targets = [rng.choice(paths) for _ in range(repeat)]
+    recorder.measure('read', lambda i: client.post('/api/files/read', json={'path': targets[i]}), repeat)
+    recorder.measure('read_lines', lambda i: client.post('/api/files/read', json={
+        'path': targets[i], 'startLine': 1, 'maxLines': 20}), repeat)
+    recorder.measure('read_bytes', lambda i: client.post('/api/files/read', json={
+        'path': targets[i], 'offset': 0, 'length': 512}), repeat)
+    recorder.measure('raw', lambda i: client.get('/api/files/raw', query_string={'path': targets[i]}), repeat)
+    recorder.measure('raw_range', lambda i: client.get('/api/files/raw', query_string={'path': targets[i]},
+                                                       headers={'Range': 'bytes=0-255'}), repeat)
+    batch = [[{'op': 'read', 'path': rng.choice(paths)} for _ in range(20)] for _ in range(repeat)]
+    recorder.measure('batch_read_20', lambda i: client.post('/api/files/batch', json={'operations': batch[i]}),
+                     repeat)
+
+
+def bench_writes(client, recorder, repeat):
+    content = "# 基准测试\n\n" + "写入的内容，" * 200
+
+    recorder.measure('write', lambda i: client.post('/api/files/write', json={
+        'path': f'{SCRATCH_DIR}/write-{i % 10}.md', 'content': f"{content}{i}"}), repeat)
+
+    version = client.post('/api/files/write', json={
+        'path': f'{SCRATCH_DIR}/patch.md', 'content': content}).get_json()['version']
+
+    def patch(i):
+        nonlocal version
+        response = client.post('/api/files/patch', json={
+            'path': f'{SCRATCH_DIR}/patch.md', 'baseVersion': version,
+            'edits': [{'start': 0, 'end': 0, 'text': f"{i}\n"}]})
+        version = response.get_json().get('version', version)
+        return response
+
+    recorder.measure('patch', patch, repeat)
+    recorder.measure('create', lambda i: client.post('/api/files/create', json={
+        'path': f'{SCRATCH_DIR}/new-{i}.md', 'content': content}), repeat)
+    recorder.measure('rename', lambda i: client.post('/api/files/rename', json={
+        'oldPath': f'{SCRATCH_DIR}/new-{i}.md', 'newPath': f'{SCRATCH_DIR}/renamed-{i}.md'}), repeat)
+    recorder.measure('delete', lambda i: client.post('/api/files/delete', json={
+        'path': f'{SCRATCH_DIR}/renamed-{i}.md'}), repeat)
+    recorder.measure('batch_write_atomic_10', lambda i: client.post('/api/files/batch', json={
+        'atomic': True,
+        'operations': [{'op': 'write', 'path': f'{SCRATCH_DIR}/batch-{j}.md', 'content': f"{content}{i}"}
+                       for j in range(10)]}), repeat)
+
+
+def bench_search(client, recorder, repeat, rng):
+    queries = [f"{rng.choice(TOPICS)} {rng.choice(TOPICS)}" for _ in range(repeat)]
+    recorder.measure('search', lambda i: client.get('/api/files/search', query_string={
+        'q': queries[i], 'limit': 20}), repeat)
+
+
+def bench_events(client, roots, repeat):
+    """启动文件监听，测量磁盘上的修改推送到 /api/files/events 订阅者的延迟"""
+    template = file_service.file_watcher
+    watcher = FileWatcher(roots, on_events=file_service.apply_fs_events, debounce=template.debounce,
+                          poll_interval=template.poll_interval)
+    file_service.file_watcher = watcher
+    started = time.perf_counter()
+    backend = watcher.start()
+    start_ms = (time.perf_counter() - started) * 1000
+    response = client.get('/api/files/events?workspace=docs', buffered=False)
+    stream = iter(response.response)
+    next(stream)  # ready
+    latencies = []
+    try:
+        for i in range(repeat):
+            rel_path = f'{SCRATCH_DIR}/event-{i}.md'
+            started = time.perf_counter()
+            with open(os.path.join(roots['docs'], rel_path), 'w', encoding='utf-8') as f:
+                f.write(f"# event {i}\n")
+            while True:
+                chunk = next(stream)
+                chunk = chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
+                if rel_path in chunk:
+                    break
+            latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        response.close()
+        watcher.stop()
+        file_service.file_watcher = template
+    return {
+        'backend': backend,
+        'watcher_start_ms': round(start_ms, 2),
+        'debounce_ms': template.debounce * 1000,
+        'latency_ms': summarize(latencies),
+    }
+
+
+def bench_size(files, args):
+    root = os.path.join(args.workdir, f'ws-{files}')
+    generated, generate_seconds = generate_workspace(root, files, seed=args.seed)
+    index = use_workspace(root)
+    roots = dict(index.roots)
+    scratch = os.path.join(roots['docs'], SCRATCH_DIR)
+    os.makedirs(scratch, exist_ok=True)
+    paths = list(workspace_paths(files))
+    rng = random.Random(args.seed)
+
+    startup = {'generated': generated, 'generate_seconds': round(generate_seconds, 2)}
+    started = time.perf_counter()
+    startup['index_sync_cold'] = index.sync()
+    startup['index_sync_cold_seconds'] = round(time.perf_counter() - started, 3)
+    started = time.perf_counter()
+    index.sync()
+    startup['index_sync_noop_seconds'] = round(time.perf_counter() - started, 3)
+
+    client = file_service.app.test_client()
+    recorder = Recorder()
+    try:
+        tree = bench_tree(client, recorder, args.repeat)
+        bench_reads(client, recorder, args.repeat, paths, rng)
+        bench_writes(client, recorder, args.repeat)
+        bench_search(client, recorder, args.repeat, rng)
+        recorder.measure('health', lambda i: client.get('/health'), args.repeat)
+        events = bench_events(client, roots, min(args.repeat, 10)) if not args.skip_events else None
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+        shutil.rmtree(file_service.BATCH_BACKUP_DIR, ignore_errors=True)
+    return {
+        'files': files,
+        'startup': startup,
+        'tree': tree,
+        'endpoints': recorder.cases,
+        'events': events,
+        'memory': process_memory(),
+    }
+
+
+def print_size(result):
+    startup = result['startup']
+    print(f"\n== {result['files']} 篇笔记 =="
+          f"  索引全量构建 {startup['index_sync_cold_seconds']:.2f}s，无变化对账 {startup['index_sync_noop_seconds']:.2f}s，"
+          f"文件树 {result['tree']['tree_bytes'] / 1024:.0f} KB")
+    print(f"{'接口':<24}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'次/秒':>10}{'响应字节':>12}{'错误':>6}")
+    for name, case in result['endpoints'].items():
+        latency = case['latency_ms']
+        print(f"{name:<24}{latency['p50']:>10.2f}{latency['p95']:>10.2f}{latency['max']:>10.2f}"
+              f"{case['ops_per_second'] or 0:>10.0f}{case['response_bytes']:>12}{case['errors']:>6}")
+        for sample in case.get('error_samples', []):
+            print(f"    ⚠️ {sample}")
+    events = result['events']
+    if events:
+        latency = events['latency_ms']
+        print(f"{'events（' + events['backend'] + '）':<24}{latency.get('p50', 0):>10.2f}{latency.get('p95', 0):>10.2f}"
+              f"{latency.get('max', 0):>10.2f}  监听启动 {events['watcher_start_ms']:.0f}ms，去抖 {events['debounce_ms']:g}ms")
+    if result['memory']:
+        print(f"进程常驻内存 {result['memory']['rss_mb']} MB（峰值 {result['memory']['peak_rss_mb']} MB）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,100000', help='逗号分隔的笔记数')
+    parser.add_argument('--repeat', type=int, default=30, help='每个接口的调用次数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default=os.path.join(DEFAULT_RESULTS_DIR, 'workspaces'),
+                        help='生成的工作区所在目录')
+    parser.add_argument('--skip-events', action='store_true', help='不测量文件监听和变化推送')
+    parser.add_argument('--output', help=f'结果文件，默认写到 {DEFAULT_RESULTS_DIR}')
+    args = parser.parse_args()
+    sizes = [int(value) for value in args.sizes.split(',') if value.strip()]
+
+    results = {}
+    for files in sizes:
+        result = bench_size(files, args)
+        results[f"files={files}"] = result
+        print_size(result)
+
+    config = {key: value for key, value in vars(args).items() if key not in ('output', 'workdir')}
+    config['file_tree_cache_ttl'] = file_service.file_tree_cache.ttl
+    path = save_results('files', config, results, args.output)
+    print(f"\n结果已写入 {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+日志开销基准测试
+
+模拟 chat_stream_async 的逐块日志（每个 token 两条：收到消息 + 回复内容），比较：
+- print：改造前的做法，每块两次 print + repr
+- logger@DEBUG（不采样）：每块都生成日志记录并放进队列
+- logger@DEBUG（采样）：每个请求每秒最多 LOG_SAMPLE_RATE 条
+- logger@INFO / WARNING：逐块日志被级别过滤，只剩一次级别判断
+
+输出调用线程上每个 chunk 的平均耗时（写出由后台线程完成，不计入）。默认写到 /dev/null，
+--stdout 时写到终端，可以看到标准输出争用的影响。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_logging.py [--chunks 50000] [--stdout]
+"""
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from service_log import LOGGER_NAME, RateSampler, configure_logging, get_logger, logging_stats, shutdown_logging  # noqa: E402
+
+CONTENT = "这是模型输出的一小段文本，"
+
+
+def run_print(chunks, out):
+    with contextlib.redirect_stdout(out):
+        started = time.perf_counter()
+        for _ in range(chunks):
+            print(f"📦 收到消息: AIMessageChunk, 元数据: agent")
+            print(f"📤 AI回复内容: {repr(CONTENT)}")
+        return time.perf_counter() - started
+
+
+def run_logger(chunks, level, rate):
+    logging.getLogger(LOGGER_NAME).setLevel(level)
+    log = get_logger("bench", request_id="bench", thread_id="bench")
+    sampler = RateSampler(rate=rate, burst=rate if rate != float('inf') else 1)
+    started = time.perf_counter()
+    for _ in range(chunks):
+        log.sampled(sampler, logging.DEBUG, "📦 收到消息: %s, 节点: %s", "AIMessageChunk", "agent")
+        log.sampled(sampler, logging.DEBUG, "📤 AI回复内容: %r", CONTENT)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunks', type=int, default=50000)
+    parser.add_argument('--stdout', action='store_true', help='写到终端而不是 /dev/null')
+    args = parser.parse_args()
+
+    out = sys.stdout if args.stdout else open(os.devnull, 'w')
+    # 队列放大到能容纳全部记录，测量的是调用线程的开销而不是丢弃
+    import service_log
+    service_log.LOG_QUEUE_SIZE = args.chunks * 2 + 1000
+    configure_logging("bench", stream=out)
+
+    cases = [
+        ("print", lambda: run_print(args.chunks, out)),
+        ("logger@DEBUG", lambda: run_logger(args.chunks, logging.DEBUG, float('inf'))),
+        ("logger@DEBUG 采样", lambda: run_logger(args.chunks, logging.DEBUG, service_log.LOG_SAMPLE_RATE)),
+        ("logger@INFO", lambda: run_logger(args.chunks, logging.INFO, service_log.LOG_SAMPLE_RATE)),
+        ("logger@WARNING", lambda: run_logger(args.chunks, logging.WARNING, service_log.LOG_SAMPLE_RATE)),
+    ]
+    results = []
+    for name, case in cases:
+        elapsed = case()
+        # 等后台线程写完，避免影响下一组
+        while logging_stats()["queued"]:
+            time.sleep(0.01)
+        results.append((name, elapsed))
+    shutdown_logging()
+
+    print(f"{args.chunks} chunks，每块 2 条日志", file=sys.stderr)
+    print(f"{'方式':<20}{'总耗时 ms':>12}{'每块 µs':>12}", file=sys.stderr)
+    for name, elapsed in results:
+        print(f"{name:<20}{elapsed * 1000:>12.1f}{elapsed / args.chunks * 1e6:>12.2f}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
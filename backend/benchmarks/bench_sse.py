@@ -0,0 +1,120 @@
+"""
+SSE 分帧基准测试
+
+用一个按固定间隔产出 token 的假 Agent 流（中间有一次模拟工具调用的停顿），对比：
+- legacy：每个 token 一帧（改造前 ai_service.generate 的行为）
+- coalesced：经过 FrameCoalescer 合并
+
+每帧 json.dumps 后通过 socket 发送一次（对应一次 WSGI 写 + 刷新），统计帧数、字节数、
+帧/秒、CPU 时间，以及每个 token 从产生到发出的额外延迟。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_sse.py [--tokens 3000] [--interval-ms 2] [--window-ms 30]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from sse_framing import FrameCoalescer, coalesce_threadsafe, format_event  # noqa: E402
+
+TOKEN = "流式"
+
+
+async def fake_stream(tokens, interval, pause_at, pause, produced):
+    """模拟模型输出：每 interval 秒一个 token，在 pause_at 处停顿 pause 秒"""
+    for i in range(tokens):
+        if i == pause_at:
+            await asyncio.sleep(pause)
+        elif interval:
+            await asyncio.sleep(interval)
+        produced.append(time.perf_counter())
+        yield TOKEN
+
+
+def legacy_frames(chunks, loop):
+    """改造前的驱动方式：每个 token 取一次、发一帧"""
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(chunks.__anext__(), loop).result()
+            except StopAsyncIteration:
+                break
+    finally:
+        asyncio.run_coroutine_threadsafe(chunks.aclose(), loop).result()
+
+
+def drain(sock):
+    while sock.recv(65536):
+        pass
+
+
+def run(name, make_frames, args, loop):
+    produced = []
+    delivered = []  # (发送时间, 本帧包含的 token 数)
+    stream = fake_stream(args.tokens, args.interval_ms / 1000, args.tokens // 2, args.pause_ms / 1000, produced)
+    writer, reader = socket.socketpair()
+    drainer = threading.Thread(target=drain, args=(reader,), daemon=True)
+    drainer.start()
+
+    frames = 0
+    sent_bytes = 0
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    for frame in make_frames(stream, loop):
+        if not frame:
+            continue
+        payload = format_event({'content': frame}).encode('utf-8')
+        writer.sendall(payload)
+        delivered.append((time.perf_counter(), len(frame) // len(TOKEN)))
+        frames += 1
+        sent_bytes += len(payload)
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    writer.close()
+    drainer.join()
+    reader.close()
+
+    # 每个 token 的额外延迟 = 所在帧的发送时间 - token 产生时间
+    delays = []
+    index = 0
+    for sent_at, count in delivered:
+        for produced_at in produced[index:index + count]:
+            delays.append((sent_at - produced_at) * 1000)
+        index += count
+    delays.sort()
+    first_token_ms = (delivered[0][0] - produced[0]) * 1000 if delivered else 0
+    print(f"{name:<10}{frames:>8}{sent_bytes:>10}{frames / wall:>10.0f}{cpu * 1000:>10.1f}"
+          f"{first_token_ms:>10.2f}{statistics.median(delays):>10.2f}{delays[int(len(delays) * 0.99)]:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, default=3000)
+    parser.add_argument('--interval-ms', type=float, default=2)
+    parser.add_argument('--pause-ms', type=float, default=300, help='模拟工具调用的停顿')
+    parser.add_argument('--window-ms', type=float, default=30)
+    parser.add_argument('--max-bytes', type=int, default=2048)
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    print(f"{args.tokens} tokens, 间隔 {args.interval_ms}ms, 窗口 {args.window_ms}ms, 上限 {args.max_bytes}B")
+    print(f"{'模式':<10}{'帧数':>8}{'字节':>10}{'帧/秒':>10}{'CPU ms':>10}"
+          f"{'首字ms':>10}{'p50延迟':>10}{'p99延迟':>10}")
+    run('legacy', legacy_frames, args, loop)
+    run('coalesced', lambda stream, loop: coalesce_threadsafe(
+        stream, loop, FrameCoalescer(window=args.window_ms / 1000, max_bytes=args.max_bytes)), args, loop)
+    loop.call_soon_threadsafe(loop.stop)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+启动耗时基准测试
+
+每项测量都在新的子进程里进行（模块缓存为空），重复若干次取中位数：
+- import ai_service：AI 服务进程能开始监听端口之前的耗时
+- 首个 /health：导入之后，用测试客户端完成第一次健康检查的耗时
+- 构建 Agent：get_agent_instance() 的耗时（模型、搜索工具、检查点、图编译），
+  默认在后台预热中完成，AGENT_WARMUP=0 时由第一个聊天请求承担
+- import file_service：文件服务的导入耗时
+
+--importtime 时额外列出 import ai_service 中累计耗时最多的模块（python -X importtime）。
+不访问网络：使用占位的 DASHSCOPE_API_KEY / TAVILY_API_KEY，只构建不调用。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_startup.py [--repeat 5] [--importtime]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+AI_SERVICE_PROBE = """
+import json, time
+started = time.perf_counter()
+import ai_service
+imported = time.perf_counter()
+client = ai_service.app.test_client()
+status = client.get('/health').get_json()['agent_status']
+health = time.perf_counter()
+from app import get_agent_instance
+get_agent_instance()
+built = time.perf_counter()
+print(json.dumps({
+    'import_ai_service': imported - started,
+    'first_health': health - imported,
+    'build_agent': built - health,
+    'health_status': status,
+}))
+"""
+
+FILE_SERVICE_PROBE = """
+import json, time
+started = time.perf_counter()
+import file_service
+print(json.dumps({'import_file_service': time.perf_counter() - started}))
+"""
+
+
+def _env():
+    env = dict(os.environ)
+    env.setdefault('DASHSCOPE_API_KEY', 'bench-placeholder')
+    env.setdefault('TAVILY_API_KEY', 'bench-placeholder')
+    # 测的是同步构建的耗时，不让后台预热抢先
+    env['AGENT_WARMUP'] = '0'
+    env.setdefault('LOG_LEVEL', 'WARNING')
+    return env
+
+
+def run_probe(code):
+    result = subprocess.run(
+        [sys.executable, '-W', 'ignore', '-c', code],
+        cwd=BACKEND_DIR, env=_env(), capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def heaviest_imports(top):
+    """python -X importtime 的累计耗时排行（只看顶层包）"""
+    result = subprocess.run(
+        [sys.executable, '-W', 'ignore', '-X', 'importtime', '-c', 'import ai_service'],
+        cwd=BACKEND_DIR, env=_env(), capture_output=True, text=True, check=True,
+    )
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        package = name.split('.')[0]
+        # 同一个包只保留最外层（累计耗时最大）的那一条
+        packages[package] = max(packages.get(package, 0), int(cumulative))
+    return sorted(packages.items(), key=lambda item: -item[1])[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--importtime', action='store_true', help='列出最耗时的导入')
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    samples = {}
+    statuses = set()
+    for _ in range(args.repeat):
+        result = {**run_probe(AI_SERVICE_PROBE), **run_probe(FILE_SERVICE_PROBE)}
+        statuses.add(result.pop('health_status'))
+        for name, seconds in result.items():
+            samples.setdefault(name, []).append(seconds)
+
+    print(f"重复 {args.repeat} 次（每次新进程），首个 /health 返回的 agent_status: {', '.join(sorted(statuses))}")
+    print(f"{'阶段':<24}{'中位数 ms':>12}{'最小 ms':>12}{'最大 ms':>12}")
+    for name, values in samples.items():
+        print(f"{name:<24}{statistics.median(values) * 1000:>12.1f}"
+              f"{min(values) * 1000:>12.1f}{max(values) * 1000:>12.1f}")
+
+    if args.importtime:
+        print("\nimport ai_service 累计耗时最多的包：")
+        for package, micros in heaviest_imports(args.top):
+            print(f"  {package:<32}{micros / 1000:>10.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+对比两次基准测试的结果文件
+
+逐项列出 results 中两边都有的数值（路径形如 concurrency=8.ttft_ms.p95）及变化百分比，
+变化超过 --threshold 的项标记 *。config 不同时先列出差异，提醒两次运行的参数不一致。
+变化的好坏按指标含义判断：耗时、内存越小越好，吞吐越大越好。
+
+用法（在 backend 目录下）：
+    python benchmarks/compare.py 基准.json 新结果.json [--threshold 5] [--filter ttft]
+"""
+import argparse
+import json
+
+
+def flatten(value, prefix='', numbers_only=True):
+    """嵌套的 dict / list -> {路径: 值}；numbers_only 时忽略非数值"""
+    items = {}
+    if isinstance(value, dict):
+        for key, child in value.items():
+            items.update(flatten(child, f"{prefix}.{key}" if prefix else str(key), numbers_only))
+    elif isinstance(value, list):
+        for index, child in enumerate(value):
+            items.update(flatten(child, f"{prefix}[{index}]", numbers_only))
+    elif not numbers_only or (isinstance(value, (int, float)) and not isinstance(value, bool)):
+        items[prefix] = value
+    return items
+
+
+def load(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=5.0, help='标记变化超过该百分比的项')
+    parser.add_argument('--filter', default='', help='只显示路径包含该字符串的项')
+    args = parser.parse_args()
+
+    baseline, current = load(args.baseline), load(args.current)
+    if baseline.get('benchmark') != current.get('benchmark'):
+        print(f"⚠️ 不是同一个基准测试：{baseline.get('benchmark')} / {current.get('benchmark')}")
+    for label, document in (('基准', baseline), ('当前', current)):
+        env = document.get('environment', {})
+        print(f"{label}: {env.get('timestamp')}  commit {env.get('git_commit')}  "
+              f"Python {env.get('python')}  {env.get('cpus')} CPU")
+
+    old_config = flatten(baseline.get('config', {}), numbers_only=False)
+    new_config = flatten(current.get('config', {}), numbers_only=False)
+    differences = sorted(key for key in old_config.keys() | new_config.keys()
+                         if old_config.get(key) != new_config.get(key))
+    if differences:
+        print("⚠️ 参数不同：" + ", ".join(f"{key} {old_config.get(key)} → {new_config.get(key)}"
+                                         for key in differences))
+
+    old, new = flatten(baseline.get('results', {})), flatten(current.get('results', {}))
+    keys = [key for key in old if key in new and args.filter in key]
+    width = max((len(key) for key in keys), default=10) + 2
+    print(f"\n{'指标':<{width}}{'基准':>14}{'当前':>14}{'变化':>10}")
+    for key in keys:
+        before, after = old[key], new[key]
+        if before:
+            change = (after - before) / abs(before) * 100
+            change_text = f"{change:+.1f}%"
+        else:
+            change = 0 if after == before else float('inf')
+            change_text = '—' if after == before else 'new'
+        mark = ' *' if abs(change) >= args.threshold else ''
+        print(f"{key:<{width}}{before:>14g}{after:>14g}{change_text:>10}{mark}")
+    only = sorted((old.keys() ^ new.keys()))
+    if only:
+        print(f"\n只在一边出现的指标 {len(only)} 项（例如 {', '.join(only[:5])}）")
+
+
+if __name__ == '__main__':
+    main()
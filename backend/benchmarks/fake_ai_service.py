@@ -0,0 +1,83 @@
+"""
+离线运行 AI 服务：对话模型换成 FakeChatModel，联网搜索和网页指向本地 FixtureServer
+
+除模型和搜索端点之外都是真实代码（Agent、工具、各级缓存、准入控制、SSE 分帧），
+bench_chat.py 用它压测 /api/chat；没有 API Key 时也可以用来调试前端。
+Agent 在开始监听之前构建完成，随后在标准输出打印一行 JSON（{"ready": true, ...}），
+调用方看到这一行后轮询 /health 等待端口可用。
+
+用法（在 backend 目录下）：
+    python benchmarks/fake_ai_service.py [--port 5005] [--mode flask|asgi] [--scenario mixed]
+        [--tokens-per-second 50] [--first-token-ms 300] [--answer-tokens 120]
+        [--fixtures-url http://127.0.0.1:PORT]   # 不指定时在本进程内启动 FixtureServer
+        [--workspace DIR]                         # generate_workspace 生成的目录，替代仓库的 docs/ 和 blog/
+"""
+import argparse
+import json
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from fakes import SCENARIOS, FakeChatModel, FixtureServer  # noqa: E402
+
+
+def use_workspace(root):
+    """把笔记目录指向生成的工作区（索引单独存放，不影响仓库的索引文件）"""
+    os.environ.setdefault('SEARCH_INDEX_PATH', os.path.join(root, 'search_index.db'))
+    import doc_cache
+    import search_index
+    search_index.WORKSPACE_ROOTS.update(docs=os.path.join(root, 'docs'), blog=os.path.join(root, 'blog'))
+    doc_cache.DOCS_DIR = search_index.WORKSPACE_ROOTS['docs']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5005)
+    parser.add_argument('--mode', choices=('flask', 'asgi'), default='flask')
+    parser.add_argument('--scenario', choices=SCENARIOS, default='mixed')
+    parser.add_argument('--tokens-per-second', type=float, default=50)
+    parser.add_argument('--first-token-ms', type=float, default=300)
+    parser.add_argument('--answer-tokens', type=int, default=120)
+    parser.add_argument('--tool-call-ms', type=float, default=200)
+    parser.add_argument('--fixtures-url', help='FixtureServer 地址；不指定时在本进程内启动')
+    parser.add_argument('--workspace', help='generate_workspace 生成的工作区')
+    args = parser.parse_args()
+
+    # 只构建、不访问外部服务
+    os.environ.setdefault('DASHSCOPE_API_KEY', 'bench-placeholder')
+    os.environ.setdefault('TAVILY_API_KEY', 'bench-placeholder')
+    os.environ['AGENT_WARMUP'] = '0'
+    fixtures_url = args.fixtures_url or FixtureServer().start().url
+    os.environ['TAVILY_API_BASE_URL'] = fixtures_url
+    if args.workspace:
+        use_workspace(os.path.abspath(args.workspace))
+
+    import app as agent_app
+    from search_index import get_search_index
+
+    agent_app.create_chat_model = lambda: FakeChatModel(
+        scenario=args.scenario,
+        tokens_per_second=args.tokens_per_second,
+        first_token_ms=args.first_token_ms,
+        answer_tokens=args.answer_tokens,
+        tool_call_ms=args.tool_call_ms,
+    )
+    agent_app.get_agent_instance()
+    get_search_index()
+
+    print(json.dumps({'ready': True, 'pid': os.getpid(), 'port': args.port, 'mode': args.mode,
+                      'scenario': args.scenario, 'fixtures_url': fixtures_url}), flush=True)
+    if args.mode == 'asgi':
+        import uvicorn
+        uvicorn.run("ai_asgi:app", host=args.host, port=args.port, log_level="warning")
+    else:
+        from werkzeug.serving import make_server
+        import ai_service
+        make_server(args.host, args.port, ai_service.app, threaded=True).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+"""
+离线基准测试用的替身：不消耗 DashScope 和 Tavily 的额度，结果可复现
+
+- FakeChatModel：按固定速率流式输出 token 的对话模型，按场景脚本发起工具调用，
+  输出只由问题决定（同一个问题每次得到同样的工具调用和回答）
+- FixtureServer：本地 HTTP 服务，提供与 Tavily 兼容的 /search 接口和 fixtures/ 下的网页，
+  延迟可配置；搜索结果里的网址指向本服务，网页抓取和正文提取走真实的代码路径
+- generate_workspace：生成指定数量 Markdown 笔记的工作区（docs/ + blog/），内容由种子决定
+
+场景（FakeChatModel.scenario）：
+    chat   直接回答
+    notes  search_notes → read_doc_file → 回答
+    web    tavily_search → extract_webpages（搜索结果中的网址）→ 回答
+    mixed  按问题在以上三种之间分配
+"""
+import asyncio
+import glob
+import json
+import os
+import random
+import re
+import shutil
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterator, List, Optional
+from urllib.parse import quote
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+SCENARIOS = ('chat', 'notes', 'web', 'mixed')
+
+# 回答由这些片段随机拼成，中英文混合，长度接近真实模型的 token
+VOCABULARY = [
+    "这篇", "笔记", "主要", "介绍", "了", "如何", "配置", "服务", "，", "。", "并且", "说明", "缓存",
+    "的", "作用", "需要", "注意", "性能", "问题", "可以", "通过", "调整", "参数", "来", "改善",
+    " the", " service", " cache", " request", " latency", " config", " file", " index",
+    "\n\n", "- ", "**", "`", "1.", "2.", "3.",
+]
+
+# 笔记标题和正文里的主题词，基准测试的搜索词从中选取
+TOPICS = [
+    "缓存", "索引", "部署", "性能", "日志", "监控", "数据库", "前端", "路由", "组件",
+    "docker", "react", "python", "sqlite", "nginx", "kubernetes", "markdown", "webpack",
+]
+
+_PAGE_RE = re.compile(r'当前用户浏览的文档路径：(\S+)')
+_URL_RE = re.compile(r'https?://[^\s"\'<>\\]+')
+
+
+def _seed(text):
+    return zlib.crc32(text.encode('utf-8'))
+
+
+def _split_question(content):
+    """用户消息 -> (问题, 页面路径)"""
+    match = _PAGE_RE.search(content)
+    question = _PAGE_RE.sub('', content).strip()
+    return question, match.group(1) if match else None
+
+
+class FakeChatModel(BaseChatModel):
+    """确定性的流式对话模型，替代 ChatTongyi"""
+
+    scenario: str = 'mixed'
+    # 每秒输出的 token 数、首个 token 之前的延迟、回答的 token 数
+    tokens_per_second: float = 50.0
+    first_token_ms: float = 300.0
+    answer_tokens: int = 120
+    # 生成工具调用（不逐字输出）所需的时间
+    tool_call_ms: float = 200.0
+
+    @property
+    def _llm_type(self) -> str:
+        return 'fake-chat'
+
+    def bind_tools(self, tools, **kwargs):
+        # 工具调用由场景脚本决定，不需要把工具描述传给模型
+        return self
+
+    def _turn(self, messages):
+        """本轮（最后一条用户消息之后）的问题、页面路径和已完成的工具调用结果"""
+        for index in range(len(messages) - 1, -1, -1):
+            if isinstance(messages[index], HumanMessage):
+                question, page = _split_question(str(messages[index].content))
+                results = [m for m in messages[index + 1:] if isinstance(m, ToolMessage)]
+                return question, page, results
+        return '', None, []
+
+    def _scenario_for(self, question):
+        if self.scenario != 'mixed':
+            return self.scenario
+        return ('chat', 'notes', 'web')[_seed(question) % 3]
+
+    def _next_tool_call(self, question, page, results):
+        """按场景脚本返回下一个工具调用 (名称, 参数)，脚本已执行完时返回 None"""
+        step = len(results)
+        scenario = self._scenario_for(question)
+        if scenario == 'notes':
+            if step == 0:
+                return 'search_notes', {'query': question}
+            if step == 1:
+                # 没有当前页面时读取搜索到的第一篇 docs 笔记
+                found = re.search(r'\] docs/(\S+)', str(results[0].content))
+                target = page or (found.group(1) if found else 'intro.md')
+                return 'read_doc_file', {'file_path': target, 'question': question}
+        elif scenario == 'web':
+            if step == 0:
+                return 'tavily_search', {'query': question}
+            if step == 1:
+                urls = list(dict.fromkeys(_URL_RE.findall(str(results[0].content))))[:2]
+                if urls:
+                    return 'extract_webpages', {'urls': urls}
+        return None
+
+    def _answer_tokens(self, question, results):
+        rng = random.Random(_seed(question) + len(results))
+        return [rng.choice(VOCABULARY) for _ in range(self.answer_tokens)]
+
+    def _usage(self, messages, output_tokens):
+        input_tokens = sum(len(str(m.content)) for m in messages) // 2
+        return {'input_tokens': input_tokens, 'output_tokens': output_tokens,
+                'total_tokens': input_tokens + output_tokens}
+
+    def _call_id(self, question, results):
+        return f"call_{_seed(question):08x}_{len(results)}"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        question, page, results = self._turn(messages)
+        call = self._next_tool_call(question, page, results)
+        if call is not None:
+            time.sleep((self.first_token_ms + self.tool_call_ms) / 1000)
+            message = AIMessage(
+                content='',
+                tool_calls=[{'name': call[0], 'args': call[1], 'id': self._call_id(question, results)}],
+                usage_metadata=self._usage(messages, 20),
+            )
+        else:
+            tokens = self._answer_tokens(question, results)
+            time.sleep(self.first_token_ms / 1000 + len(tokens) / self.tokens_per_second)
+            message = AIMessage(content=''.join(tokens), usage_metadata=self._usage(messages, len(tokens)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        question, page, results = self._turn(messages)
+        call = self._next_tool_call(question, page, results)
+        await asyncio.sleep(self.first_token_ms / 1000)
+        if call is not None:
+            await asyncio.sleep(self.tool_call_ms / 1000)
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content='',
+                tool_call_chunks=[{'name': call[0], 'args': json.dumps(call[1], ensure_ascii=False),
+                                   'id': self._call_id(question, results), 'index': 0}],
+                usage_metadata=self._usage(messages, 20),
+            ))
+            return
+        tokens = self._answer_tokens(question, results)
+        interval = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+        for index, token in enumerate(tokens):
+            if index and interval:
+                await asyncio.sleep(interval)
+            last = index == len(tokens) - 1
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content=token,
+                usage_metadata=self._usage(messages, len(tokens)) if last else None,
+            ))
+
+
+class FixtureServer:
+    """本地搜索接口和网页（在后台线程中运行），统计各类请求的次数
+
+    网页抓取对同一站点限制并发数和请求间隔，真实的搜索结果通常来自不同站点。
+    sites > 1 时网页分散在 127.0.0.2、127.0.0.3 … 上（Linux 的回环地址段），地址不可用时退回单一站点。
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, search_latency_ms=150.0, page_latency_ms=80.0, results=3, sites=1):
+        self.search_latency = search_latency_ms / 1000
+        self.page_latency = page_latency_ms / 1000
+        self.results = results
+        self.pages = {}
+        for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html'))):
+            with open(path, 'rb') as f:
+                self.pages[os.path.basename(path)] = f.read()
+        self.counts = {'search': 0, 'page': 0, 'not_found': 0}
+        self._lock = threading.Lock()
+        self._servers = [self._bind(host, port)]
+        for index in range(1, sites):
+            try:
+                self._servers.append(self._bind(f"127.0.0.{index + 1}", self._servers[0].server_address[1]))
+            except OSError:
+                break
+        self._threads = []
+
+    def _bind(self, host, port):
+        server = ThreadingHTTPServer((host, port), self._handler_class())
+        server.daemon_threads = True
+        return server
+
+    @staticmethod
+    def _server_url(server):
+        host, port = server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def url(self):
+        return self._server_url(self._servers[0])
+
+    @property
+    def sites(self):
+        return len(self._servers)
+
+    def _count(self, kind):
+        with self._lock:
+            self.counts[kind] += 1
+
+    def search_results(self, query):
+        """与 Tavily /search 相同结构的结果，网址指向本服务的网页"""
+        names = sorted(self.pages)
+        rng = random.Random(_seed(query))
+        picked = rng.sample(names, min(self.results, len(names))) if names else []
+        return {
+            'query': query,
+            'follow_up_questions': None,
+            'answer': None,
+            'images': [],
+            'results': [{
+                'title': f"{query} - {name}",
+                'url': f"{self._server_url(self._servers[rng.randrange(len(self._servers))])}"
+                       f"/pages/{name}?q={quote(query)}",
+                'content': f"关于“{query}”的网页摘要，来自本地样本 {name}。",
+                'score': round(0.9 - 0.1 * rank, 2),
+                'raw_content': None,
+            } for rank, name in enumerate(picked)],
+            'response_time': self.search_latency,
+        }
+
+    def _handler_class(self):
+        fixtures = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                # 不让网页缓存命中，每次都走完整的抓取
+                self.send_header('Cache-Control', 'no-store')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                if self.path.rstrip('/') != '/search':
+                    fixtures._count('not_found')
+                    return self._reply(404, b'{}', 'application/json')
+                fixtures._count('search')
+                time.sleep(fixtures.search_latency)
+                body = json.dumps(fixtures.search_results(payload.get('query', '')), ensure_ascii=False)
+                self._reply(200, body.encode('utf-8'), 'application/json')
+
+            def do_GET(self):
+                name = self.path.split('?')[0].rsplit('/', 1)[-1]
+                if not self.path.startswith('/pages/') or name not in fixtures.pages:
+                    fixtures._count('not_found')
+                    return self._reply(404, b'not found', 'text/plain')
+                fixtures._count('page')
+                time.sleep(fixtures.page_latency)
+                self._reply(200, fixtures.pages[name], 'text/html; charset=utf-8')
+
+        return Handler
+
+    def start(self):
+        for server in self._servers:
+            thread = threading.Thread(target=server.serve_forever, daemon=True, name="fixture-server")
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+
+# ---------- 生成的工作区 ----------
+
+WORKSPACE_FORMAT = 1
+_PROSE_WORDS = [word for word in VOCABULARY if not word.isspace()]
+# 每个目录的笔记数、每个分组的目录数
+FILES_PER_DIR = 100
+DIRS_PER_SECTION = 10
+
+
+def workspace_paths(files):
+    """生成的工作区中第 0..files-1 篇笔记在 docs/ 下的相对路径（不必列目录即可挑选目标）"""
+    for index in range(files):
+        directory = index // FILES_PER_DIR
+        yield (f"section-{directory // DIRS_PER_SECTION:03d}/topic-{directory % DIRS_PER_SECTION:02d}/"
+               f"note-{index:06d}.md")
+
+
+def _note(index, rng):
+    topics = rng.sample(TOPICS, 3)
+    lines = ['---', f'title: 笔记 {index:06d}：{topics[0]}与{topics[1]}', '---', '',
+             f'# 笔记 {index:06d}：{topics[0]}与{topics[1]}', '']
+    for section in range(rng.randint(2, 6)):
+        lines.append(f'## {rng.choice(topics)} 第 {section + 1} 部分')
+        lines.append('')
+        words = [rng.choice(_PROSE_WORDS + topics) for _ in range(rng.randint(40, 160))]
+        lines.append(''.join(words).strip())
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def generate_workspace(root, files, seed=0, blog_files=None):
+    """在 root 下生成 docs/（files 篇笔记）和 blog/（默认 files // 10 篇），返回 (是否新生成, 耗时秒)
+
+    root/workspace.json 记录生成参数，参数相同的已有工作区直接复用。
+    """
+    blog_files = files // 10 if blog_files is None else blog_files
+    spec = {'format': WORKSPACE_FORMAT, 'files': files, 'blog_files': blog_files, 'seed': seed}
+    marker = os.path.join(root, 'workspace.json')
+    if os.path.exists(marker):
+        with open(marker, 'r', encoding='utf-8') as f:
+            if json.load(f) == spec:
+                return False, 0.0
+    started = time.perf_counter()
+    for workspace, count in (('docs', files), ('blog', blog_files)):
+        workspace_root = os.path.join(root, workspace)
+        if os.path.isdir(workspace_root):
+            shutil.rmtree(workspace_root)
+        os.makedirs(workspace_root)
+        rng = random.Random(f"{seed}:{workspace}")
+        created = set()
+        for index, rel_path in enumerate(workspace_paths(count)):
+            full_path = os.path.join(workspace_root, rel_path)
+            directory = os.path.dirname(full_path)
+            if directory not in created:
+                os.makedirs(directory, exist_ok=True)
+                created.add(directory)
+            with open(full_path, 'w', encoding='utf-8') as f:
+                f.write(_note(index, rng))
+    with open(marker, 'w', encoding='utf-8') as f:
+        json.dump(spec, f)
+    return True, time.perf_counter() - started
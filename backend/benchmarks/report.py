@@ -0,0 +1,135 @@
+"""
+基准测试结果的统计、进程资源采样和 JSON 输出（bench_chat.py / bench_files.py 共用）
+
+结果文件结构：
+    {"benchmark": 名称, "environment": {...}, "config": {...}, "results": {...}}
+默认写到 backend/.cache/benchmarks/<名称>-<时间>.json，用 compare.py 对比两次运行。
+"""
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RESULTS_DIR = os.path.join(BACKEND_DIR, '.cache', 'benchmarks')
+
+
+def percentile(sorted_values, fraction):
+    """最近秩百分位数（sorted_values 已排序且非空）"""
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def summarize(values, digits=2):
+    """一组测量值的分布：count、min、p50、p95、p99、max、mean"""
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'min': round(values[0], digits),
+        'p50': round(percentile(values, 0.50), digits),
+        'p95': round(percentile(values, 0.95), digits),
+        'p99': round(percentile(values, 0.99), digits),
+        'max': round(values[-1], digits),
+        'mean': round(sum(values) / len(values), digits),
+    }
+
+
+def process_memory(pid='self'):
+    """进程的常驻内存和峰值（MB），读取 /proc；不支持的平台返回 None"""
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return None
+    # 数值单位为 kB
+    return {
+        'rss_mb': round(int(fields['VmRSS'].split()[0]) / 1024, 1),
+        'peak_rss_mb': round(int(fields['VmHWM'].split()[0]) / 1024, 1),
+    }
+
+
+def process_cpu_seconds(pid='self'):
+    """进程累计的用户态 + 内核态 CPU 秒数；不支持的平台返回 None"""
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as f:
+            # 进程名可能包含空格，从最后一个右括号之后开始数字段
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+class MemorySampler:
+    """在后台线程中按固定间隔采样进程的常驻内存，记录区间内的起始、峰值和结束值"""
+
+    def __init__(self, pid='self', interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.start_mb = self.peak_mb = self.end_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        memory = process_memory(self.pid)
+        if memory is None:
+            return
+        self.end_mb = memory['rss_mb']
+        if self.start_mb is None:
+            self.start_mb = self.end_mb
+        self.peak_mb = max(self.peak_mb or 0, self.end_mb)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="memory-sampler")
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def to_dict(self):
+        return {'rss_start_mb': self.start_mb, 'rss_peak_mb': self.peak_mb, 'rss_end_mb': self.end_mb}
+
+
+def _git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def environment():
+    """运行环境，对比结果时用来确认两次运行是否可比"""
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'argv': sys.argv[1:],
+    }
+
+
+def save_results(name, config, results, output=None):
+    """写出结果文件，返回路径"""
+    if not output:
+        os.makedirs(DEFAULT_RESULTS_DIR, exist_ok=True)
+        output = os.path.join(DEFAULT_RESULTS_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    document = {'benchmark': name, 'environment': environment(), 'config': config, 'results': results}
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(document, f, ensure_ascii=False, indent=2)
+    return output
@@ -0,0 +1,177 @@
+"""
+客户端断开后取消聊天运行
+
+用户中途关闭聊天面板或刷新页面后，不应继续为没有人看的回答调用模型、搜索和抓取网页：
+- 断开检测：ASGI 模式监听 http.disconnect；Flask 模式在等待下一段输出时定期检查连接是否已被对端关闭
+  （否则只有下一次写入失败时才会发现，而工具调用期间可能很久都没有输出）
+- 检测到断开后取消驱动 agent.astream 的协程，LangGraph 随之取消正在执行的模型调用和异步工具
+- 线程池中执行的同步工具无法被强行终止：工具把正在进行的 HTTP 请求登记到本次运行的 CancelToken，
+  取消时关闭这些连接，阻塞的读取立即出错返回，线程随即释放
+- 指标：被取消的运行数（按取消时所处的阶段）、被中止的请求数、估算节省的模型时间
+"""
+import select
+import socket
+import threading
+
+from metrics import Counter
+
+CHAT_RUNS_CANCELLED = Counter(
+    'chat_runs_cancelled_total',
+    '客户端断开后被取消的聊天运行数，stage 为取消时所处的阶段：llm、tool 或 stream',
+    ['stage'],
+)
+CHAT_CANCELLED_IO_ABORTED = Counter(
+    'chat_cancelled_io_aborted_total',
+    '运行被取消时中止的进行中请求数（网页抓取等）',
+)
+CHAT_LLM_SECONDS_SAVED = Counter(
+    'chat_cancelled_llm_seconds_saved_total',
+    '取消运行节省的模型时间（估算值：完成的运行平均花在模型上的时间减去被取消的运行已经花掉的时间）',
+)
+
+
+class RunCancelled(Exception):
+    """运行已被取消"""
+
+
+class CancelToken:
+    """一次运行的取消标记；on_cancel 登记的回调在取消时执行（已取消时立即执行）"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self._next_handle = 0
+        self.aborted = 0
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise RunCancelled("运行已取消")
+
+    def on_cancel(self, callback):
+        """登记取消时的回调，返回用于 remove() 的句柄"""
+        with self._lock:
+            if not self._event.is_set():
+                self._next_handle += 1
+                self._callbacks[self._next_handle] = callback
+                return self._next_handle
+        self._abort(callback)
+        return None
+
+    def remove(self, handle):
+        with self._lock:
+            self._callbacks.pop(handle, None)
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = list(self._callbacks.values()), {}
+        for callback in callbacks:
+            self._abort(callback)
+
+    def _abort(self, callback):
+        self.aborted += 1
+        CHAT_CANCELLED_IO_ABORTED.inc()
+        try:
+            callback()
+        except Exception:
+            pass
+
+
+class RunRegistry:
+    """进行中的运行（request_id -> CancelToken），工具通过 config 中的 request_id 找到所属运行的标记"""
+
+    def __init__(self, alpha=0.2):
+        self._tokens = {}
+        self._lock = threading.Lock()
+        # 完成的运行花在模型上的平均秒数（指数移动平均），用于估算取消节省的时间
+        self._alpha = alpha
+        self._llm_seconds = None
+
+    def start(self, request_id):
+        token = CancelToken()
+        with self._lock:
+            self._tokens[request_id] = token
+        return token
+
+    def get(self, request_id):
+        with self._lock:
+            return self._tokens.get(request_id)
+
+    def finish(self, request_id, token, trace, status):
+        """运行结束：status 为 aborted（生成器被关闭或协程被取消）时记录指标并返回取消信息
+
+        无论结果如何都会取消标记：运行超时或出错时，线程池中可能还有工具的请求没有结束。
+        """
+        with self._lock:
+            # 上游重复使用同一个 X-Request-Id 时，只移除自己登记的标记
+            if self._tokens.get(request_id) is token:
+                del self._tokens[request_id]
+        llm_seconds = trace.time_in('llm') / 1000
+        if status != 'aborted':
+            if status == 'ok' and llm_seconds > 0:
+                self._observe(llm_seconds)
+            token.cancel()
+            return None
+        # 先确定所处阶段：取消标记会中止工具的请求，工具随即结束自己的 span
+        stage = trace.interrupted_span_kind() or 'stream'
+        token.cancel()
+        saved = max((self._llm_seconds or 0) - llm_seconds, 0)
+        CHAT_RUNS_CANCELLED.labels(stage=stage).inc()
+        CHAT_LLM_SECONDS_SAVED.inc(saved)
+        return {
+            'stage': stage,
+            'llm_ms_spent': round(llm_seconds * 1000),
+            'llm_ms_saved': round(saved * 1000),
+            'io_aborted': token.aborted,
+        }
+
+    def _observe(self, seconds):
+        with self._lock:
+            if self._llm_seconds is None:
+                self._llm_seconds = seconds
+            else:
+                self._llm_seconds += self._alpha * (seconds - self._llm_seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active_runs': len(self._tokens),
+                'avg_llm_seconds': round(self._llm_seconds, 3) if self._llm_seconds is not None else None,
+            }
+
+
+run_registry = RunRegistry()
+
+
+def token_from_config(config):
+    """工具调用的 RunnableConfig -> 所属运行的 CancelToken（不在聊天运行中时为 None）"""
+    request_id = ((config or {}).get('configurable') or {}).get('request_id')
+    return run_registry.get(request_id) if request_id else None
+
+
+def _readable(sock):
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+        return bool(poller.poll(0))
+    return bool(select.select([sock], [], [], 0)[0])
+
+
+def socket_disconnected(sock):
+    """对端是否已关闭连接（请求体已读完，可读且读到 EOF 即为断开）；不阻塞"""
+    try:
+        if not _readable(sock):
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b''
+    except (ValueError, NotImplementedError):
+        # TLS 套接字不支持 MSG_PEEK，无法判断
+        return False
+    except OSError:
+        return True
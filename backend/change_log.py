@@ -0,0 +1,87 @@
+"""
+跨进程的文件变化广播
+
+多进程部署时每个工作进程都有自己的文件树缓存。某个进程通过 API 修改文件后，把受影响的路径追加到
+共享的 SQLite（WAL 模式）表中；其他进程在读取文件树前调用 poll() 取回新记录，使本地缓存失效，
+因此刚写入的文件在任何工作进程上都立即可见，不必等待文件监听的去抖延迟。
+
+没有新写入时 poll() 只执行一次 PRAGMA data_version（不读表），开销可以忽略。
+"""
+import os
+import threading
+import time
+
+from prefork import connect_shared_db
+
+# 默认的日志文件位置
+DEFAULT_CHANGE_LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'file_changes.db')
+
+
+class ChangeLog:
+    """追加式的变化记录，记录保留 retention_seconds 秒"""
+
+    def __init__(self, path=DEFAULT_CHANGE_LOG_PATH, retention_seconds=3600):
+        self.path = path
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+        self._last_seq = 0
+        self._data_version = None
+        self._trimmed_at = 0.0
+
+    def _connect(self):
+        """每个进程各自打开连接，打开时从当前末尾开始读取"""
+        if self._db is not None and self._pid == os.getpid():
+            return self._db
+        db = connect_shared_db(self.path)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS changes ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, origin INTEGER NOT NULL, "
+            "workspace TEXT NOT NULL, path TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        db.commit()
+        # AUTOINCREMENT 的序号不会复用，即使记录已被清理也从最后分配的序号开始
+        row = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+        self._last_seq = row[0] if row else 0
+        self._data_version = db.execute("PRAGMA data_version").fetchone()[0]
+        self._db = db
+        self._pid = os.getpid()
+        return db
+
+    def publish(self, workspace, paths):
+        """记录本进程造成的变化"""
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            db.executemany(
+                "INSERT INTO changes (origin, workspace, path, created_at) VALUES (?, ?, ?, ?)",
+                [(self._pid, workspace, path, now) for path in paths],
+            )
+            if now - self._trimmed_at > 60:
+                db.execute("DELETE FROM changes WHERE created_at < ?", (now - self.retention_seconds,))
+                self._trimmed_at = now
+            db.commit()
+
+    def poll(self):
+        """返回其他进程自上次调用以来记录的 [(workspace, path)]
+
+        本进程落后太多、所需的记录已被清理时返回 None，调用方应使全部缓存失效。
+        """
+        with self._lock:
+            db = self._connect()
+            # data_version 只在其他连接提交后变化
+            data_version = db.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return []
+            self._data_version = data_version
+            rows = db.execute(
+                "SELECT seq, origin, workspace, path FROM changes WHERE seq > ? ORDER BY seq", (self._last_seq,)
+            ).fetchall()
+            if not rows:
+                return []
+            truncated = rows[0][0] > self._last_seq + 1
+            self._last_seq = rows[-1][0]
+            if truncated:
+                return None
+            return [(workspace, path) for _, origin, workspace, path in rows if origin != self._pid]
@@ -0,0 +1,427 @@
+"""
+对话检查点存储
+
+在 LangGraph 的 InMemorySaver 之上增加：
+- 按 thread_id 的 LRU 淘汰（最大线程数 + 空闲 TTL），保证内存占用有上限
+- 每个线程只保留最近若干个检查点，避免单个会话无限增长
+- 可选的 SQLite 磁盘层：被淘汰的线程落盘，再次访问时自动加载回内存
+- 共享模式（多进程部署）：每次写入都同步落盘并生成新的版本号，读取前比较版本号，
+  其他进程写过的线程会重新加载，因此任何工作进程都能继续任何会话。
+  磁盘上按 (线程, 命名空间, 检查点) 分行存储，每次写入只落盘变化的检查点 / writes / blob；
+  SQLite 读写在保存器的锁之外进行，异步接口在线程池中执行，不占用事件循环
+"""
+import asyncio
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from langgraph.checkpoint.memory import InMemorySaver
+from prefork import SERVICE_WORKERS, connect_shared_db
+from service_log import get_logger
+
+logger = get_logger("checkpoint_store")
+
+# 共享模式下未设置 CHECKPOINT_SQLITE_PATH 时使用的文件
+DEFAULT_SHARED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'checkpoints.db')
+
+
+class BoundedCheckpointSaver(InMemorySaver):
+    """带容量/TTL 上限和可选 SQLite 磁盘层的检查点存储
+
+    shared=True 时磁盘层是多个进程共用的权威副本，内存只作缓存（要求设置 sqlite_path）。
+    同一会话在两个进程中同时写入时以后写入的为准。
+    """
+
+    def __init__(self, max_threads=256, ttl_seconds=3600, max_checkpoints=8,
+                 sqlite_path=None, sqlite_ttl_seconds=7 * 24 * 3600, shared=False, **kwargs):
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self.ttl_seconds = ttl_seconds
+        self.max_checkpoints = max_checkpoints
+        self.sqlite_ttl_seconds = sqlite_ttl_seconds
+        # thread_id -> 最后访问时间，按访问顺序排列（最旧的在前）
+        self._access = OrderedDict()
+        self._lock = threading.RLock()
+        # 数据库连接的锁；需要同时持有时先取 _lock 再取 _db_lock
+        self._db_lock = threading.Lock()
+        self._db = None
+        self.shared = bool(shared and sqlite_path)
+        # thread_id -> 内存中数据对应的磁盘版本号（共享模式）
+        self._versions = {}
+        if sqlite_path:
+            self._db = self._open_db(sqlite_path)
+
+    # ---------- 磁盘层 ----------
+
+    def _open_db(self, sqlite_path):
+        """打开（或创建）SQLite 磁盘层"""
+        if self.shared:
+            db = connect_shared_db(sqlite_path)
+        else:
+            directory = os.path.dirname(os.path.abspath(sqlite_path))
+            os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(sqlite_path, check_same_thread=False)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS threads ("
+            "thread_id TEXT PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL, version TEXT)"
+        )
+        columns = {row[1] for row in db.execute("PRAGMA table_info(threads)")}
+        if 'version' not in columns:
+            db.execute("ALTER TABLE threads ADD COLUMN version TEXT")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_threads_updated ON threads(updated_at)")
+        if self.shared:
+            # 共享模式逐行存储：shared_threads 记录版本号，其余三张表各对应 InMemorySaver 的一个字典
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS shared_threads (
+                    thread_id TEXT PRIMARY KEY, version TEXT NOT NULL, updated_at REAL NOT NULL);
+                CREATE INDEX IF NOT EXISTS idx_shared_threads_updated ON shared_threads(updated_at);
+                CREATE TABLE IF NOT EXISTS shared_checkpoints (
+                    thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL,
+                    data BLOB NOT NULL, PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id));
+                CREATE TABLE IF NOT EXISTS shared_writes (
+                    thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL,
+                    data BLOB NOT NULL, PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id));
+                CREATE TABLE IF NOT EXISTS shared_blobs (
+                    thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, channel TEXT NOT NULL, version TEXT NOT NULL,
+                    data BLOB NOT NULL, PRIMARY KEY (thread_id, checkpoint_ns, channel, version));
+            """)
+        db.commit()
+        return db
+
+    def _execute(self, statements):
+        """在一个事务中执行 [(sql, 参数)]，调用方持有 _db_lock"""
+        try:
+            for sql, params in statements:
+                self._db.execute(sql, params)
+            self._db.commit()
+        except sqlite3.Error as e:
+            self._db.rollback()
+            logger.warning("⚠️ 写入会话检查点失败: %s", e)
+
+    def _export_thread(self, thread_id):
+        """导出某个线程在内存中的全部数据（均为已序列化的字节）"""
+        return {
+            'storage': {ns: dict(cps) for ns, cps in self.storage.get(thread_id, {}).items()},
+            'writes': {k: v for k, v in self.writes.items() if k[0] == thread_id},
+            'blobs': {k: v for k, v in self.blobs.items() if k[0] == thread_id},
+        }
+
+    def _import_thread(self, thread_id, data):
+        """把磁盘层的线程数据装回内存"""
+        for ns, cps in data['storage'].items():
+            self.storage[thread_id][ns].update(cps)
+        for k, v in data['writes'].items():
+            self.writes[k] = v
+        self.blobs.update(data['blobs'])
+
+    def _spill(self, thread_id):
+        """把线程整体写入磁盘层（非共享模式，线程被淘汰时）"""
+        if self._db is None or not self.storage.get(thread_id):
+            return
+        data = pickle.dumps(self._export_thread(thread_id), protocol=pickle.HIGHEST_PROTOCOL)
+        with self._db_lock:
+            self._execute([(
+                "INSERT OR REPLACE INTO threads (thread_id, data, updated_at, version) VALUES (?, ?, ?, ?)",
+                (thread_id, data, time.time(), uuid.uuid4().hex),
+            )])
+
+    def _load(self, thread_id):
+        """内存未命中时尝试从磁盘层加载线程"""
+        if self._db is None:
+            return
+        if self.shared:
+            self._load_shared(thread_id)
+            return
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT data, updated_at FROM threads WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+            if row is None:
+                return
+            data, updated_at = row
+            if self.sqlite_ttl_seconds and time.time() - updated_at > self.sqlite_ttl_seconds:
+                self._execute([("DELETE FROM threads WHERE thread_id = ?", (thread_id,))])
+                return
+        try:
+            self._import_thread(thread_id, pickle.loads(data))
+        except Exception as e:
+            logger.warning("⚠️ 加载会话检查点失败 %s: %s", thread_id, e)
+
+    def _load_shared(self, thread_id):
+        """共享模式：从逐行存储中加载线程的全部检查点、writes 和 blob"""
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT version FROM shared_threads WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+            if row is None:
+                return
+            checkpoints = self._db.execute(
+                "SELECT checkpoint_ns, checkpoint_id, data FROM shared_checkpoints WHERE thread_id = ?", (thread_id,)
+            ).fetchall()
+            writes = self._db.execute(
+                "SELECT checkpoint_ns, checkpoint_id, data FROM shared_writes WHERE thread_id = ?", (thread_id,)
+            ).fetchall()
+            blobs = self._db.execute("SELECT data FROM shared_blobs WHERE thread_id = ?", (thread_id,)).fetchall()
+        try:
+            data = {
+                'storage': {},
+                'writes': {(thread_id, ns, cid): pickle.loads(value) for ns, cid, value in writes},
+                'blobs': dict(pickle.loads(value) for value, in blobs),
+            }
+            for ns, cid, value in checkpoints:
+                data['storage'].setdefault(ns, {})[cid] = pickle.loads(value)
+            self._import_thread(thread_id, data)
+            self._versions[thread_id] = row[0]
+        except Exception as e:
+            logger.warning("⚠️ 加载会话检查点失败 %s: %s", thread_id, e)
+
+    def _purge_disk(self):
+        """清理磁盘层中过期的线程"""
+        if self._db is None or not self.sqlite_ttl_seconds:
+            return
+        cutoff = time.time() - self.sqlite_ttl_seconds
+        if self.shared:
+            expired = "SELECT thread_id FROM shared_threads WHERE updated_at < ?"
+            statements = [(f"DELETE FROM {table} WHERE thread_id IN ({expired})", (cutoff,))
+                          for table in ('shared_checkpoints', 'shared_writes', 'shared_blobs')]
+            statements.append(("DELETE FROM shared_threads WHERE updated_at < ?", (cutoff,)))
+        else:
+            statements = [("DELETE FROM threads WHERE updated_at < ?", (cutoff,))]
+        with self._db_lock:
+            self._execute(statements)
+
+    def _refresh(self, thread_id):
+        """共享模式：磁盘上的版本与内存不同（其他进程写入或删除过）时丢弃内存中的数据并重新加载"""
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT version FROM shared_threads WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+        disk_version = row[0] if row else None
+        if disk_version is not None and disk_version == self._versions.get(thread_id):
+            return
+        if thread_id in self._versions or thread_id in self.storage:
+            self._versions.pop(thread_id, None)
+            InMemorySaver.delete_thread(self, thread_id)
+        if disk_version is not None:
+            self._load_shared(thread_id)
+
+    def _bump_version(self, thread_id):
+        """共享模式：为线程生成新的版本号，返回记录它的语句"""
+        version = uuid.uuid4().hex
+        self._versions[thread_id] = version
+        return ("INSERT OR REPLACE INTO shared_threads (thread_id, version, updated_at) VALUES (?, ?, ?)",
+                (thread_id, version, time.time()))
+
+    def _write_shared(self, statements):
+        """在持有 _lock 时调用：先取得数据库锁再释放 _lock，在锁外执行写入
+
+        同一进程内的写入按顺序落盘；落盘完成前，其他线程的 _refresh 会等待数据库锁，
+        不会因为看到旧版本号而丢弃内存中较新的数据。
+        """
+        self._db_lock.acquire()
+        self._lock.release()
+        try:
+            self._execute(statements)
+        finally:
+            self._db_lock.release()
+            self._lock.acquire()
+
+    # ---------- LRU / TTL ----------
+
+    def _touch(self, thread_id):
+        """记录一次访问；首次访问时从磁盘层加载（共享模式下每次都校验版本），并执行淘汰"""
+        if self.shared:
+            self._refresh(thread_id)
+        elif thread_id not in self._access and thread_id not in self.storage:
+            self._load(thread_id)
+        self._access[thread_id] = time.time()
+        self._access.move_to_end(thread_id)
+        self._evict(keep=thread_id)
+
+    def _evict(self, keep=None):
+        """淘汰超过 TTL 或超出容量的线程"""
+        now = time.time()
+        evicted = False
+        while self._access:
+            thread_id, last_access = next(iter(self._access.items()))
+            if thread_id == keep:
+                break
+            expired = self.ttl_seconds and now - last_access > self.ttl_seconds
+            if not expired and len(self._access) <= self.max_threads:
+                break
+            self._access.pop(thread_id)
+            if not self.shared:
+                # 共享模式下每次写入都已落盘
+                self._spill(thread_id)
+            self._versions.pop(thread_id, None)
+            InMemorySaver.delete_thread(self, thread_id)
+            evicted = True
+        if evicted:
+            self._purge_disk()
+
+    def _prune(self, thread_id, checkpoint_ns):
+        """只保留线程最近的 max_checkpoints 个检查点，返回删除的 (检查点 ID 列表, blob 键列表)"""
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if not self.max_checkpoints or len(checkpoints) <= self.max_checkpoints * 2:
+            return [], []
+        removed = sorted(checkpoints)[:-self.max_checkpoints]
+        for checkpoint_id in removed:
+            checkpoints.pop(checkpoint_id, None)
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        # 回收不再被任何检查点引用的 blob
+        referenced = set()
+        for checkpoint, _, _ in checkpoints.values():
+            versions = self.serde.loads_typed(checkpoint).get('channel_versions', {})
+            referenced.update(versions.items())
+        unreferenced = [k for k in self.blobs
+                        if k[0] == thread_id and k[1] == checkpoint_ns and (k[2], k[3]) not in referenced]
+        for key in unreferenced:
+            del self.blobs[key]
+        return removed, unreferenced
+
+    def stats(self):
+        """返回当前存储状态（用于状态接口）"""
+        with self._lock:
+            disk_threads = 0
+            if self._db is not None:
+                table = 'shared_threads' if self.shared else 'threads'
+                with self._db_lock:
+                    disk_threads = self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            return {
+                'memory_threads': len(self._access),
+                'max_threads': self.max_threads,
+                'ttl_seconds': self.ttl_seconds,
+                'disk_threads': disk_threads,
+                'disk_enabled': self._db is not None,
+                'shared': self.shared,
+            }
+
+    # ---------- BaseCheckpointSaver 接口 ----------
+    # InMemorySaver 的异步方法直接调用同步方法；非共享模式只需覆盖同步版本
+
+    def get_tuple(self, config):
+        with self._lock:
+            self._touch(config["configurable"]["thread_id"])
+            return super().get_tuple(config)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        with self._lock:
+            if config:
+                self._touch(config["configurable"]["thread_id"])
+            # 在锁内物化结果，避免迭代时字典被其他线程修改
+            return iter(list(super().list(config, filter=filter, before=before, limit=limit)))
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with self._lock:
+            thread_id = config["configurable"]["thread_id"]
+            checkpoint_ns = config["configurable"]["checkpoint_ns"]
+            self._touch(thread_id)
+            result = super().put(config, checkpoint, metadata, new_versions)
+            removed, unreferenced = self._prune(thread_id, checkpoint_ns)
+            if self.shared:
+                # 只落盘这一个检查点和它新增的 blob，以及被裁剪掉的行
+                checkpoint_id = checkpoint["id"]
+                statements = [(
+                    "INSERT OR REPLACE INTO shared_checkpoints (thread_id, checkpoint_ns, checkpoint_id, data) "
+                    "VALUES (?, ?, ?, ?)",
+                    (thread_id, checkpoint_ns, checkpoint_id,
+                     pickle.dumps(self.storage[thread_id][checkpoint_ns][checkpoint_id])),
+                )]
+                for channel, version in new_versions.items():
+                    key = (thread_id, checkpoint_ns, channel, version)
+                    if key in self.blobs:
+                        statements.append((
+                            "INSERT OR REPLACE INTO shared_blobs (thread_id, checkpoint_ns, channel, version, data) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (thread_id, checkpoint_ns, channel, str(version), pickle.dumps((key, self.blobs[key]))),
+                        ))
+                for removed_id in removed:
+                    for table in ('shared_checkpoints', 'shared_writes'):
+                        statements.append((
+                            f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                            (thread_id, checkpoint_ns, removed_id),
+                        ))
+                for key in unreferenced:
+                    statements.append((
+                        "DELETE FROM shared_blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? "
+                        "AND version = ?",
+                        (key[0], key[1], key[2], str(key[3])),
+                    ))
+                statements.append(self._bump_version(thread_id))
+                self._write_shared(statements)
+            return result
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with self._lock:
+            thread_id = config["configurable"]["thread_id"]
+            self._touch(thread_id)
+            result = super().put_writes(config, writes, task_id, task_path)
+            if self.shared:
+                # 只落盘这一个检查点的 writes
+                checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+                checkpoint_id = config["configurable"]["checkpoint_id"]
+                pending = self.writes.get((thread_id, checkpoint_ns, checkpoint_id))
+                if pending:
+                    self._write_shared([(
+                        "INSERT OR REPLACE INTO shared_writes (thread_id, checkpoint_ns, checkpoint_id, data) "
+                        "VALUES (?, ?, ?, ?)",
+                        (thread_id, checkpoint_ns, checkpoint_id, pickle.dumps(pending)),
+                    ), self._bump_version(thread_id)])
+            return result
+
+    def delete_thread(self, thread_id):
+        with self._lock:
+            self._access.pop(thread_id, None)
+            self._versions.pop(thread_id, None)
+            super().delete_thread(thread_id)
+            if self._db is not None:
+                tables = ('shared_threads', 'shared_checkpoints', 'shared_writes', 'shared_blobs') \
+                    if self.shared else ('threads',)
+                with self._db_lock:
+                    self._execute([(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,)) for table in tables])
+
+    # 共享模式下读写都要访问 SQLite，放到线程池中执行，不阻塞事件循环上的其他流
+
+    async def aget_tuple(self, config):
+        if not self.shared:
+            return self.get_tuple(config)
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        if not self.shared:
+            items = self.list(config, filter=filter, before=before, limit=limit)
+        else:
+            items = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: self.list(config, filter=filter, before=before, limit=limit))
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        if not self.shared:
+            return self.put(config, checkpoint, metadata, new_versions)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        if not self.shared:
+            return self.put_writes(config, writes, task_id, task_path)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.put_writes, config, writes, task_id, task_path)
+
+
+def create_checkpointer():
+    """根据环境变量创建检查点存储；多进程部署（SERVICE_WORKERS > 1 或 CHECKPOINT_SHARED=1）时使用共享模式"""
+    shared = SERVICE_WORKERS > 1 or os.getenv("CHECKPOINT_SHARED", "0") == "1"
+    return BoundedCheckpointSaver(
+        max_threads=int(os.getenv("CHECKPOINT_MAX_THREADS", "256")),
+        ttl_seconds=int(os.getenv("CHECKPOINT_TTL_SECONDS", "3600")),
+        max_checkpoints=int(os.getenv("CHECKPOINT_MAX_PER_THREAD", "8")),
+        sqlite_path=os.getenv("CHECKPOINT_SQLITE_PATH") or (DEFAULT_SHARED_PATH if shared else None),
+        sqlite_ttl_seconds=int(os.getenv("CHECKPOINT_SQLITE_TTL_SECONDS", str(7 * 24 * 3600))),
+        shared=shared,
+    )
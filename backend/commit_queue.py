@@ -0,0 +1,205 @@
+"""
+Agent 写文件的提交队列
+
+write_file 工具只把内容暂存到 temp_docs/，由唯一的后台线程在本轮对话结束时统一发布到 docs/：
+- 同一会话内对同一路径的多次写入合并为一次
+- 对话流结束时 flush(thread_id)，一批文件集中 os.replace，Docusaurus 只触发一次重新构建
+- 超过 max_delay 仍未被 flush 的暂存文件也会自动发布（例如调用方异常退出）
+- 进程重启后，temp_docs/ 中残留的暂存文件会在启动时发布
+- 由服务启动时调用 start()（或第一次暂存时自动启动），导入模块不会启动线程
+- pre-fork 模式下每个工作进程有自己的暂存目录（temp_docs.worker-N）和发布线程，只恢复自己目录中的残留文件；
+  主进程在 fork 之前调用 recover() 恢复全部暂存目录（不启动线程），单进程模式在 start() 时恢复
+"""
+import glob
+import os
+import queue
+import threading
+import time
+import weakref
+from prefork import worker_index
+from service_log import get_logger
+
+logger = get_logger("commit_queue")
+
+_instances = weakref.WeakSet()
+
+
+class CommitQueue:
+    """暂存 + 批量发布的单线程提交队列"""
+
+    def __init__(self, staging_dir, target_dir, on_commit=None, max_delay=60.0):
+        self.staging_root = os.path.abspath(staging_dir)
+        self.staging_dir = self.staging_root
+        self.target_dir = os.path.abspath(target_dir)
+        self.on_commit = on_commit
+        self.max_delay = max_delay
+        # thread_id -> {相对路径: 暂存时间}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self.committed = 0
+        self.batches = 0
+        _instances.add(self)
+
+    def _resolve(self, root, rel_path):
+        full_path = os.path.realpath(os.path.join(root, rel_path))
+        if not full_path.startswith(os.path.realpath(root) + os.sep):
+            raise ValueError(f"非法的文件路径: {rel_path}")
+        return full_path
+
+    def stage(self, thread_id, rel_path, content):
+        """写入暂存区，返回写入的字节数；同一路径的重复写入会覆盖之前的暂存内容"""
+        self.start()
+        self._resolve(self.target_dir, rel_path)
+        staging_path = self._resolve(self.staging_dir, rel_path)
+        os.makedirs(os.path.dirname(staging_path), exist_ok=True)
+        data = content.encode('utf-8')
+        with self._lock:
+            tmp_path = f"{staging_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, staging_path)
+            self._pending.setdefault(thread_id, {})[rel_path] = time.monotonic()
+        return len(data)
+
+    def flush(self, thread_id):
+        """请求发布某个会话暂存的全部文件（异步执行，立即返回）"""
+        with self._lock:
+            if thread_id not in self._pending:
+                return
+        self._queue.put(thread_id)
+
+    def pending_count(self):
+        with self._lock:
+            return sum(len(paths) for paths in self._pending.values())
+
+    # ---------- 后台线程 ----------
+
+    def start(self):
+        """启动当前进程的后台线程（幂等），启动前先发布残留的暂存文件
+
+        pre-fork 工作进程第一次调用时确定自己的暂存目录，因此要在 fork 之后、暂存文件之前调用。
+        """
+        with self._start_lock:
+            if self._worker is not None:
+                return
+            index = worker_index()
+            if index is None:
+                self.staging_dir = self.staging_root
+                self.recover()
+            else:
+                self.staging_dir = f"{self.staging_root}.worker-{index}"
+                self._recover(self.staging_dir)
+            self._worker = threading.Thread(target=self._run, name="commit-queue", daemon=True)
+            self._worker.start()
+
+    def recover(self, notify=True):
+        """同步发布所有暂存目录（包括各工作进程的目录）中的残留文件，不启动线程
+
+        只能在没有工作进程写入时调用：单进程启动时，或 pre-fork 主进程 fork 之前。
+        notify=False 时不调用 on_commit。
+        """
+        for directory in [self.staging_root] + sorted(glob.glob(f"{glob.escape(self.staging_root)}.worker-*")):
+            self._recover(directory, notify)
+
+    def _reset_after_fork(self):
+        """fork 出的子进程里没有父进程的后台线程，锁也可能正被它持有，全部换新；暂存目录在 start() 时重新确定"""
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._worker = None
+        self.staging_dir = self.staging_root
+
+    def _take(self, thread_ids=None):
+        """取出要发布的路径：指定会话的全部文件，或所有超过 max_delay 的文件"""
+        now = time.monotonic()
+        paths = set()
+        with self._lock:
+            for thread_id in list(self._pending):
+                staged = self._pending[thread_id]
+                if thread_ids is not None and thread_id in thread_ids:
+                    paths.update(staged)
+                    del self._pending[thread_id]
+                    continue
+                for rel_path, staged_at in list(staged.items()):
+                    if now - staged_at >= self.max_delay:
+                        paths.add(rel_path)
+                        del staged[rel_path]
+                if not staged:
+                    del self._pending[thread_id]
+            # 同一路径可能还被其他会话暂存，一并发布，避免之后用旧内容覆盖
+            for thread_id in list(self._pending):
+                staged = self._pending[thread_id]
+                for rel_path in paths.intersection(staged):
+                    del staged[rel_path]
+                if not staged:
+                    del self._pending[thread_id]
+        return sorted(paths)
+
+    def _commit(self, paths, staging_dir=None, notify=True):
+        staging_dir = staging_dir or self.staging_dir
+        committed = []
+        with self._lock:
+            for rel_path in paths:
+                staging_path = os.path.join(staging_dir, rel_path)
+                final_path = os.path.join(self.target_dir, rel_path)
+                try:
+                    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                    os.replace(staging_path, final_path)
+                    committed.append(rel_path)
+                except FileNotFoundError:
+                    # 已经随同一批次发布
+                    continue
+                except OSError as e:
+                    logger.error("❌ 发布文件失败 %s: %s", rel_path, e)
+        if not committed:
+            return
+        self.committed += len(committed)
+        self.batches += 1
+        logger.info("✅ 已发布 %d 个文件到 %s: %s", len(committed), self.target_dir, ', '.join(committed))
+        if self.on_commit and notify:
+            try:
+                self.on_commit(committed)
+            except Exception as e:
+                logger.warning("⚠️ 发布后回调出错: %s", e)
+
+    def _recover(self, staging_dir, notify=True):
+        """发布上次进程退出前残留在暂存目录中的文件"""
+        leftovers = []
+        for directory, _, files in os.walk(staging_dir):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                leftovers.append(os.path.relpath(os.path.join(directory, name), staging_dir))
+        with self._lock:
+            staged = {path for paths in self._pending.values() for path in paths}
+        leftovers = [path for path in leftovers if path not in staged]
+        if leftovers:
+            self._commit(leftovers, staging_dir, notify)
+
+    def _run(self):
+        while True:
+            try:
+                thread_ids = {self._queue.get(timeout=min(self.max_delay, 5.0))}
+            except queue.Empty:
+                thread_ids = set()
+            # 同时到达的多个 flush 合并成一批
+            while True:
+                try:
+                    thread_ids.add(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            paths = self._take(thread_ids)
+            if paths:
+                self._commit(paths)
+
+
+def _reset_after_fork():
+    for commit_queue in list(_instances):
+        commit_queue._reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
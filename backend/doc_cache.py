@@ -0,0 +1,246 @@
+"""
+文档缓存与章节级检索
+
+- 解析后的文档按路径缓存，以 (mtime, size) 判断是否失效，文件未变化时不再重复读取
+- 文档按 Markdown 标题切分为章节（忽略代码块中的 #）
+- 根据问题或指定标题，在 token 预算内只返回相关章节
+"""
+import hashlib
+import math
+import os
+import re
+import threading
+import urllib.parse
+from collections import Counter, OrderedDict
+
+from tokenizer import tokenize, estimate_tokens
+from service_log import get_logger
+
+logger = get_logger("doc_cache")
+
+DOCS_DIR = "../docs"
+
+_HEADING_RE = re.compile(r'^(#{1,6})\s+(.+?)\s*#*\s*$')
+_FENCE_RE = re.compile(r'^\s*(```|~~~)')
+
+
+class Section:
+    """文档中的一个章节（标题及其下的正文，不含子章节）"""
+
+    __slots__ = ('title', 'level', 'breadcrumb', 'text', 'terms', 'tokens')
+
+    def __init__(self, title, level, breadcrumb, text):
+        self.title = title
+        self.level = level
+        self.breadcrumb = breadcrumb
+        self.text = text
+        self.terms = Counter(tokenize(text))
+        self.tokens = estimate_tokens(text)
+
+
+class ParsedDocument:
+    """解析后的文档"""
+
+    def __init__(self, path, mtime_ns, size, content):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.content = content
+        self.content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        self.sections = parse_sections(content)
+        self.tokens = sum(section.tokens for section in self.sections)
+
+    def outline(self):
+        """文档大纲（标题列表）"""
+        return [f"{'  ' * (s.level - 1)}- {s.title}" for s in self.sections if s.level > 0]
+
+
+def parse_sections(content):
+    """按标题把 Markdown 切分为章节"""
+    sections = []
+    stack = []  # 当前标题路径 [(level, title)]
+    title, level, lines = '', 0, []
+    in_fence = False
+
+    def flush():
+        text = '\n'.join(lines).strip()
+        if text or level > 0:
+            breadcrumb = ' > '.join(t for _, t in stack)
+            sections.append(Section(title, level, breadcrumb, text))
+
+    for line in content.splitlines():
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+        match = None if in_fence else _HEADING_RE.match(line)
+        if match:
+            flush()
+            level = len(match.group(1))
+            title = match.group(2)
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+            stack.append((level, title))
+            lines = [line]
+        else:
+            lines.append(line)
+    flush()
+    return sections
+
+
+def resolve_doc_path(file_path):
+    """把前端传来的页面路径（/docs/xxx、docs/xxx 或文件名）转换为本地 Markdown 文件路径"""
+    # URL 解码
+    try:
+        decoded_path = urllib.parse.unquote(file_path)
+    except Exception as e:
+        logger.warning("URL解码失败: %s", e)
+        decoded_path = file_path
+
+    # 去除首尾空格
+    decoded_path = decoded_path.strip()
+
+    # 处理不同的路径格式，提取实际文档路径
+    if decoded_path.startswith('/docs/'):
+        doc_path = decoded_path[6:]  # 去掉 '/docs/'
+    elif decoded_path.startswith('docs/'):
+        doc_path = decoded_path[5:]  # 去掉 'docs/'
+    else:
+        doc_path = decoded_path  # 直接是文件名
+
+    # 去除可能的尾部斜杠
+    doc_path = doc_path.rstrip('/')
+
+    # 构建完整路径
+    full_path = DOCS_DIR + "/" + doc_path
+    # 如果没有扩展名，添加 .md
+    if not full_path.endswith('.md'):
+        full_path += '.md'
+    return full_path
+
+
+class DocumentCache:
+    """按 (路径, mtime, size) 失效的文档解析缓存（LRU）"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        """获取解析后的文档；文件不存在时抛出 FileNotFoundError"""
+        key = os.path.realpath(path)
+        stat = os.stat(key)
+        with self._lock:
+            doc = self._entries.get(key)
+            if doc is not None and doc.mtime_ns == stat.st_mtime_ns and doc.size == stat.st_size:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return doc
+
+        with open(key, 'r', encoding='utf-8') as f:
+            content = f.read()
+        doc = ParsedDocument(key, stat.st_mtime_ns, stat.st_size, content)
+
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = doc
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return doc
+
+    def invalidate(self, path=None):
+        """使某个文档（或全部）缓存失效"""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.realpath(path), None)
+
+
+def _score_sections(doc, question):
+    """用文档内的 BM25 为各章节打分"""
+    query_terms = set(tokenize(question))
+    if not query_terms:
+        return [0.0] * len(doc.sections)
+    n = len(doc.sections)
+    avg_len = sum(sum(s.terms.values()) for s in doc.sections) / max(n, 1) or 1
+    df = Counter(term for s in doc.sections for term in query_terms if term in s.terms)
+    scores = []
+    for section in doc.sections:
+        length = sum(section.terms.values())
+        score = 0.0
+        for term in query_terms:
+            tf = section.terms.get(term, 0)
+            if not tf:
+                continue
+            idf = math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5))
+            score += idf * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * length / avg_len))
+        # 标题命中额外加分
+        title_terms = set(tokenize(section.breadcrumb))
+        score += 1.5 * len(query_terms & title_terms)
+        scores.append(score)
+    return scores
+
+
+def _fit(text, budget):
+    """把文本截断到 token 预算以内"""
+    if estimate_tokens(text) <= budget:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + "\n……（内容已截断）"
+
+
+def select_sections(doc, question='', heading='', max_tokens=2000):
+    """
+    在 token 预算内选出需要返回的章节，按文档顺序返回 (章节列表, 是否有省略)
+
+    - 指定 heading 时返回匹配标题的章节及其子章节
+    - 指定 question 时按相关度挑选章节
+    - 都未指定时从文档开头依次返回
+    """
+    sections = doc.sections
+    if heading:
+        wanted = heading.strip().lstrip('#').strip().lower()
+        chosen = []
+        for i, section in enumerate(sections):
+            if section.level and wanted in section.title.lower():
+                chosen.append(i)
+                for j in range(i + 1, len(sections)):
+                    if sections[j].level and sections[j].level <= section.level:
+                        break
+                    chosen.append(j)
+                break
+        order = chosen
+    elif question:
+        scores = _score_sections(doc, question)
+        order = [i for i in sorted(range(len(sections)), key=lambda i: -scores[i]) if scores[i] > 0]
+        if not order:
+            order = list(range(len(sections)))
+    else:
+        order = list(range(len(sections)))
+
+    picked, used = [], 0
+    for i in order:
+        section = sections[i]
+        if used + section.tokens <= max_tokens:
+            picked.append((i, section.text))
+            used += section.tokens
+        elif not picked:
+            # 第一节就超出预算时截断返回，保证至少有内容
+            picked.append((i, _fit(section.text, max_tokens)))
+            used = max_tokens
+            break
+    picked.sort()
+    return [text for _, text in picked], len(picked) < len(sections)
+
+
+# 全局文档缓存
+document_cache = DocumentCache(max_entries=int(os.getenv("DOC_CACHE_MAX_ENTRIES", "256")))
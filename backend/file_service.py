@@ -1,11 +1,34 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, send_file
 from flask_cors import CORS
+import hashlib
+import itertools
+import json
 import os
+import queue
 import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from search_index import get_search_index
+from file_tree import FileTreeCache
+from file_watcher import FileWatcher
+from change_log import ChangeLog, DEFAULT_CHANGE_LOG_PATH
+from prefork import SERVICE_WORKERS, worker_index
+from http_compression import init_compression
+from metrics import SSE_ACTIVE_STREAMS, init_metrics
+from service_log import configure_logging, get_logger
+
+configure_logging("file")
+logger = get_logger("file_service")
+
 app = Flask(__name__)
 CORS(app)  # 允许前端跨域请求
+init_compression(app)  # 按 Accept-Encoding 压缩响应（br / gzip）
+init_metrics(app)  # 请求耗时统计 + /metrics
 
 # 文件管理配置
 DOCS_ROOT = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'docs')
@@ -23,268 +46,875 @@ def is_safe_path(root_path, user_path):
     except:
         return False
 
-def build_file_tree(root_path, current_path=""):
-    """构建文件树结构"""
-    tree = []
+def content_version(content):
+    """文件内容的版本号（读取时返回，增量保存时用于检测冲突）"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+# 分页读取：每页默认字节数、最大字节数和最大行数
+READ_PAGE_BYTES = 256 * 1024
+MAX_READ_PAGE_BYTES = 4 * 1024 * 1024
+MAX_READ_PAGE_LINES = 20000
+
+def file_version(full_path):
+    """流式计算文件版本号，结果与 content_version(全文) 相同，但不把整个文件读进内存"""
+    digest = hashlib.sha256()
+    with open(full_path, 'r', encoding='utf-8') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), ''):
+            digest.update(chunk.encode('utf-8'))
+    return digest.hexdigest()
+
+def _utf8_tail_missing(data):
+    """末尾被截断的多字节字符还缺几个字节"""
+    for i in range(1, min(4, len(data)) + 1):
+        byte = data[-i]
+        if byte & 0xC0 != 0x80:  # 找到首字节
+            if byte >= 0xF0:
+                need = 4
+            elif byte >= 0xE0:
+                need = 3
+            elif byte >= 0xC0:
+                need = 2
+            else:
+                need = 1
+            return max(need - i, 0)
+    return 0
+
+def read_byte_range(full_path, offset, length):
+    """读取从 offset 开始约 length 字节，按字符边界对齐，返回 (文本, 下一页偏移, 文件大小)。
+    换行与整篇读取一致地统一为 \n，offset 须是上一页返回的 nextOffset"""
+    size = os.path.getsize(full_path)
+    with open(full_path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+        if offset + len(data) < size:
+            data += f.read(_utf8_tail_missing(data))
+            # 不要把 \r\n 拆到两页
+            if data.endswith(b'\r'):
+                if f.read(1) == b'\n':
+                    data += b'\n'
+    text = data.decode('utf-8', errors='replace').replace('\r\n', '\n').replace('\r', '\n')
+    return text, offset + len(data), size
+
+def read_line_range(full_path, start_line, max_lines):
+    """读取从第 start_line 行（从 1 开始）起的最多 max_lines 行，返回 (文本, 是否还有更多)"""
+    with open(full_path, 'r', encoding='utf-8') as f:
+        for _ in itertools.islice(f, start_line - 1):
+            pass
+        lines = list(itertools.islice(f, max_lines))
+        has_more = next(f, None) is not None
+    return ''.join(lines), has_more
+
+# 每个文件一把锁，保证“校验版本 + 写入”在进程内是原子的
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+def file_lock(full_path):
+    key = os.path.realpath(full_path)
+    with _file_locks_guard:
+        lock = _file_locks.get(key)
+        if lock is None:
+            lock = _file_locks[key] = threading.Lock()
+        return lock
+
+def atomic_write(full_path, content):
+    """先写同目录下的临时文件再放到目标位置，读者不会看到写了一半的文件
+
+    已有文件用 os.replace 覆盖（文件监听报告为 modified）；新文件用硬链接放到位（报告为 created），
+    目标在此期间被创建或文件系统不支持硬链接时退回 os.replace。
+    """
+    directory, name = os.path.split(full_path)
+    # 以 . 开头，文件监听和文件树都会忽略
+    tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
     try:
-        full_path = os.path.join(root_path, current_path) if current_path else root_path
-        
-        if not os.path.exists(full_path):
-            return tree
-        
-        for item in sorted(os.listdir(full_path)):
-            if item.startswith('.'):  # 跳过隐藏文件
-                continue
-                
-            item_path = os.path.join(current_path, item) if current_path else item
-            full_item_path = os.path.join(full_path, item)
-            
-            if os.path.isdir(full_item_path):
-                tree.append({
-                    'name': item,
-                    'path': item_path,
-                    'type': 'folder',
-                    'children': build_file_tree(root_path, item_path)
-                })
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(full_path):
+            shutil.copymode(full_path, tmp_path)
+        else:
+            try:
+                os.link(tmp_path, full_path)
+            except OSError:
+                pass
             else:
-                tree.append({
-                    'name': item,
-                    'path': item_path,
-                    'type': 'file'
-                })
+                os.remove(tmp_path)
+                return
+        os.replace(tmp_path, full_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def apply_text_edits(content, edits):
+    """按 UTF-16 偏移（与前端 JavaScript 字符串下标一致）应用编辑。
+    edits: [{'start', 'end', 'text'}]，偏移都相对于同一个基准版本，区间不能重叠"""
+    data = content.encode('utf-16-le')
+    length = len(data) // 2
+    spans = []
+    for edit in edits:
+        start, end = int(edit.get('start', 0)), int(edit.get('end', edit.get('start', 0)))
+        text = edit.get('text') or ''
+        if not isinstance(text, str) or not 0 <= start <= end <= length:
+            raise ValueError('编辑区间超出文件范围')
+        spans.append((start, end, text))
+    spans.sort(key=lambda span: (span[0], span[1]))
+    for previous, current in zip(spans, spans[1:]):
+        if current[0] < previous[1]:
+            raise ValueError('编辑区间重叠')
+    parts = []
+    position = 0
+    for start, end, text in spans:
+        parts.append(data[position * 2:start * 2])
+        parts.append(text.encode('utf-16-le'))
+        position = end
+    parts.append(data[position * 2:])
+    # 偏移落在代理对中间时解码失败
+    return b''.join(parts).decode('utf-16-le')
+
+def workspace_key(workspace):
+    """把请求中的 workspace 归一化为 'docs' 或 'blog'"""
+    return 'docs' if workspace == 'docs' else 'blog'
+
+def update_search_index(action, workspace, *paths):
+    """增量更新搜索索引；索引失败不影响文件操作本身"""
+    try:
+        index = get_search_index()
+        getattr(index, action)(workspace_key(workspace), *paths)
     except Exception as e:
-        print(f"Error building tree for {full_path}: {e}")
-    
-    return tree
+        logger.warning("⚠️ 搜索索引更新失败 (%s %s): %s", action, paths, e)
+
+# 文件树缓存，写操作负责失效；多进程时 ETag 按内容计算，各工作进程一致
+file_tree_cache = FileTreeCache(
+    {'docs': DOCS_ROOT, 'blog': BLOG_ROOT},
+    ttl=float(os.getenv("FILE_TREE_CACHE_TTL", "10")),
+    content_etags=SERVICE_WORKERS > 1,
+    max_snapshots=int(os.getenv("FILE_TREE_MAX_SNAPSHOTS", "64")),
+)
+
+# 多进程时，写操作造成的文件树失效通过共享的变化记录通知其他工作进程
+change_log = ChangeLog(os.getenv("FILE_CHANGE_LOG_PATH") or DEFAULT_CHANGE_LOG_PATH) if SERVICE_WORKERS > 1 else None
+
+def invalidate_tree(workspace, *paths):
+    """文件结构变化后使文件树缓存失效"""
+    for path in paths:
+        file_tree_cache.invalidate(workspace_key(workspace), path)
+    if change_log is not None and paths:
+        try:
+            change_log.publish(workspace_key(workspace), paths)
+        except sqlite3.Error as e:
+            logger.warning("⚠️ 广播文件变化失败 %s: %s", paths, e)
+
+def apply_worker_changes():
+    """取回其他工作进程写入造成的文件树失效"""
+    if change_log is None:
+        return
+    try:
+        changes = change_log.poll()
+    except sqlite3.Error as e:
+        logger.warning("⚠️ 读取文件变化记录失败: %s", e)
+        return
+    if changes is None:
+        # 落后太多，记录已被清理，整体失效
+        for workspace in file_tree_cache.roots:
+            file_tree_cache.invalidate(workspace)
+        return
+    for workspace, path in changes:
+        file_tree_cache.invalidate(workspace, path)
+
+def apply_fs_events(events, update_index=True):
+    """把文件监听事件同步到文件树缓存和搜索索引（update_index=False 时只处理文件树缓存）"""
+    for event in events:
+        workspace, path = event['workspace'], event['path']
+        if event['type'] == 'resync':
+            file_tree_cache.invalidate(workspace)
+            if update_index:
+                get_search_index().sync()
+        elif event['type'] == 'moved':
+            file_tree_cache.invalidate(workspace, event['oldPath'])
+            file_tree_cache.invalidate(workspace, path)
+            if update_index:
+                update_search_index('rename_path', workspace, event['oldPath'], path)
+        elif event['type'] == 'deleted':
+            file_tree_cache.invalidate(workspace, path)
+            if update_index:
+                update_search_index('remove_path', workspace, path)
+        elif event['type'] == 'created':
+            file_tree_cache.invalidate(workspace, path)
+            if update_index:
+                update_search_index('update_path', workspace, path)
+        elif event['type'] == 'modified' and update_index:
+            update_search_index('update_path', workspace, path)
+
+# 文件监听（inotify，回退为轮询），在 start_background_services 中启动
+file_watcher = FileWatcher(
+    {'docs': DOCS_ROOT, 'blog': BLOG_ROOT},
+    on_events=apply_fs_events,
+    debounce=float(os.getenv("FILE_WATCH_DEBOUNCE_MS", "200")) / 1000,
+    poll_interval=float(os.getenv("FILE_WATCH_POLL_INTERVAL", "5")),
+)
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match 的弱比较：逐个比较列表中的 ETag（忽略 W/ 前缀），* 匹配任何 ETag"""
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
 
 @app.route('/api/files/tree', methods=['GET'])
 def get_file_tree():
-    """获取文件树"""
+    """获取文件树（支持 path/depth 按需展开和 ETag 协商缓存）"""
     try:
         workspace = request.args.get('workspace', 'docs')
+        sub_path = request.args.get('path', '')
+        depth = int(request.args.get('depth', -1))
         root_path = DOCS_ROOT if workspace == 'docs' else BLOG_ROOT
         
-        # 确保目录存在
-        os.makedirs(root_path, exist_ok=True)
-        
-        tree = build_file_tree(root_path)
-        
-        return jsonify({
-            'success': True,
-            'tree': tree,
-            'workspace': workspace
-        })
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
-
-@app.route('/api/files/read', methods=['POST'])
-def read_file():
-    """读取文件内容"""
-    try:
-        data = request.json
-        workspace = data.get('workspace', 'docs')
-        file_path = data.get('path', '')
-        
-        root_path = DOCS_ROOT if workspace == 'docs' else BLOG_ROOT
-        
-        if not is_safe_path(root_path, file_path):
+        if sub_path and not is_safe_path(root_path, sub_path):
             return jsonify({
                 'success': False,
                 'error': '非法的文件路径'
             }), 400
         
-        full_path = os.path.join(root_path, file_path)
+        # 确保目录存在
+        os.makedirs(root_path, exist_ok=True)
         
-        if not os.path.exists(full_path) or not os.path.isfile(full_path):
-            return jsonify({
-                'success': False,
-                'error': '文件不存在'
-            }), 404
+        apply_worker_changes()
+        tree, etag = file_tree_cache.get_tree(workspace_key(workspace), sub_path, depth)
         
-        with open(full_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        if etag_matches(request.headers.get('If-None-Match', ''), etag):
+            response = app.response_class(status=304)
+            response.headers['ETag'] = etag
+            return response
         
-        return jsonify({
+        response = jsonify({
             'success': True,
-            'content': content,
-            'path': file_path
+            'tree': tree,
+            'workspace': workspace,
+            'path': sub_path,
+            'depth': depth
         })
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
-@app.route('/api/files/write', methods=['POST'])
-def write_file():
-    """写入文件内容"""
-    try:
-        data = request.json
-        workspace = data.get('workspace', 'docs')
-        file_path = data.get('path', '')
-        content = data.get('content', '')
-        
-        root_path = DOCS_ROOT if workspace == 'docs' else BLOG_ROOT
-        
-        if not is_safe_path(root_path, file_path):
-            return jsonify({
-                'success': False,
-                'error': '非法的文件路径'
-            }), 400
-        
-        full_path = os.path.join(root_path, file_path)
-        
+# ---------- 文件操作 ----------
+# 每个操作是一个接收 (请求数据, OpContext) 、返回结果字典的函数，单个接口和 /api/files/batch 共用。
+# 对文件树缓存和搜索索引的影响记录在 ctx.effects 中，由调用方在操作完成后统一应用；
+# 修改磁盘前通过 ctx 的钩子通知，原子批处理据此记录撤销日志。
+
+class FileOpError(Exception):
+    """文件操作失败，带 HTTP 状态码和附加字段"""
+
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+    def to_dict(self):
+        return {'success': False, 'error': str(self), **self.extra}
+
+def resolve_path(workspace, user_path):
+    """校验路径并返回 (根目录, 完整路径)"""
+    root_path = DOCS_ROOT if workspace == 'docs' else BLOG_ROOT
+    if not is_safe_path(root_path, user_path):
+        raise FileOpError('非法的文件路径', 400)
+    return root_path, os.path.join(root_path, user_path)
+
+def apply_effects(effects):
+    """把操作记录的变化同步到文件树缓存和搜索索引"""
+    for action, workspace, paths, structural in effects:
+        if structural:
+            invalidate_tree(workspace, *paths)
+        update_search_index(action, workspace, *paths)
+
+class OpContext:
+    """文件操作的执行上下文：记录副作用，直接修改磁盘"""
+
+    def __init__(self):
+        self.effects = []
+
+    def record(self, action, workspace, paths, structural):
+        """记录一次变化：action 为搜索索引的方法名，structural 表示文件树结构有变化"""
+        self.effects.append((action, workspace, tuple(paths), structural))
+
+    def before_change(self, full_path):
+        """即将创建或覆盖 full_path"""
+
+    def after_rename(self, old_full_path, new_full_path):
+        """已把 old_full_path 重命名为 new_full_path"""
+
+    def remove(self, full_path):
+        if os.path.isdir(full_path):
+            shutil.rmtree(full_path)
+        else:
+            os.remove(full_path)
+
+def op_read(data, ctx=None):
+    """读取文件内容，支持按行或按字节分页"""
+    workspace = data.get('workspace', 'docs')
+    file_path = data.get('path', '')
+    _, full_path = resolve_path(workspace, file_path)
+    
+    if not os.path.isfile(full_path):
+        raise FileOpError('文件不存在', 404)
+    
+    # 按行分页
+    if 'startLine' in data or 'maxLines' in data:
+        start_line = max(int(data.get('startLine') or 1), 1)
+        max_lines = min(max(int(data.get('maxLines') or 1000), 1), MAX_READ_PAGE_LINES)
+        content, has_more = read_line_range(full_path, start_line, max_lines)
+        result = {
+            'success': True,
+            'content': content,
+            'path': file_path,
+            'startLine': start_line,
+            'nextLine': start_line + max_lines if has_more else None,
+            'hasMore': has_more,
+            'size': os.path.getsize(full_path)
+        }
+        if start_line == 1:
+            result['version'] = file_version(full_path)
+        return result
+    
+    # 按字节分页
+    if 'offset' in data or 'length' in data:
+        offset = max(int(data.get('offset') or 0), 0)
+        length = min(max(int(data.get('length') or READ_PAGE_BYTES), 1), MAX_READ_PAGE_BYTES)
+        content, next_offset, size = read_byte_range(full_path, offset, length)
+        result = {
+            'success': True,
+            'content': content,
+            'path': file_path,
+            'offset': offset,
+            'nextOffset': next_offset if next_offset < size else None,
+            'hasMore': next_offset < size,
+            'size': size
+        }
+        if offset == 0:
+            result['version'] = file_version(full_path)
+        return result
+    
+    with open(full_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    
+    return {
+        'success': True,
+        'content': content,
+        'version': content_version(content),
+        'path': file_path
+    }
+
+def op_write(data, ctx):
+    """写入文件内容；带 baseVersion 时校验版本"""
+    workspace = data.get('workspace', 'docs')
+    file_path = data.get('path', '')
+    content = data.get('content', '')
+    base_version = data.get('baseVersion')
+    _, full_path = resolve_path(workspace, file_path)
+    
+    with file_lock(full_path):
+        is_new_file = not os.path.exists(full_path)
+        if base_version and not is_new_file:
+            with open(full_path, 'r', encoding='utf-8') as f:
+                current_version = content_version(f.read())
+            if current_version != base_version:
+                raise FileOpError('文件已被其他人修改，请重新加载后再保存', 409, version=current_version)
+        ctx.before_change(full_path)
         # 确保目录存在
         os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        atomic_write(full_path, content)
+    
+    ctx.record('update_path', workspace, (file_path,), is_new_file)
+    
+    return {
+        'success': True,
+        'message': '文件保存成功',
+        'version': content_version(content),
+        'path': file_path
+    }
+
+def op_patch(data, ctx):
+    """增量保存：按基准版本应用文本编辑，基准版本过期时返回 409"""
+    workspace = data.get('workspace', 'docs')
+    file_path = data.get('path', '')
+    base_version = data.get('baseVersion', '')
+    edits = data.get('edits')
+    _, full_path = resolve_path(workspace, file_path)
+    
+    if not base_version or not isinstance(edits, list):
+        raise FileOpError('缺少 baseVersion 或 edits', 400)
+    
+    with file_lock(full_path):
+        if not os.path.isfile(full_path):
+            raise FileOpError('文件不存在', 404)
         
+        with open(full_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        current_version = content_version(content)
+        if current_version != base_version:
+            raise FileOpError('文件已被其他人修改，请重新加载后再保存', 409, version=current_version)
+        
+        try:
+            content = apply_text_edits(content, edits)
+        except (ValueError, TypeError, UnicodeDecodeError) as e:
+            raise FileOpError(f'无效的编辑: {e}', 400)
+        
+        if edits:
+            ctx.before_change(full_path)
+            atomic_write(full_path, content)
+    
+    if edits:
+        ctx.record('update_path', workspace, (file_path,), False)
+    
+    return {
+        'success': True,
+        'message': '文件保存成功',
+        'version': content_version(content),
+        'path': file_path
+    }
+
+def op_create(data, ctx):
+    """创建文件或文件夹"""
+    workspace = data.get('workspace', 'docs')
+    file_path = data.get('path', '')
+    file_type = data.get('type', 'file')  # 'file' or 'folder'
+    content = data.get('content', '')
+    _, full_path = resolve_path(workspace, file_path)
+    
+    if os.path.exists(full_path):
+        raise FileOpError('文件或文件夹已存在', 400)
+    
+    ctx.before_change(full_path)
+    if file_type == 'folder':
+        os.makedirs(full_path, exist_ok=True)
+        message = '文件夹创建成功'
+    else:
+        # 确保目录存在
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
         with open(full_path, 'w', encoding='utf-8') as f:
             f.write(content)
-        
-        return jsonify({
-            'success': True,
-            'message': '文件保存成功',
-            'path': file_path
-        })
+        message = '文件创建成功'
+    
+    ctx.record('update_path', workspace, (file_path,), True)
+    
+    return {
+        'success': True,
+        'message': message,
+        'path': file_path
+    }
+
+def op_delete(data, ctx):
+    """删除文件或文件夹"""
+    workspace = data.get('workspace', 'docs')
+    file_path = data.get('path', '')
+    _, full_path = resolve_path(workspace, file_path)
+    
+    if not os.path.exists(full_path):
+        raise FileOpError('文件或文件夹不存在', 404)
+    
+    message = '文件夹删除成功' if os.path.isdir(full_path) else '文件删除成功'
+    ctx.remove(full_path)
+    
+    ctx.record('remove_path', workspace, (file_path,), True)
+    
+    return {
+        'success': True,
+        'message': message,
+        'path': file_path
+    }
+
+def op_rename(data, ctx):
+    """重命名文件或文件夹"""
+    workspace = data.get('workspace', 'docs')
+    old_path = data.get('oldPath', '')
+    new_path = data.get('newPath', '')
+    _, old_full_path = resolve_path(workspace, old_path)
+    _, new_full_path = resolve_path(workspace, new_path)
+    
+    if not os.path.exists(old_full_path):
+        raise FileOpError('源文件或文件夹不存在', 404)
+    
+    if os.path.exists(new_full_path):
+        raise FileOpError('目标文件或文件夹已存在', 400)
+    
+    ctx.before_change(new_full_path)
+    # 确保目标目录存在
+    os.makedirs(os.path.dirname(new_full_path), exist_ok=True)
+    
+    os.rename(old_full_path, new_full_path)
+    ctx.after_rename(old_full_path, new_full_path)
+    
+    ctx.record('rename_path', workspace, (old_path, new_path), True)
+    
+    return {
+        'success': True,
+        'message': '重命名成功',
+        'oldPath': old_path,
+        'newPath': new_path
+    }
+
+FILE_OPS = {
+    'read': op_read,
+    'write': op_write,
+    'patch': op_patch,
+    'create': op_create,
+    'delete': op_delete,
+    'rename': op_rename,
+}
+
+def run_file_op(op):
+    """执行单个文件操作并转换为 HTTP 响应"""
+    try:
+        ctx = OpContext()
+        result = op(request.json or {}, ctx)
+        apply_effects(ctx.effects)
+        return jsonify(result)
+    except FileOpError as e:
+        return jsonify(e.to_dict()), e.status
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
-@app.route('/api/files/create', methods=['POST'])
-def create_file_or_folder():
-    """创建文件或文件夹"""
-    try:
-        data = request.json
-        workspace = data.get('workspace', 'docs')
-        file_path = data.get('path', '')
-        file_type = data.get('type', 'file')  # 'file' or 'folder'
-        content = data.get('content', '')
-        
-        root_path = DOCS_ROOT if workspace == 'docs' else BLOG_ROOT
-        
-        if not is_safe_path(root_path, file_path):
-            return jsonify({
-                'success': False,
-                'error': '非法的文件路径'
-            }), 400
-        
-        full_path = os.path.join(root_path, file_path)
-        
-        if os.path.exists(full_path):
-            return jsonify({
-                'success': False,
-                'error': '文件或文件夹已存在'
-            }), 400
-        
-        if file_type == 'folder':
-            os.makedirs(full_path, exist_ok=True)
-            message = '文件夹创建成功'
-        else:
-            # 确保目录存在
-            os.makedirs(os.path.dirname(full_path), exist_ok=True)
-            with open(full_path, 'w', encoding='utf-8') as f:
-                f.write(content)
-            message = '文件创建成功'
-        
+@app.route('/api/files/read', methods=['POST'])
+def read_file():
+    """读取文件内容"""
+    return run_file_op(op_read)
+
+@app.route('/api/files/raw', methods=['GET'])
+def read_file_raw():
+    """以纯文本流式返回文件，支持 Range（断点/分段读取）和 ETag 条件请求"""
+    workspace = request.args.get('workspace', 'docs')
+    file_path = request.args.get('path', '')
+    
+    root_path = DOCS_ROOT if workspace == 'docs' else BLOG_ROOT
+    
+    if not is_safe_path(root_path, file_path):
         return jsonify({
-            'success': True,
-            'message': message,
-            'path': file_path
-        })
-    except Exception as e:
+            'success': False,
+            'error': '非法的文件路径'
+        }), 400
+    
+    full_path = os.path.join(root_path, file_path)
+    
+    if not os.path.isfile(full_path):
         return jsonify({
             'success': False,
-            'error': str(e)
-        }), 500
+            'error': '文件不存在'
+        }), 404
+    
+    response = send_file(
+        full_path,
+        mimetype='text/plain; charset=utf-8',
+        conditional=True,
+        max_age=0
+    )
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+@app.route('/api/files/write', methods=['POST'])
+def write_file():
+    """写入文件内容"""
+    return run_file_op(op_write)
+
+@app.route('/api/files/patch', methods=['PATCH', 'POST'])
+def patch_file():
+    """增量保存：按基准版本应用文本编辑，基准版本过期时返回 409"""
+    return run_file_op(op_patch)
+
+@app.route('/api/files/create', methods=['POST'])
+def create_file_or_folder():
+    """创建文件或文件夹"""
+    return run_file_op(op_create)
 
 @app.route('/api/files/delete', methods=['POST'])
 def delete_file_or_folder():
     """删除文件或文件夹"""
+    return run_file_op(op_delete)
+
+@app.route('/api/files/rename', methods=['POST'])
+def rename_file_or_folder():
+    """重命名文件或文件夹"""
+    return run_file_op(op_rename)
+
+# ---------- 批量操作 ----------
+
+BATCH_BACKUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'batch')
+# 单次批量请求最多包含的操作数
+MAX_BATCH_OPS = int(os.getenv("FILE_BATCH_MAX_OPS", "200"))
+# 并行读取的线程数
+BATCH_READ_WORKERS = 8
+
+_batch_read_executor = None
+_batch_read_executor_lock = threading.Lock()
+# 原子批处理之间串行执行，避免彼此的撤销日志交错
+_atomic_batch_lock = threading.Lock()
+
+def _get_batch_read_executor():
+    global _batch_read_executor
+    with _batch_read_executor_lock:
+        if _batch_read_executor is None:
+            _batch_read_executor = ThreadPoolExecutor(max_workers=BATCH_READ_WORKERS, thread_name_prefix="batch-read")
+    return _batch_read_executor
+
+class TransactionContext(OpContext):
+    """原子批处理的执行上下文：修改前备份，失败时按撤销日志逆序恢复"""
+
+    def __init__(self):
+        super().__init__()
+        os.makedirs(BATCH_BACKUP_DIR, exist_ok=True)
+        self.backup_dir = tempfile.mkdtemp(prefix='batch-', dir=BATCH_BACKUP_DIR)
+        self._undo = []
+        self._touched = []
+        self._backups = 0
+
+    def _backup_path(self):
+        self._backups += 1
+        return os.path.join(self.backup_dir, str(self._backups))
+
+    def before_change(self, full_path):
+        self._touched.append(full_path)
+        if os.path.isfile(full_path):
+            backup = self._backup_path()
+            shutil.copy2(full_path, backup)
+            self._undo.append(lambda: os.replace(backup, full_path))
+            return
+        # 新建的路径（包括 makedirs 会创建的上级目录）在回滚时删除
+        top = full_path
+        while not os.path.exists(os.path.dirname(top)):
+            top = os.path.dirname(top)
+        if not os.path.exists(top):
+            self._undo.append(lambda: _remove_if_exists(top))
+
+    def after_rename(self, old_full_path, new_full_path):
+        self._touched.append(old_full_path)
+        self._undo.append(lambda: os.rename(new_full_path, old_full_path))
+
+    def remove(self, full_path):
+        # 删除改为移入备份目录，回滚时移回
+        self._touched.append(full_path)
+        backup = self._backup_path()
+        shutil.move(full_path, backup)
+
+        def restore():
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            shutil.move(backup, full_path)
+        self._undo.append(restore)
+
+    def commit(self):
+        shutil.rmtree(self.backup_dir, ignore_errors=True)
+
+    def rollback(self):
+        """逆序撤销已执行的修改，返回撤销失败的信息列表"""
+        errors = []
+        for undo in reversed(self._undo):
+            try:
+                undo()
+            except Exception as e:
+                errors.append(str(e))
+        shutil.rmtree(self.backup_dir, ignore_errors=True)
+        # 回滚后受影响的路径重新同步文件树缓存和搜索索引
+        for full_path in self._touched:
+            for workspace, root_path in (('docs', DOCS_ROOT), ('blog', BLOG_ROOT)):
+                rel_path = os.path.relpath(full_path, root_path)
+                if not rel_path.startswith('..'):
+                    invalidate_tree(workspace, rel_path)
+                    update_search_index('update_path', workspace, rel_path)
+        return errors
+
+def _remove_if_exists(full_path):
+    if os.path.isdir(full_path):
+        shutil.rmtree(full_path)
+    elif os.path.exists(full_path):
+        os.remove(full_path)
+
+def validate_batch(operations, default_workspace):
+    """执行前统一校验全部操作，返回 (规范化后的操作列表, 错误列表)"""
+    if not isinstance(operations, list) or not operations:
+        return [], [{'index': None, 'error': 'operations 必须是非空数组'}]
+    if len(operations) > MAX_BATCH_OPS:
+        return [], [{'index': None, 'error': f'一次最多 {MAX_BATCH_OPS} 个操作'}]
+    normalized, errors = [], []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in FILE_OPS:
+            errors.append({'index': index, 'error': f"不支持的操作: {operation.get('op') if isinstance(operation, dict) else operation}"})
+            continue
+        data = {'workspace': default_workspace, **operation}
+        path_keys = ('oldPath', 'newPath') if data['op'] == 'rename' else ('path',)
+        try:
+            for key in path_keys:
+                if not data.get(key):
+                    raise FileOpError(f'缺少 {key}', 400)
+                resolve_path(data['workspace'], data[key])
+        except FileOpError as e:
+            errors.append({'index': index, 'error': str(e)})
+            continue
+        normalized.append(data)
+    return normalized, errors
+
+def _run_op(op, data, ctx):
     try:
-        data = request.json
-        workspace = data.get('workspace', 'docs')
-        file_path = data.get('path', '')
-        
-        root_path = DOCS_ROOT if workspace == 'docs' else BLOG_ROOT
-        
-        if not is_safe_path(root_path, file_path):
+        return op(data, ctx), 200
+    except FileOpError as e:
+        return e.to_dict(), e.status
+    except Exception as e:
+        return {'success': False, 'error': str(e)}, 500
+
+def run_batch(operations, atomic=False):
+    """按顺序执行操作，相邻的读操作并行执行；返回 (结果列表, 失败操作的状态码或 None, 是否已回滚)"""
+    ctx = TransactionContext() if atomic else OpContext()
+    results = [None] * len(operations)
+    failed_status = None
+    index = 0
+    while index < len(operations):
+        if operations[index]['op'] == 'read':
+            end = index
+            while end < len(operations) and operations[end]['op'] == 'read':
+                end += 1
+            group = list(range(index, end))
+            if len(group) > 1:
+                outcomes = list(_get_batch_read_executor().map(
+                    lambda i: _run_op(op_read, operations[i], ctx), group))
+            else:
+                outcomes = [_run_op(op_read, operations[index], ctx)]
+        else:
+            group = [index]
+            outcomes = [_run_op(FILE_OPS[operations[index]['op']], operations[index], ctx)]
+        for i, (result, status) in zip(group, outcomes):
+            results[i] = {'index': i, 'op': operations[i]['op'], 'status': status, **result}
+            if status >= 400 and failed_status is None:
+                failed_status = status
+        index = group[-1] + 1
+        if atomic and failed_status is not None:
+            break
+
+    rolled_back = False
+    if atomic and failed_status is not None:
+        undo_errors = ctx.rollback()
+        rolled_back = True
+        for i, result in enumerate(results):
+            if result is None:
+                results[i] = {'index': i, 'op': operations[i]['op'], 'success': False,
+                              'skipped': True, 'error': '未执行：批处理已回滚'}
+            elif result.get('success'):
+                result['rolledBack'] = True
+        if undo_errors:
+            logger.error("❌ 批处理回滚时出错: %s", undo_errors)
+    else:
+        if atomic:
+            ctx.commit()
+        apply_effects(ctx.effects)
+    return results, failed_status, rolled_back
+
+@app.route('/api/files/batch', methods=['POST'])
+def batch_file_ops():
+    """批量文件操作：operations 按顺序执行，atomic 为 true 时任一操作失败则全部回滚"""
+    try:
+        data = request.json or {}
+        atomic = bool(data.get('atomic'))
+        operations, errors = validate_batch(data.get('operations'), data.get('workspace', 'docs'))
+        if errors:
             return jsonify({
                 'success': False,
-                'error': '非法的文件路径'
+                'error': '批量操作校验失败',
+                'errors': errors
             }), 400
         
-        full_path = os.path.join(root_path, file_path)
-        
-        if not os.path.exists(full_path):
-            return jsonify({
-                'success': False,
-                'error': '文件或文件夹不存在'
-            }), 404
-        
-        if os.path.isdir(full_path):
-            shutil.rmtree(full_path)
-            message = '文件夹删除成功'
+        if atomic:
+            with _atomic_batch_lock:
+                results, failed_status, rolled_back = run_batch(operations, atomic=True)
         else:
-            os.remove(full_path)
-            message = '文件删除成功'
-        
-        return jsonify({
-            'success': True,
-            'message': message,
-            'path': file_path
-        })
+            results, failed_status, rolled_back = run_batch(operations)
+        
+        response = {
+            'success': failed_status is None,
+            'atomic': atomic,
+            'rolledBack': rolled_back,
+            'results': results
+        }
+        # 原子模式失败时返回失败操作的状态码；非原子模式以每个操作的 status 为准
+        return jsonify(response), (failed_status if rolled_back else 200)
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
-@app.route('/api/files/rename', methods=['POST'])
-def rename_file_or_folder():
-    """重命名文件或文件夹"""
+@app.route('/api/files/events', methods=['GET'])
+def file_events():
+    """文件变化推送（SSE），客户端据此刷新而不必轮询文件树"""
+    workspace = request.args.get('workspace')
+    workspace = workspace_key(workspace) if workspace else None
+    subscription = file_watcher.subscribe()
+    
+    def generate():
+        active = SSE_ACTIVE_STREAMS.labels(stream='file_events')
+        active.inc()
+        try:
+            yield f"retry: 3000\nevent: ready\ndata: {json.dumps({'watcher': file_watcher.backend_name})}\n\n"
+            while True:
+                try:
+                    events = subscription.get(timeout=15)
+                except queue.Empty:
+                    # 心跳，防止代理断开空闲连接
+                    yield ": ping\n\n"
+                    continue
+                if workspace:
+                    events = [e for e in events if e['workspace'] == workspace]
+                if events:
+                    yield f"event: change\ndata: {json.dumps(events, ensure_ascii=False)}\n\n"
+        finally:
+            active.dec()
+            file_watcher.unsubscribe(subscription)
+    
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        }
+    )
+
+@app.route('/api/files/search', methods=['GET'])
+def search_files():
+    """全文搜索"""
     try:
-        data = request.json
-        workspace = data.get('workspace', 'docs')
-        old_path = data.get('oldPath', '')
-        new_path = data.get('newPath', '')
-        
-        root_path = DOCS_ROOT if workspace == 'docs' else BLOG_ROOT
+        query = request.args.get('q', '').strip()
+        workspace = request.args.get('workspace')
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
         
-        if not is_safe_path(root_path, old_path) or not is_safe_path(root_path, new_path):
+        if not query:
             return jsonify({
                 'success': False,
-                'error': '非法的文件路径'
+                'error': '搜索关键词不能为空'
             }), 400
         
-        old_full_path = os.path.join(root_path, old_path)
-        new_full_path = os.path.join(root_path, new_path)
-        
-        if not os.path.exists(old_full_path):
-            return jsonify({
-                'success': False,
-                'error': '源文件或文件夹不存在'
-            }), 404
-        
-        if os.path.exists(new_full_path):
-            return jsonify({
-                'success': False,
-                'error': '目标文件或文件夹已存在'
-            }), 400
-        
-        # 确保目标目录存在
-        os.makedirs(os.path.dirname(new_full_path), exist_ok=True)
-        
-        os.rename(old_full_path, new_full_path)
+        started = time.perf_counter()
+        results = get_search_index().search(
+            query, limit=limit, workspace=workspace_key(workspace) if workspace else None
+        )
         
         return jsonify({
             'success': True,
-            'message': '重命名成功',
-            'oldPath': old_path,
-            'newPath': new_path
+            'query': query,
+            'results': results,
+            'took_ms': round((time.perf_counter() - started) * 1000, 2)
         })
     except Exception as e:
         return jsonify({
@@ -299,11 +929,40 @@ def health():
         "service": "File Management Service",
         "status": "healthy",
         "port": 5006,
-        "workspaces": ["docs", "blog"]
+        "workspaces": ["docs", "blog"],
+        "worker": worker_index(),
+        "pid": os.getpid()
     })
 
+def start_background_services(index_owner=True):
+    """启动文件监听和搜索索引同步
+
+    多进程时每个工作进程都监听文件变化（维护自己的文件树缓存和变化推送），
+    但只有 index_owner 把外部修改同步到共享的搜索索引，避免重复索引。
+    """
+    if os.getenv("FILE_WATCH_ENABLED", "1") != "0":
+        if not index_owner:
+            file_watcher.on_events = lambda events: apply_fs_events(events, update_index=False)
+        file_watcher.start()
+        # 监听器会推送外部修改，文件树缓存不再需要定期用 mtime 校验
+        file_tree_cache.ttl = 0
+    if index_owner:
+        # 后台同步搜索索引（只处理变化的文件）
+        threading.Thread(target=lambda: get_search_index().sync(), daemon=True).start()
+
 if __name__ == '__main__':
-    print("📁 文件管理服务启动中...")
-    print("📍 服务地址: http://localhost:5006")
-    print("🔧 功能: 文件管理、CRUD 操作")
-    app.run(debug=True, host='0.0.0.0', port=5006)
\ No newline at end of file
+    logger.info("📁 文件管理服务启动中...")
+    logger.info("📍 服务地址: http://localhost:5006")
+    logger.info("🔧 功能: 文件管理、CRUD 操作、全文搜索、变化推送")
+    if SERVICE_WORKERS > 1:
+        # 生产模式：多个 pre-fork 工作进程共用端口，第 0 个负责搜索索引同步
+        import prefork
+        prefork.run(
+            prefork.wsgi_server(app), '0.0.0.0', 5006,
+            on_worker_start=lambda index: start_background_services(index_owner=index == 0),
+        )
+    else:
+        # debug 模式下 werkzeug 的父进程只负责重载，后台服务只在实际处理请求的子进程中启动
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_background_services()
+        app.run(debug=True, host='0.0.0.0', port=5006)
\ No newline at end of file
@@ -0,0 +1,206 @@
+"""
+文件树缓存
+
+- 用 os.scandir 列目录（不再对每个条目单独 stat），结果按目录缓存
+- 写操作通过 invalidate() 使相关目录失效，并递增工作区的版本号（用作 ETag）
+- 支持从任意子目录开始、按深度返回，前端可以按需展开
+- 在没有文件监听的情况下，每隔 ttl 秒用目录 mtime 校验一次缓存，发现外部修改
+- 快照按 (工作区, 路径, 深度) 缓存，数量超过 max_snapshots 时淘汰最久未用的
+- content_etags=True 时 ETag 由树的内容计算：多进程部署时各进程的版本号互不相同，
+  按内容计算才能让同一棵树在任何工作进程上得到同一个 ETag
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from metrics import Gauge, Histogram
+from service_log import get_logger
+
+logger = get_logger("file_tree")
+
+TREE_BUILD_DURATION = Histogram(
+    'file_tree_build_seconds',
+    '文件树构建耗时，size 为构建出的条目数所在的区间',
+    ['workspace', 'size'],
+)
+TREE_BUILD_ENTRIES = Gauge(
+    'file_tree_last_build_entries',
+    '最近一次构建的文件树条目数',
+    ['workspace'],
+)
+# 条目数区间的上界，用来观察构建耗时随文件数的变化
+_SIZE_CLASSES = (100, 1000, 10000, 100000)
+
+
+def _size_class(entries):
+    for bound in _SIZE_CLASSES:
+        if entries <= bound:
+            return f"le_{bound}"
+    return f"gt_{_SIZE_CLASSES[-1]}"
+
+
+class FileTreeCache:
+    """按目录缓存的文件树"""
+
+    def __init__(self, roots, ttl=10.0, content_etags=False, max_snapshots=64):
+        self.roots = roots
+        self.ttl = ttl
+        self.max_snapshots = max_snapshots
+        self.content_etags = content_etags
+        self._lock = threading.RLock()
+        # (workspace, 相对目录) -> (目录 mtime_ns, [(名称, 是否目录)])
+        self._listings = {}
+        # workspace -> 版本号，任何失效都会递增
+        self._generations = {workspace: 0 for workspace in roots}
+        # workspace -> 上次用 mtime 校验缓存的时间
+        self._validated_at = {workspace: time.monotonic() for workspace in roots}
+        # (workspace, 路径, 深度) -> (版本号, 树, 内容摘要)，LRU 顺序
+        self._snapshots = OrderedDict()
+        # 最近一次构建的统计信息
+        self.last_build = {'seconds': 0.0, 'entries': 0}
+        # 进程标识，避免重启后版本号归零导致旧 ETag 误命中
+        self._epoch = f"{os.getpid():x}{int(time.time()):x}"
+
+    def _full_path(self, workspace, rel_dir):
+        root = self.roots[workspace]
+        return os.path.join(root, rel_dir) if rel_dir else root
+
+    def _list_dir(self, workspace, rel_dir):
+        """返回目录的 [(名称, 是否目录)]，优先使用缓存"""
+        key = (workspace, rel_dir)
+        cached = self._listings.get(key)
+        if cached is not None:
+            return cached[1]
+        full_path = self._full_path(workspace, rel_dir)
+        try:
+            mtime_ns = os.stat(full_path).st_mtime_ns
+            with os.scandir(full_path) as it:
+                entries = sorted(
+                    (entry.name, entry.is_dir())
+                    for entry in it if not entry.name.startswith('.')  # 跳过隐藏文件
+                )
+        except OSError as e:
+            logger.warning("Error building tree for %s: %s", full_path, e)
+            return []
+        self._listings[key] = (mtime_ns, entries)
+        return entries
+
+    def _revalidate(self, workspace):
+        """按 ttl 周期检查已缓存目录的 mtime，发现外部修改时失效"""
+        if not self.ttl or time.monotonic() - self._validated_at[workspace] < self.ttl:
+            return
+        changed = []
+        for (ws, rel_dir), (mtime_ns, _) in list(self._listings.items()):
+            if ws != workspace:
+                continue
+            try:
+                current = os.stat(self._full_path(ws, rel_dir)).st_mtime_ns
+            except OSError:
+                current = None
+            if current != mtime_ns:
+                changed.append(rel_dir)
+        for rel_dir in changed:
+            self._drop(workspace, rel_dir)
+        if changed:
+            self._bump(workspace)
+        self._validated_at[workspace] = time.monotonic()
+
+    def _build(self, workspace, rel_dir, depth):
+        """从缓存的目录列表构建树；depth 为剩余展开层数，负数表示不限"""
+        tree = []
+        for name, is_dir in self._list_dir(workspace, rel_dir):
+            item_path = f"{rel_dir}/{name}" if rel_dir else name
+            if is_dir:
+                node = {'name': name, 'path': item_path, 'type': 'folder'}
+                if depth != 0:
+                    node['children'] = self._build(workspace, item_path, depth - 1)
+                else:
+                    node['hasChildren'] = bool(self._list_dir(workspace, item_path))
+                tree.append(node)
+            else:
+                tree.append({'name': name, 'path': item_path, 'type': 'file'})
+        return tree
+
+    def get_tree(self, workspace, path='', depth=-1):
+        """返回 (树, ETag)；depth=1 只返回一层"""
+        # 同一目录的不同写法（a//b、./a）、不同的负数深度共用一个快照
+        path = os.path.normpath(path.strip('/')).replace(os.sep, '/')
+        path = '' if path == '.' else path
+        depth = max(depth, -1)
+        with self._lock:
+            self._revalidate(workspace)
+            key = (workspace, path, depth)
+            generation = self._generations[workspace]
+            snapshot = self._snapshots.get(key)
+            if snapshot is None or snapshot[0] != generation:
+                started = time.perf_counter()
+                tree = self._build(workspace, path, depth - 1 if depth > 0 else -1)
+                self.last_build = {
+                    'seconds': time.perf_counter() - started,
+                    'entries': _count_entries(tree),
+                }
+                TREE_BUILD_DURATION.labels(
+                    workspace=workspace, size=_size_class(self.last_build['entries'])
+                ).observe(self.last_build['seconds'])
+                TREE_BUILD_ENTRIES.labels(workspace=workspace).set(self.last_build['entries'])
+                content_digest = _tree_digest(tree) if self.content_etags else None
+                snapshot = (generation, tree, content_digest)
+                self._snapshots[key] = snapshot
+                while len(self._snapshots) > self.max_snapshots:
+                    self._snapshots.popitem(last=False)
+            self._snapshots.move_to_end(key)
+            if snapshot[2] is not None:
+                return snapshot[1], f'W/"{workspace}-{snapshot[2]}"'
+            return snapshot[1], self._etag(workspace, path, depth, generation)
+
+    def _etag(self, workspace, path, depth, generation):
+        digest = hashlib.sha1(f"{path}\0{depth}".encode('utf-8')).hexdigest()[:12]
+        return f'W/"{workspace}-{self._epoch}-{generation}-{digest}"'
+
+    def _drop(self, workspace, rel_path):
+        """删除某路径及其所有子目录的缓存列表"""
+        rel_path = rel_path.strip('/')
+        prefix = rel_path + '/'
+        for key in list(self._listings):
+            ws, rel_dir = key
+            if ws == workspace and (rel_dir == rel_path or rel_dir.startswith(prefix) or not rel_path):
+                del self._listings[key]
+
+    def _bump(self, workspace):
+        self._generations[workspace] += 1
+        # 旧版本的快照不会再命中，直接清掉释放内存
+        for key in [k for k in self._snapshots if k[0] == workspace]:
+            del self._snapshots[key]
+
+    def invalidate(self, workspace, rel_path=None):
+        """文件或目录被创建/删除/重命名后调用；rel_path 为空时使整个工作区失效"""
+        with self._lock:
+            if rel_path:
+                rel_path = rel_path.strip('/')
+                self._drop(workspace, rel_path)
+                # 祖先目录的列表也可能变化（例如 makedirs 创建了中间目录）
+                parent = os.path.dirname(rel_path)
+                while True:
+                    self._listings.pop((workspace, parent), None)
+                    if not parent:
+                        break
+                    parent = os.path.dirname(parent)
+            else:
+                self._drop(workspace, '')
+            self._bump(workspace)
+
+
+def _tree_digest(tree):
+    encoded = json.dumps(tree, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()[:20]
+
+
+def _count_entries(tree):
+    count = 0
+    for node in tree:
+        count += 1
+        if node.get('children'):
+            count += _count_entries(node['children'])
+    return count
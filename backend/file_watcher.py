@@ -0,0 +1,341 @@
+"""
+文件变化监听
+
+监听 docs/ 和 blog/ 下的文件变化（包括 API 之外的修改：Agent 写入、git、编辑器），
+把事件去抖、合并后交给回调（刷新文件树缓存、搜索索引），并推送给 SSE 订阅者。
+
+- Linux 上优先使用 inotify（inotify_simple），不可用或超出 watch 数量限制时回退到轮询
+- 事件类型：created / modified / deleted / moved，以及队列溢出时的 resync
+"""
+import os
+import queue
+import threading
+import time
+from service_log import get_logger
+
+logger = get_logger("file_watcher")
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:  # 非 Linux 或未安装时使用轮询
+    INotify = None
+
+
+def _ignored(name):
+    """忽略隐藏文件和编辑器临时文件"""
+    return name.startswith('.') or name.endswith('~') or name.endswith('.swp')
+
+
+def _join(rel_dir, name):
+    return f"{rel_dir}/{name}" if rel_dir else name
+
+
+class _InotifyBackend:
+    """基于 inotify 的递归监听"""
+
+    name = 'inotify'
+
+    def __init__(self, roots, emit):
+        self.roots = roots
+        self.emit = emit
+        self.inotify = INotify()
+        self.mask = (inotify_flags.CREATE | inotify_flags.DELETE | inotify_flags.CLOSE_WRITE
+                     | inotify_flags.MOVED_FROM | inotify_flags.MOVED_TO
+                     | inotify_flags.DELETE_SELF | inotify_flags.MOVE_SELF)
+        self.watches = {}  # wd -> (workspace, 相对目录)
+        self.moves = {}  # cookie -> (时间, workspace, 路径, 是否目录)
+        for workspace, root in roots.items():
+            os.makedirs(root, exist_ok=True)
+            self._watch_tree(workspace, '')
+
+    def _watch_tree(self, workspace, rel_dir, strict=True):
+        """递归添加目录监听；strict 时超出系统 watch 上限会抛出 OSError"""
+        full_dir = os.path.join(self.roots[workspace], rel_dir) if rel_dir else self.roots[workspace]
+        try:
+            wd = self.inotify.add_watch(full_dir, self.mask)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            if strict:
+                raise
+            logger.warning("⚠️ 无法监听目录 %s: %s", full_dir, e)
+            return
+        self.watches[wd] = (workspace, rel_dir)
+        try:
+            with os.scandir(full_dir) as it:
+                subdirs = [e.name for e in it if e.is_dir(follow_symlinks=False) and not _ignored(e.name)]
+        except OSError:
+            return
+        for name in subdirs:
+            self._watch_tree(workspace, _join(rel_dir, name), strict)
+
+    def _unwatch_prefix(self, workspace, rel_path):
+        prefix = rel_path + '/'
+        for wd, (ws, rel_dir) in list(self.watches.items()):
+            if ws == workspace and (rel_dir == rel_path or rel_dir.startswith(prefix)):
+                del self.watches[wd]
+                try:
+                    self.inotify.rm_watch(wd)
+                except OSError:
+                    pass
+
+    def _rename_prefix(self, workspace, old_path, new_path):
+        prefix = old_path + '/'
+        for wd, (ws, rel_dir) in list(self.watches.items()):
+            if ws == workspace and (rel_dir == old_path or rel_dir.startswith(prefix)):
+                self.watches[wd] = (ws, new_path + rel_dir[len(old_path):])
+
+    def _expire_moves(self, now):
+        """超时未配对的 MOVED_FROM 视为移出监听范围（删除）"""
+        for cookie, (at, workspace, path, is_dir) in list(self.moves.items()):
+            if now - at > 0.5:
+                del self.moves[cookie]
+                if path is None:
+                    # 被忽略的临时文件移走了，不需要通知
+                    continue
+                if is_dir:
+                    self._unwatch_prefix(workspace, path)
+                self.emit({'type': 'deleted', 'workspace': workspace, 'path': path, 'isDir': is_dir})
+
+    def run(self, stop_event):
+        while not stop_event.is_set():
+            events = self.inotify.read(timeout=500)
+            self._expire_moves(time.monotonic())
+            for event in events:
+                if event.mask & inotify_flags.Q_OVERFLOW:
+                    for workspace in self.roots:
+                        self.emit({'type': 'resync', 'workspace': workspace, 'path': ''})
+                    continue
+                if event.mask & inotify_flags.IGNORED:
+                    self.watches.pop(event.wd, None)
+                    continue
+                location = self.watches.get(event.wd)
+                if location is None or not event.name:
+                    continue
+                workspace, rel_dir = location
+                if _ignored(event.name):
+                    # 原子保存（写临时文件再改名覆盖）：记下临时文件的 cookie，配对的 MOVED_TO 按修改处理
+                    if event.mask & inotify_flags.MOVED_FROM:
+                        self.moves[event.cookie] = (time.monotonic(), workspace, None, False)
+                    continue
+                path = _join(rel_dir, event.name)
+                is_dir = bool(event.mask & inotify_flags.ISDIR)
+
+                if event.mask & inotify_flags.MOVED_FROM:
+                    self.moves[event.cookie] = (time.monotonic(), workspace, path, is_dir)
+                elif event.mask & inotify_flags.MOVED_TO:
+                    moved = self.moves.pop(event.cookie, None)
+                    if moved and moved[2] is None and not is_dir:
+                        # 新文件由 atomic_write 用硬链接创建（CREATE），改名覆盖的一定是已有文件
+                        self.emit({'type': 'modified', 'workspace': workspace, 'path': path, 'isDir': False})
+                    elif moved and moved[1] == workspace and moved[2] is not None:
+                        if is_dir:
+                            self._rename_prefix(workspace, moved[2], path)
+                        self.emit({'type': 'moved', 'workspace': workspace, 'path': path,
+                                   'oldPath': moved[2], 'isDir': is_dir})
+                    else:
+                        if moved and moved[2] is not None:
+                            # 跨工作区移动：旧位置视为删除
+                            self.emit({'type': 'deleted', 'workspace': moved[1], 'path': moved[2], 'isDir': is_dir})
+                        if is_dir:
+                            self._watch_tree(workspace, path, strict=False)
+                        self.emit({'type': 'created', 'workspace': workspace, 'path': path, 'isDir': is_dir})
+                elif event.mask & inotify_flags.CREATE:
+                    if is_dir:
+                        self._watch_tree(workspace, path, strict=False)
+                    self.emit({'type': 'created', 'workspace': workspace, 'path': path, 'isDir': is_dir})
+                elif event.mask & inotify_flags.DELETE:
+                    self.emit({'type': 'deleted', 'workspace': workspace, 'path': path, 'isDir': is_dir})
+                elif event.mask & inotify_flags.CLOSE_WRITE:
+                    self.emit({'type': 'modified', 'workspace': workspace, 'path': path, 'isDir': False})
+
+    def close(self):
+        self.inotify.close()
+
+
+class _PollingBackend:
+    """定期扫描目录、比较 mtime/size 的兜底实现"""
+
+    name = 'polling'
+
+    def __init__(self, roots, emit, interval=5.0):
+        self.roots = roots
+        self.emit = emit
+        self.interval = interval
+        self.snapshots = {workspace: self._scan(workspace) for workspace in roots}
+
+    def _scan(self, workspace):
+        snapshot = {}
+        stack = ['']
+        while stack:
+            rel_dir = stack.pop()
+            full_dir = os.path.join(self.roots[workspace], rel_dir) if rel_dir else self.roots[workspace]
+            try:
+                with os.scandir(full_dir) as it:
+                    for entry in it:
+                        if _ignored(entry.name):
+                            continue
+                        path = _join(rel_dir, entry.name)
+                        if entry.is_dir(follow_symlinks=False):
+                            snapshot[path] = (True, 0, 0)
+                            stack.append(path)
+                        else:
+                            stat = entry.stat()
+                            snapshot[path] = (False, stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                continue
+        return snapshot
+
+    def run(self, stop_event):
+        while not stop_event.wait(self.interval):
+            for workspace in self.roots:
+                old, new = self.snapshots[workspace], self._scan(workspace)
+                for path, info in new.items():
+                    previous = old.get(path)
+                    if previous is None:
+                        self.emit({'type': 'created', 'workspace': workspace, 'path': path, 'isDir': info[0]})
+                    elif previous != info and not info[0]:
+                        self.emit({'type': 'modified', 'workspace': workspace, 'path': path, 'isDir': False})
+                for path, info in old.items():
+                    if path not in new:
+                        self.emit({'type': 'deleted', 'workspace': workspace, 'path': path, 'isDir': info[0]})
+                self.snapshots[workspace] = new
+
+    def close(self):
+        pass
+
+
+class FileWatcher:
+    """监听文件变化，去抖合并后分发给回调和订阅者"""
+
+    def __init__(self, roots, on_events=None, debounce=0.2, max_delay=1.0, poll_interval=5.0):
+        self.roots = roots
+        self.on_events = on_events
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.backend_name = None
+        self._pending = {}  # (workspace, path) -> 事件
+        self._first_at = None
+        self._last_at = None
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._stop = threading.Event()
+        self._backend = None
+
+    # ---------- 事件合并 ----------
+
+    def _emit(self, event):
+        """后端产生的原始事件进入合并缓冲区"""
+        key = (event['workspace'], event['path'])
+        with self._lock:
+            now = time.monotonic()
+            previous = self._pending.get(key)
+            kind = event['type']
+            if event['type'] == 'moved':
+                old = self._pending.pop((event['workspace'], event['oldPath']), None)
+                if old and old['type'] == 'created':
+                    # 新建后又被移动，对外只表现为在新位置创建
+                    event = {**event, 'type': 'created'}
+                    event.pop('oldPath')
+            elif previous:
+                if previous['type'] == 'created' and kind == 'deleted':
+                    # 短时间内创建又删除，相互抵消
+                    del self._pending[key]
+                    return
+                if previous['type'] == 'created' and kind == 'modified':
+                    return
+                if previous['type'] == 'deleted' and kind == 'created':
+                    event = {**event, 'type': 'modified'} if not event['isDir'] else event
+                if previous['type'] == 'moved' and kind == 'modified':
+                    return
+            self._pending[key] = event
+            self._first_at = self._first_at or now
+            self._last_at = now
+
+    def _take_ready(self):
+        """去抖时间到（或累计等待超过 max_delay）时取出待发送事件"""
+        with self._lock:
+            if not self._pending:
+                return None
+            now = time.monotonic()
+            if now - self._last_at < self.debounce and now - self._first_at < self.max_delay:
+                return None
+            events = list(self._pending.values())
+            self._pending.clear()
+            self._first_at = self._last_at = None
+            return events
+
+    def _dispatch_loop(self):
+        while not self._stop.wait(0.05):
+            events = self._take_ready()
+            if not events:
+                continue
+            if self.on_events:
+                try:
+                    self.on_events(events)
+                except Exception as e:
+                    logger.warning("⚠️ 处理文件变化事件出错: %s", e)
+            self._publish(events)
+
+    # ---------- 订阅 ----------
+
+    def subscribe(self, maxsize=256):
+        """注册一个订阅者，返回接收事件批次的队列"""
+        q = queue.Queue(maxsize=maxsize)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def _publish(self, events):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(events)
+            except queue.Full:
+                # 订阅者消费太慢：清空积压，通知其整体刷新
+                try:
+                    while True:
+                        q.get_nowait()
+                except queue.Empty:
+                    pass
+                q.put_nowait([{'type': 'resync', 'workspace': ws, 'path': ''} for ws in self.roots])
+
+    # ---------- 生命周期 ----------
+
+    def _create_backend(self):
+        if INotify is not None:
+            try:
+                return _InotifyBackend(self.roots, self._emit)
+            except OSError as e:
+                logger.warning("⚠️ inotify 不可用（%s），改用轮询监听", e)
+        return _PollingBackend(self.roots, self._emit, interval=self.poll_interval)
+
+    def _run_backend(self):
+        try:
+            self._backend.run(self._stop)
+        except Exception as e:
+            logger.error("❌ 文件监听异常退出: %s", e)
+        finally:
+            self._backend.close()
+
+    def start(self):
+        """启动监听线程，返回所用的后端名称"""
+        self._backend = self._create_backend()
+        self.backend_name = self._backend.name
+        threading.Thread(target=self._run_backend, name="file-watcher", daemon=True).start()
+        threading.Thread(target=self._dispatch_loop, name="file-watcher-dispatch", daemon=True).start()
+        logger.info("👀 文件监听已启动（%s）", self.backend_name)
+        return self.backend_name
+
+    @property
+    def running(self):
+        return self._backend is not None and not self._stop.is_set()
+
+    def stop(self):
+        self._stop.set()
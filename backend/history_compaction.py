@@ -0,0 +1,303 @@
+"""
+对话历史压缩
+
+ReAct Agent 每一轮都会把检查点中的完整历史发给模型，其中包括之前各轮工具返回的整篇文档和网页正文，
+prompt 会随对话轮数无限增长。compactor 作为 create_react_agent 的 pre_model_hook，在每次调用模型前：
+
+1. 截断陈旧的工具输出：当前这一轮（最后一条用户消息）之前的 ToolMessage 超过
+   HISTORY_TOOL_OUTPUT_TOKENS 时只保留开头部分（工具调用与结果的配对保持不变，需要时模型可以重新调用工具）
+2. 历史仍超过 HISTORY_TOKEN_BUDGET 时，把较早的若干轮（按用户消息划分，不会拆开工具调用配对）
+   连同已有摘要一起压缩成新摘要，保存在状态的 history_summary 中，由 prompt 放进系统提示
+
+压缩结果直接写回检查点，后续各轮从压缩后的历史开始；累计移除的 token 数也保存在状态中，
+因此每次调用模型都能报告相对未压缩历史节省了多少 prompt token（指标、执行追踪的 history 事件）。
+每条消息的 token 数按消息缓存，均为 tokenizer.estimate_tokens 的估算值。
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import NotRequired
+
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, SystemMessage, ToolMessage
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+from langgraph.prebuilt.chat_agent_executor import AgentState
+
+from metrics import Counter, Histogram
+from service_log import get_logger
+from tokenizer import estimate_tokens
+from tracing import trace_store
+
+logger = get_logger("history_compaction")
+
+HISTORY_COMPACTION = os.getenv("HISTORY_COMPACTION", "1") != "0"
+# 对话历史（不含系统提示）的 token 预算，超过后压缩较早的轮次
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "6000"))
+# 之前各轮的工具输出最多保留的 token 数
+HISTORY_TOOL_OUTPUT_TOKENS = int(os.getenv("HISTORY_TOOL_OUTPUT_TOKENS", "300"))
+# 摘要的目标长度
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "600"))
+
+HISTORY_TOKENS = Histogram(
+    'chat_history_tokens',
+    '每次调用模型前对话历史的 token 数（估算值，压缩后）',
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000),
+)
+PROMPT_TOKENS_SAVED = Counter(
+    'chat_prompt_tokens_saved_total',
+    '与未压缩的历史相比，各次模型调用少发送的 prompt token 数（估算值）',
+)
+HISTORY_TOKENS_REMOVED = Counter(
+    'chat_history_tokens_removed_total',
+    '压缩时从历史中移除的 token 数（估算值），stage 为 tool_output 或 summary',
+    ['stage'],
+)
+HISTORY_SUMMARIES = Counter(
+    'chat_history_summaries_total',
+    '生成对话摘要的次数，method 为 llm 或 extractive（模型调用失败时的回退）',
+    ['method'],
+)
+
+# 每条消息的固定开销（角色、分隔符等）
+_MESSAGE_OVERHEAD = 4
+_TRUNCATED_SUFFIX = "需要时可重新调用工具）"
+_TRUNCATED_MARK = "…（之前的工具输出已截断，原文约 {tokens} tokens，" + _TRUNCATED_SUFFIX
+
+SUMMARY_PROMPT = (
+    "请把下面的对话压缩成一段简洁的摘要，不超过 {limit} 字。保留用户的目标和偏好、已确认的事实和结论、"
+    "提到的文件路径和网址、尚未完成的事项；省略寒暄和工具输出的细节。只输出摘要本身。"
+)
+
+
+class CompactedAgentState(AgentState):
+    """在默认状态上增加较早轮次的摘要和累计移除的 token 数"""
+    history_summary: NotRequired[str]
+    history_tokens_removed: NotRequired[int]
+
+
+def with_summary(base_prompt):
+    """返回 create_react_agent 的 prompt：系统提示之后附上较早轮次的摘要"""
+    def prompt(state):
+        summary = state.get("history_summary")
+        system = base_prompt + (f"\n\n之前对话的摘要（更早的消息已省略）：\n{summary}" if summary else "")
+        return [SystemMessage(system)] + list(state["messages"])
+    return prompt
+
+
+def _content_text(message):
+    content = message.content
+    if isinstance(content, str):
+        return content
+    parts = []
+    for block in content or []:
+        if isinstance(block, str):
+            parts.append(block)
+        elif isinstance(block, dict) and block.get('type') == 'text':
+            parts.append(block.get('text', ''))
+        else:
+            # 工具直接返回的列表/字典（例如 extract_webpages 的结果）
+            parts.append(json.dumps(block, ensure_ascii=False, default=str))
+    return ''.join(parts)
+
+
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+_TOKEN_CACHE_SIZE = 8192
+
+
+def message_tokens(message):
+    """估算一条消息的 token 数（按消息 ID 和内容长度缓存）"""
+    text = _content_text(message)
+    tool_calls = getattr(message, 'tool_calls', None) or []
+    key = (message.id, len(text), len(tool_calls)) if message.id else None
+    if key is not None:
+        with _token_cache_lock:
+            cached = _token_cache.get(key)
+            if cached is not None:
+                _token_cache.move_to_end(key)
+                return cached
+    tokens = _MESSAGE_OVERHEAD + estimate_tokens(text)
+    for call in tool_calls:
+        tokens += estimate_tokens(call.get('name', '')) + estimate_tokens(
+            json.dumps(call.get('args', {}), ensure_ascii=False)
+        )
+    if key is not None:
+        with _token_cache_lock:
+            _token_cache[key] = tokens
+            while len(_token_cache) > _TOKEN_CACHE_SIZE:
+                _token_cache.popitem(last=False)
+    return tokens
+
+
+def history_tokens(messages, summary=''):
+    return sum(message_tokens(message) for message in messages) + estimate_tokens(summary or '')
+
+
+def truncate_to_tokens(text, max_tokens):
+    """截取文本开头不超过 max_tokens（估算）的部分"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 先按最坏情况（每个字符 1 token）截取，再逐步放宽
+    end = max_tokens
+    while end < len(text) and estimate_tokens(text[:end * 2]) <= max_tokens:
+        end *= 2
+    low, high = end, min(end * 2, len(text))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
+
+
+def _turn_starts(messages):
+    """每一轮（从一条用户消息开始）的起始下标"""
+    return [i for i, message in enumerate(messages) if isinstance(message, HumanMessage)]
+
+
+def _transcript(messages, per_message_tokens=200):
+    lines = []
+    for message in messages:
+        text = truncate_to_tokens(_content_text(message).strip(), per_message_tokens)
+        if isinstance(message, HumanMessage):
+            lines.append(f"用户：{text}")
+        elif isinstance(message, ToolMessage):
+            lines.append(f"工具 {message.name or ''} 返回：{text}")
+        elif isinstance(message, AIMessage):
+            calls = ', '.join(call.get('name', '') for call in message.tool_calls or [])
+            if text:
+                lines.append(f"助手：{text}")
+            if calls:
+                lines.append(f"助手调用工具：{calls}")
+    return '\n'.join(lines)
+
+
+class HistoryCompactor:
+    """对话历史压缩（用作 pre_model_hook）；summarizer 为用于生成摘要的聊天模型，为空时使用摘录"""
+
+    def __init__(self, summarizer=None, budget=HISTORY_TOKEN_BUDGET,
+                 tool_output_tokens=HISTORY_TOOL_OUTPUT_TOKENS, summary_tokens=HISTORY_SUMMARY_TOKENS):
+        self.summarizer = summarizer
+        self.budget = budget
+        self.tool_output_tokens = tool_output_tokens
+        self.summary_tokens = summary_tokens
+
+    # ---------- 压缩步骤 ----------
+
+    def truncate_stale_tool_outputs(self, messages, current):
+        """截断当前轮之前的工具输出，返回 (新消息列表, 节省的 token 数)"""
+        result = list(messages)
+        saved = 0
+        for i in range(current):
+            message = result[i]
+            if not isinstance(message, ToolMessage):
+                continue
+            before = message_tokens(message)
+            if before - _MESSAGE_OVERHEAD <= self.tool_output_tokens:
+                continue
+            text = _content_text(message)
+            if text.endswith(_TRUNCATED_SUFFIX):
+                continue
+            content = truncate_to_tokens(text, self.tool_output_tokens) + _TRUNCATED_MARK.format(
+                tokens=estimate_tokens(text)
+            )
+            result[i] = message.model_copy(update={'content': content})
+            saved += before - message_tokens(result[i])
+        return result, saved
+
+    def summarize(self, messages, previous_summary=''):
+        """把较早的消息（连同已有摘要）压缩成新摘要，返回 (摘要, 方法)"""
+        transcript = _transcript(messages)
+        if previous_summary:
+            transcript = f"之前的摘要：{previous_summary}\n\n{transcript}"
+        if self.summarizer is not None:
+            try:
+                # 不继承本轮的回调，摘要模型的输出不会混进流式回复
+                response = self.summarizer.invoke(
+                    [SystemMessage(SUMMARY_PROMPT.format(limit=self.summary_tokens)), HumanMessage(transcript)],
+                    config={'callbacks': [], 'run_name': 'history_summary'},
+                )
+                summary = _content_text(response).strip()
+                if summary:
+                    return truncate_to_tokens(summary, self.summary_tokens * 2), 'llm'
+            except Exception as e:
+                logger.warning("⚠️ 生成对话摘要失败，改用摘录: %s", e)
+        # 摘录：已有摘要 + 每条用户消息和回复的开头
+        excerpt = _transcript([m for m in messages if not isinstance(m, ToolMessage)], per_message_tokens=60)
+        summary = f"{previous_summary}\n{excerpt}".strip() if previous_summary else excerpt
+        return truncate_to_tokens(summary, self.summary_tokens), 'extractive'
+
+    def compact(self, messages, summary=''):
+        """返回 (新消息列表, 新摘要, 统计)；不需要压缩时统计中 changed 为 False"""
+        starts = _turn_starts(messages)
+        current = starts[-1] if starts else len(messages)
+        before = history_tokens(messages, summary)
+        stats = {'before': before, 'after': before, 'saved': 0, 'tool_output': 0, 'summary': 0,
+                 'summarized_messages': 0, 'changed': False}
+
+        compacted, saved = self.truncate_stale_tool_outputs(messages, current)
+        stats['tool_output'] = saved
+        total = before - saved
+
+        if total > self.budget and current > 0:
+            # 从最近的轮次往前保留，直到占满一半预算；当前轮总是保留
+            keep_from = current
+            kept = history_tokens(compacted[current:])
+            for start in reversed(starts[:-1]):
+                turn = history_tokens(compacted[start:keep_from])
+                if kept + turn > self.budget // 2:
+                    break
+                kept += turn
+                keep_from = start
+            if keep_from > 0:
+                started = time.perf_counter()
+                new_summary, method = self.summarize(compacted[:keep_from], summary)
+                HISTORY_SUMMARIES.labels(method=method).inc()
+                stats.update(
+                    summary_method=method,
+                    summary_ms=round((time.perf_counter() - started) * 1000, 2),
+                    summarized_messages=keep_from,
+                )
+                dropped = history_tokens(compacted[:keep_from], summary)
+                stats['summary'] = max(dropped - estimate_tokens(new_summary), 0)
+                compacted, summary = compacted[keep_from:], new_summary
+
+        stats['changed'] = bool(stats['tool_output'] or stats['summarized_messages'])
+        stats['after'] = history_tokens(compacted, summary)
+        stats['saved'] = stats['before'] - stats['after']
+        return compacted, summary, stats
+
+    # ---------- pre_model_hook ----------
+
+    def __call__(self, state, config):
+        messages = list(state["messages"])
+        compacted, summary, stats = self.compact(messages, state.get("history_summary", ''))
+        # 各次压缩的 before - after 累加起来，正好是未压缩的历史比当前历史多出的部分
+        removed = state.get("history_tokens_removed", 0) + stats['saved']
+        HISTORY_TOKENS.observe(stats['after'])
+        PROMPT_TOKENS_SAVED.inc(max(removed, 0))
+        configurable = (config or {}).get('configurable', {})
+        trace = trace_store.get(configurable.get('request_id'))
+        if trace is not None:
+            details = {k: v for k, v in stats.items() if k != 'changed'} if stats['changed'] else {}
+            trace.event('history', tokens=stats['after'], saved=removed, **({'compacted': details} if details else {}))
+        if not stats['changed']:
+            return {}
+        for stage in ('tool_output', 'summary'):
+            if stats[stage] > 0:
+                HISTORY_TOKENS_REMOVED.labels(stage=stage).inc(stats[stage])
+        logger.info("🗜️ 对话历史压缩：%d → %d tokens", stats['before'], stats['after'], fields={
+            "thread_id": configurable.get('thread_id'),
+            "request_id": configurable.get('request_id'),
+            "tool_output_saved": stats['tool_output'],
+            "summary_saved": stats['summary'],
+            "summarized_messages": stats['summarized_messages'],
+        })
+        # 用压缩后的历史整体替换检查点中的消息，后续各轮不必重复压缩
+        return {
+            "messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES), *compacted],
+            "history_summary": summary,
+            "history_tokens_removed": removed,
+        }
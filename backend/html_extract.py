@@ -0,0 +1,270 @@
+"""
+网页正文提取引擎
+
+- 可插拔的解析后端：优先使用 lxml（C 实现，速度快），不可用时回退到 BeautifulSoup 的 html.parser
+- readability 风格的正文识别：按段落文本长度、标点数给父节点打分，结合 class/id 权重和链接密度，
+  选出得分最高的容器及其相近的兄弟节点，去掉导航、侧栏、评论等噪音
+- 输出保留段落换行，并限制最大长度，避免把整页内容塞进 LLM 上下文
+"""
+import os
+import re
+
+try:
+    import lxml.etree
+except ImportError:
+    lxml = None
+
+from bs4 import BeautifulSoup
+
+# 直接删除的标签
+REMOVE_TAGS = ('script', 'style', 'noscript', 'nav', 'footer', 'header', 'aside', 'form',
+               'iframe', 'svg', 'canvas', 'button', 'select', 'template')
+# 参与打分的段落类标签
+PARAGRAPH_TAGS = ('p', 'pre', 'td', 'blockquote', 'li', 'h1', 'h2', 'h3', 'h4', 'section', 'article')
+# 输出时需要换行的块级标签
+BLOCK_TAGS = frozenset(('p', 'div', 'pre', 'blockquote', 'li', 'ul', 'ol', 'table', 'tr', 'section',
+                        'article', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'br', 'hr', 'main', 'dd', 'dt'))
+
+NEGATIVE_RE = re.compile(
+    r'comment|footer|foot|sidebar|side-bar|menu|nav|banner|breadcrumb|share|social|related|'
+    r'recommend|popup|modal|cookie|subscribe|advert|\bads?\b|ad-|sponsor|widget|copyright|login',
+    re.I)
+POSITIVE_RE = re.compile(r'article|content|post|entry|main|text|body|story|detail|rich_media', re.I)
+PUNCTUATION_RE = re.compile(r'[,，。；;！？!?、]')
+WHITESPACE_RE = re.compile(r'[ \t\r\f\v 　]+')
+
+MAX_TEXT_CHARS = int(os.getenv("WEB_MAX_TEXT_CHARS", "20000"))
+# 提取算法版本，变更后旧的正文缓存自动失效
+ENGINE_VERSION = 'readability-1'
+
+
+class _LxmlBackend:
+    """lxml 解析后端"""
+
+    name = 'lxml'
+
+    def parse(self, html):
+        if isinstance(html, str):
+            # lxml 不接受带编码声明的 str，统一转成字节
+            html = html.encode('utf-8')
+        # 用 etree 而不是 lxml.html：后者给每个节点做自定义类查找，慢数倍
+        parser = lxml.etree.HTMLParser(encoding='utf-8', remove_comments=True, remove_pis=True)
+        root = lxml.etree.fromstring(html, parser=parser)
+        if root is None:
+            return lxml.etree.Element('body')
+        body = root.find('body')
+        return body if body is not None else root
+
+    def elements(self, root):
+        return [el for el in root.iter() if isinstance(el.tag, str)]
+
+    def tag(self, el):
+        return el.tag.lower() if isinstance(el.tag, str) else ''
+
+    def attrs(self, el):
+        return f"{el.get('class', '')} {el.get('id', '')}"
+
+    def parent(self, el):
+        return el.getparent()
+
+    def children(self, el):
+        return [child for child in el if isinstance(child.tag, str)]
+
+    def text(self, el):
+        return ''.join(el.itertext())
+
+    def link_text_length(self, el):
+        return sum(len(''.join(a.itertext())) for a in el.iter('a'))
+
+    def remove(self, el):
+        parent = el.getparent()
+        if parent is not None:
+            # 保留尾随文本
+            if el.tail:
+                previous = el.getprevious()
+                if previous is not None:
+                    previous.tail = (previous.tail or '') + el.tail
+                else:
+                    parent.text = (parent.text or '') + el.tail
+            parent.remove(el)
+
+    def block_text(self, el, out):
+        """按块级元素换行输出文本"""
+        tag = self.tag(el)
+        if tag in BLOCK_TAGS:
+            out.append('\n')
+        if el.text:
+            out.append(el.text)
+        for child in el:
+            if isinstance(child.tag, str):
+                self.block_text(child, out)
+            if child.tail:
+                out.append(child.tail)
+        if tag in BLOCK_TAGS:
+            out.append('\n')
+
+
+class _SoupBackend:
+    """BeautifulSoup + html.parser 后端（纯 Python 兜底）"""
+
+    name = 'html.parser'
+
+    def parse(self, html):
+        soup = BeautifulSoup(html, 'html.parser')
+        return soup.body or soup
+
+    def elements(self, root):
+        return [root] + root.find_all(True)
+
+    def tag(self, el):
+        return (el.name or '').lower()
+
+    def attrs(self, el):
+        classes = el.get('class') or []
+        if isinstance(classes, str):
+            classes = [classes]
+        return f"{' '.join(classes)} {el.get('id') or ''}"
+
+    def parent(self, el):
+        return el.parent
+
+    def children(self, el):
+        return el.find_all(True, recursive=False)
+
+    def text(self, el):
+        return el.get_text()
+
+    def link_text_length(self, el):
+        return sum(len(a.get_text()) for a in el.find_all('a'))
+
+    def remove(self, el):
+        # 祖先节点可能已经被删除
+        if not el.decomposed:
+            el.decompose()
+
+    def block_text(self, el, out):
+        from bs4 import NavigableString, Comment
+        tag = self.tag(el)
+        if tag in BLOCK_TAGS:
+            out.append('\n')
+        for child in el.children:
+            if isinstance(child, Comment):
+                continue
+            if isinstance(child, NavigableString):
+                out.append(str(child))
+            else:
+                self.block_text(child, out)
+        if tag in BLOCK_TAGS:
+            out.append('\n')
+
+
+BACKENDS = {'html.parser': _SoupBackend}
+if lxml is not None:
+    BACKENDS['lxml'] = _LxmlBackend
+
+
+def get_backend(name=None):
+    """按名称获取解析后端；默认优先 lxml"""
+    name = name or os.getenv("WEB_PARSER_BACKEND") or ('lxml' if 'lxml' in BACKENDS else 'html.parser')
+    return BACKENDS.get(name, _SoupBackend)()
+
+
+def _clean_text(raw):
+    lines = (WHITESPACE_RE.sub(' ', line).strip() for line in raw.splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+def _class_weight(backend, el):
+    attrs = backend.attrs(el)
+    weight = 0
+    if NEGATIVE_RE.search(attrs):
+        weight -= 25
+    if POSITIVE_RE.search(attrs):
+        weight += 25
+    return weight
+
+
+def _find_main_content(backend, root):
+    """readability 风格的正文容器识别，返回选中的元素列表"""
+    scores = {}
+    nodes = {}
+
+    def add(el, value):
+        if el is None:
+            return
+        key = id(el)
+        if key not in scores:
+            nodes[key] = el
+            scores[key] = _class_weight(backend, el) + (5 if backend.tag(el) in ('article', 'main') else 0)
+        scores[key] += value
+
+    for el in backend.elements(root):
+        if backend.tag(el) not in PARAGRAPH_TAGS:
+            continue
+        text = backend.text(el).strip()
+        if len(text) < 25:
+            continue
+        score = 1 + len(PUNCTUATION_RE.findall(text)) + min(len(text) // 100, 3)
+        parent = backend.parent(el)
+        add(parent, score)
+        if parent is not None:
+            add(backend.parent(parent), score / 2)
+
+    if not scores:
+        return []
+
+    # 按链接密度降权
+    for key, el in nodes.items():
+        text_length = len(backend.text(el)) or 1
+        scores[key] *= 1 - min(backend.link_text_length(el) / text_length, 1)
+
+    best_key = max(scores, key=scores.get)
+    best = nodes[best_key]
+    threshold = max(10, scores[best_key] * 0.2)
+    parent = backend.parent(best)
+    if parent is None:
+        return [best]
+
+    # 同一父节点下得分接近的兄弟节点也属于正文（例如被拆成多个 div 的文章）
+    siblings = []
+    for sibling in backend.children(parent):
+        if sibling is best or scores.get(id(sibling), 0) >= threshold:
+            siblings.append(sibling)
+    return siblings or [best]
+
+
+def extract_main_text(html, backend=None, max_chars=None):
+    """从 HTML 中提取正文文本"""
+    backend = backend if backend is not None and not isinstance(backend, str) else get_backend(backend)
+    max_chars = MAX_TEXT_CHARS if max_chars is None else max_chars
+    root = backend.parse(html)
+
+    for el in backend.elements(root):
+        if backend.tag(el) in REMOVE_TAGS:
+            backend.remove(el)
+
+    # 删除明显的噪音容器（评论区、侧栏等），正文候选不受影响
+    for el in backend.elements(root):
+        if backend.tag(el) not in ('div', 'section', 'ul', 'span'):
+            continue
+        attrs = backend.attrs(el)
+        if NEGATIVE_RE.search(attrs) and not POSITIVE_RE.search(attrs):
+            backend.remove(el)
+
+    candidates = _find_main_content(backend, root)
+    out = []
+    for el in candidates:
+        backend.block_text(el, out)
+    text = _clean_text(''.join(out))
+
+    # 识别失败（正文过短）时回退为整页文本
+    if len(text) < 200:
+        out = []
+        backend.block_text(root, out)
+        full_text = _clean_text(''.join(out))
+        if len(full_text) > len(text):
+            text = full_text
+
+    if max_chars and len(text) > max_chars:
+        text = text[:max_chars] + "\n……（内容过长，已截断）"
+    return text
@@ -0,0 +1,116 @@
+"""
+Flask 响应压缩
+
+根据 Accept-Encoding 协商 br（需要安装 brotli）或 gzip：
+- 普通响应体积超过阈值时整体压缩
+- 流式响应（direct_passthrough）逐块压缩，不会把整个文件读进内存
+- SSE、206 分段响应、已编码或体积很小的响应不处理
+"""
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:  # 未安装时只支持 gzip
+    brotli = None
+
+# 低于该大小的响应不压缩
+MIN_COMPRESS_SIZE = 1024
+# 可压缩的内容类型
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml')
+
+
+def _accepted_encodings(header):
+    """解析 Accept-Encoding，返回 q > 0 的编码集合"""
+    accepted = set()
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name and q > 0:
+            accepted.add(name)
+    return accepted
+
+
+def choose_encoding(header):
+    accepted = _accepted_encodings(header)
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _compress_stream(chunks, encoding):
+    """逐块压缩可迭代的响应体"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        # wbits=31：带 gzip 头
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+def _should_compress(response):
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if 'Content-Encoding' in response.headers or 'Content-Range' in response.headers:
+        return False
+    mimetype = response.mimetype or ''
+    if mimetype == 'text/event-stream':
+        return False
+    return mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def init_compression(app, min_size=MIN_COMPRESS_SIZE):
+    """为 Flask 应用注册压缩钩子"""
+
+    @app.after_request
+    def compress_response(response):
+        from flask import request
+
+        if not _should_compress(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+
+        if response.direct_passthrough or response.is_streamed:
+            response.direct_passthrough = False
+            response.response = _compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            response.set_data(_compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        # 压缩后字节不同，强 ETag 降级为弱 ETag（与 nginx 的做法一致），条件请求仍可命中
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    return app
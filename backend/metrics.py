@@ -0,0 +1,275 @@
+"""
+Prometheus 指标
+
+不依赖 prometheus_client 的最小实现：
+- Counter / Gauge / Histogram，支持标签（labels(...) 返回对应标签组合的子指标）
+- REGISTRY.render() 输出 Prometheus 文本格式（0.0.4）
+- init_metrics(app) 为 Flask 应用记录每个路由的请求耗时，并在 /metrics 暴露本进程的指标
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 默认的耗时分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """进程内的指标集合"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标 {metric.name} 已注册")
+            self._metrics[metric.name] = metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return ''.join(metric.render() for metric in metrics)
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values, **kwvalues):
+        """返回指定标签值的子指标"""
+        if kwvalues:
+            values = tuple(str(kwvalues[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {_escape(self.documentation)}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        with self._lock:
+            children = sorted(self._children.items())
+        for values, child in children:
+            lines.extend(child.samples(self.name, list(zip(self.labelnames, values))))
+        return '\n'.join(lines) + '\n'
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError("计数器只能增加")
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def samples(self, name, pairs):
+        return [f"{name}{_format_labels(pairs)} {_format_value(self._value)}"]
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    @contextmanager
+    def track_inprogress(self):
+        """进入时加一，退出时减一"""
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+
+class Gauge(_Metric):
+    """可增可减的当前值"""
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        """记录代码块的耗时（秒）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    @property
+    def count(self):
+        return sum(self._counts)
+
+    @property
+    def sum(self):
+        return self._sum
+
+    def samples(self, name, pairs):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self._buckets + (float('inf'),), counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(pairs + [('le', _format_value(float(bound)))])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(pairs)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(pairs)} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    """分桶统计的分布（耗时、速率等）"""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(float(bound) for bound in buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+# ---------- 两个服务共用的 HTTP 指标 ----------
+
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds',
+    '按路由统计的请求耗时（流式响应只统计到响应头返回）',
+    ['endpoint', 'method', 'status'],
+)
+SSE_ACTIVE_STREAMS = Gauge(
+    'sse_active_streams',
+    '当前打开的 SSE 流数量',
+    ['stream'],
+)
+
+
+def observe_request(endpoint, method, status, seconds):
+    HTTP_REQUEST_DURATION.labels(endpoint=endpoint, method=method, status=status).observe(seconds)
+
+
+def init_metrics(app):
+    """为 Flask 应用注册请求耗时统计和 /metrics 路由"""
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            # 用路由模板而不是实际路径作为标签，避免标签数量无限增长
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            observe_request(endpoint, request.method, response.status_code, time.perf_counter() - started)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Prometheus 指标"""
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+    return app
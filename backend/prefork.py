@@ -0,0 +1,135 @@
+"""
+多进程（pre-fork）启动
+
+主进程先绑定监听端口，再 fork 出 SERVICE_WORKERS 个工作进程共用这个套接字，由内核在它们之间分配连接；
+主进程只负责监督：工作进程异常退出时重新拉起，收到 SIGTERM / SIGINT 时通知所有工作进程退出。
+
+工作进程之间不共享内存，需要跨进程一致的状态放在 SQLite（WAL 模式）里：
+- AI 服务：对话检查点（checkpoint_store 的共享模式），任何工作进程都能继续任何会话
+- 文件服务：搜索索引本来就在 SQLite 中；文件树缓存的失效通过 change_log 广播
+
+只支持提供 os.fork 的平台（Linux / macOS）。
+"""
+import os
+import signal
+import socket
+import sqlite3
+import time
+
+from service_log import get_logger, shutdown_logging
+
+logger = get_logger("prefork")
+
+SERVICE_WORKERS = max(int(os.getenv("SERVICE_WORKERS", "1")), 1)
+# 工作进程启动后这么短时间内就退出时，稍等再重新拉起，避免崩溃循环占满 CPU
+_RESPAWN_BACKOFF_SECONDS = 1.0
+
+_worker_index = None
+
+
+def worker_index():
+    """当前工作进程的序号（0 ~ N-1）；不是 pre-fork 模式时返回 None"""
+    return _worker_index
+
+
+def connect_shared_db(path, timeout=30):
+    """打开多个进程共用的 SQLite 数据库：WAL 模式下读写互不阻塞，写冲突时等待而不是立即报错
+
+    连接不能跨 fork 使用，每个进程需要自己打开。
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    db = sqlite3.connect(path, check_same_thread=False, timeout=timeout)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+def bind_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def wsgi_server(app):
+    """返回在共享套接字上运行 WSGI 应用（多线程）的函数"""
+    def serve(sock):
+        from werkzeug.serving import make_server
+        host, port = sock.getsockname()[:2]
+        make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+    return serve
+
+
+def asgi_server(app_path, **config):
+    """返回在共享套接字上运行 ASGI 应用（uvicorn）的函数；app_path 形如 "ai_asgi:app" """
+    def serve(sock):
+        import uvicorn
+        uvicorn.Server(uvicorn.Config(app_path, fd=sock.fileno(), **config)).run()
+    return serve
+
+
+def run(serve, host, port, workers=None, on_worker_start=None):
+    """在主进程中绑定端口并监督工作进程，直到收到退出信号
+
+    serve(sock) 在每个工作进程中运行服务器；on_worker_start(index) 在其之前调用，
+    用于启动只属于该进程的后台任务（预热、文件监听等）。
+    """
+    workers = workers or SERVICE_WORKERS
+    sock = bind_socket(host, port)
+    children = {}  # pid -> (序号, 启动时间)
+    stopping = False
+
+    def spawn(index):
+        global _worker_index
+        pid = os.fork()
+        if pid == 0:
+            _worker_index = index
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                if on_worker_start:
+                    on_worker_start(index)
+                serve(sock)
+            except BaseException:
+                logger.exception("❌ 工作进程 %d 异常退出", index)
+                code = 1
+            finally:
+                # os._exit 不执行 atexit，先写出队列中的日志
+                shutdown_logging()
+                os._exit(code)
+        children[pid] = (index, time.monotonic())
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info("🧵 pre-fork 模式: %d 个工作进程，监听 %s:%d", workers, host, port)
+    for index in range(workers):
+        spawn(index)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index, started = children.pop(pid, (None, 0))
+        if index is None or stopping:
+            continue
+        logger.warning("⚠️ 工作进程 %d (pid %d) 退出，状态 %d，重新启动", index, pid, status)
+        if time.monotonic() - started < _RESPAWN_BACKOFF_SECONDS:
+            time.sleep(_RESPAWN_BACKOFF_SECONDS)
+        if not stopping:
+            spawn(index)
+    sock.close()
+    logger.info("👋 所有工作进程已退出")
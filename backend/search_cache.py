@@ -0,0 +1,253 @@
+"""
+联网搜索结果缓存
+
+包在 TavilySearch 外面：
+- 查询归一化（全半角、大小写、空白和标点），只是措辞上微小差别的查询共用同一条缓存
+- TTL + 条目数上限的 LRU，可选 SQLite 持久化（重启后仍然有效）
+- 单飞（single-flight）：并发的相同查询只向上游发一次请求，其余请求等待同一个结果
+- 统计命中 / 未命中 / 合并次数，便于确定容量和 TTL
+"""
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Optional
+
+from prefork import connect_shared_db
+from service_log import get_logger
+
+logger = get_logger("search_cache")
+
+_PUNCTUATION_RE = re.compile(r'[\s,.!?;:"\'()\[\]{}<>，。！？；：、“”‘’（）【】《》…·~`]+')
+
+
+def normalize_query(query):
+    """归一化查询文本，用作缓存键"""
+    query = unicodedata.normalize('NFKC', query or '').lower()
+    return ' '.join(_PUNCTUATION_RE.sub(' ', query).split())
+
+
+class _LeaderCancelled(Exception):
+    """共享的上游调用随发起它的运行一起被取消"""
+
+
+class SearchCache:
+    """带 TTL 的 LRU 搜索缓存，支持单飞合并和可选的 SQLite 持久化"""
+
+    def __init__(self, ttl_seconds=600, max_entries=512, sqlite_path=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # 键 -> (过期时间, 结果)
+        self._entries = OrderedDict()
+        # 键 -> 正在进行的上游请求
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._db = None
+        self._sqlite_path = sqlite_path
+        if sqlite_path:
+            self._db = self._open_db(sqlite_path)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _open_db(self, sqlite_path):
+        # WAL 模式：多进程部署时各工作进程共用同一个缓存文件
+        db = connect_shared_db(sqlite_path)
+        self._db_pid = os.getpid()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS search_cache ("
+            "key TEXT PRIMARY KEY, result TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        db.execute("DELETE FROM search_cache WHERE expires_at < ?", (time.time(),))
+        db.commit()
+        return db
+
+    def _connection(self):
+        """SQLite 连接不能跨 fork 使用，pre-fork 工作进程首次使用时重新打开"""
+        if self._db is not None and self._db_pid != os.getpid():
+            self._db = self._open_db(self._sqlite_path)
+        return self._db
+
+    @staticmethod
+    def make_key(query, params=None):
+        params = {k: v for k, v in (params or {}).items() if v is not None}
+        return json.dumps([normalize_query(query), params], ensure_ascii=False, sort_keys=True)
+
+    def _lookup(self, key):
+        """在锁内查找未过期的结果，内存未命中时查磁盘"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[1]
+            del self._entries[key]
+        db = self._connection()
+        if db is not None:
+            row = db.execute(
+                "SELECT result, expires_at FROM search_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row and row[1] > now:
+                result = json.loads(row[0])
+                self._remember(key, row[1], result)
+                return result
+        return None
+
+    def _remember(self, key, expires_at, result):
+        self._entries[key] = (expires_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _store(self, key, result):
+        # 上游报错的结果不缓存
+        if isinstance(result, dict) and 'error' in result:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._remember(key, expires_at, result)
+            db = self._connection()
+            if db is not None:
+                try:
+                    db.execute(
+                        "INSERT OR REPLACE INTO search_cache (key, result, expires_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(result, ensure_ascii=False, default=str), expires_at),
+                    )
+                    db.commit()
+                except (sqlite3.Error, TypeError, ValueError) as e:
+                    logger.warning("⚠️ 写入搜索缓存失败: %s", e)
+
+    def _begin(self, key):
+        """返回 (缓存结果, 等待的 Future, 是否由本请求负责调用上游)"""
+        with self._lock:
+            result = self._lookup(key)
+            if result is not None:
+                self.hits += 1
+                return result, None, False
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return None, future, False
+            self.misses += 1
+            future = self._inflight[key] = Future()
+            return None, future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            self._inflight.pop(key, None)
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def get_or_fetch(self, key, fetch):
+        """同步版本：命中缓存直接返回，否则调用 fetch()（并发的相同请求共享一次调用）"""
+        result, future, leader = self._begin(key)
+        if result is not None:
+            return result
+        if not leader:
+            try:
+                return future.result()
+            except _LeaderCancelled:
+                return self.get_or_fetch(key, fetch)
+        try:
+            result = fetch()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._store(key, result)
+        self._finish(key, future, result)
+        return result
+
+    async def aget_or_fetch(self, key, fetch):
+        """异步版本：fetch 为返回协程的函数"""
+        result, future, leader = self._begin(key)
+        if result is not None:
+            return result
+        if not leader:
+            try:
+                # shield：本请求被取消（客户端断开、超时）时只取消自己的等待，不取消共享的 Future
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except _LeaderCancelled:
+                # 负责调用上游的请求被取消（客户端断开），由本请求重新调用
+                return await self.aget_or_fetch(key, fetch)
+        try:
+            result = await fetch()
+        except asyncio.CancelledError:
+            self._finish(key, future, error=_LeaderCancelled())
+            raise
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._store(key, result)
+        self._finish(key, future, result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'disk_enabled': self._db is not None,
+            }
+
+
+search_cache = SearchCache(
+    ttl_seconds=int(os.getenv("SEARCH_CACHE_TTL_SECONDS", "600")),
+    max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "512")),
+    sqlite_path=os.getenv("SEARCH_CACHE_PATH") or None,
+)
+
+
+_search_tool_class = None
+_search_tool_lock = threading.Lock()
+
+
+def create_cached_search(deadline=None, **kwargs):
+    """创建经过 search_cache 的 TavilySearch 工具，工具名称和参数与原工具一致
+
+    deadline 为异步调用（Agent 的调用方式）的期限（秒），超时作为工具错误返回。
+    langchain_tavily 导入较慢，首次调用时才导入并定义子类。
+    """
+    global _search_tool_class
+    with _search_tool_lock:
+        if _search_tool_class is None:
+            from langchain_tavily import TavilySearch
+            from admission import call_with_deadline
+
+            class CachedTavilySearch(TavilySearch):
+                deadline: Optional[float] = None
+
+                def _run(self, query, run_manager=None, **kwargs):
+                    key = search_cache.make_key(query, kwargs)
+                    return search_cache.get_or_fetch(
+                        key, lambda: super(CachedTavilySearch, self)._run(query, run_manager=run_manager, **kwargs)
+                    )
+
+                async def _arun(self, query, run_manager=None, **kwargs):
+                    key = search_cache.make_key(query, kwargs)
+                    return await call_with_deadline(self.name, self.deadline, search_cache.aget_or_fetch(
+                        key, lambda: super(CachedTavilySearch, self)._arun(query, run_manager=run_manager, **kwargs)
+                    ))
+
+            _search_tool_class = CachedTavilySearch
+    if deadline:
+        kwargs.setdefault('handle_tool_error', True)
+    # 指向兼容的搜索端点（代理，或离线基准测试的本地替身）
+    if os.getenv("TAVILY_API_BASE_URL"):
+        kwargs.setdefault('api_base_url', os.getenv("TAVILY_API_BASE_URL"))
+    return _search_tool_class(deadline=deadline, **kwargs)
@@ -0,0 +1,307 @@
+"""
+知识库全文检索
+
+基于 SQLite FTS5 的本地倒排索引（BM25 排序），覆盖 docs/ 和 blog/：
+- 入库前先用 tokenizer.tokenize 做中英文分词（中文二元组），FTS5 只按空格切分
+- 索引持久化在磁盘上，文件增删改时按路径增量更新，启动时只重新索引 mtime/size 变化的文件
+- 文件服务和 AI 服务进程共享同一个索引文件（WAL 模式，读写互不阻塞）
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from tokenizer import tokenize
+from service_log import get_logger
+
+logger = get_logger("search_index")
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKSPACE_ROOTS = {
+    'docs': os.path.join(BASE_DIR, 'docs'),
+    'blog': os.path.join(BASE_DIR, 'blog'),
+}
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'search_index.db')
+
+# 参与索引的文件类型
+INDEXED_EXTENSIONS = ('.md', '.mdx', '.markdown', '.txt')
+# 单次查询最多使用的词项数
+MAX_QUERY_TERMS = 32
+# 生成摘要时只读取文件开头这么多字符（不解析全文，也不占用 read_doc_file 的文档缓存）
+SNIPPET_SOURCE_CHARS = 8192
+
+_TITLE_RE = re.compile(r'^#\s+(.+?)\s*#*\s*$', re.MULTILINE)
+_FRONT_TITLE_RE = re.compile(r'^title:\s*["\']?(.+?)["\']?\s*$', re.MULTILINE)
+
+
+def _extract_title(content, file_name):
+    """优先取 frontmatter 的 title，其次是一级标题，最后是文件名"""
+    head = content[:4096]
+    if head.startswith('---'):
+        match = _FRONT_TITLE_RE.search(head)
+        if match:
+            return match.group(1)
+    match = _TITLE_RE.search(head)
+    if match:
+        return match.group(1)
+    return os.path.splitext(file_name)[0]
+
+
+def _read_head(full_path, chars=SNIPPET_SOURCE_CHARS):
+    """读取文件开头的一段文本，用于生成摘要"""
+    with open(full_path, 'r', encoding='utf-8', errors='replace') as f:
+        return f.read(chars)
+
+
+def _like_prefix(rel_path):
+    """构造匹配某目录下所有路径的 LIKE 模式"""
+    prefix = rel_path.rstrip('/') + '/'
+    return prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _make_snippet(content, terms, width=80):
+    """截取包含首个命中词的一段原文"""
+    lowered = content.lower()
+    positions = [p for p in (lowered.find(t) for t in terms) if p >= 0]
+    start = max(min(positions) - width // 4, 0) if positions else 0
+    snippet = ' '.join(content[start:start + width].split())
+    return ('…' if start > 0 else '') + snippet + ('…' if start + width < len(content) else '')
+
+
+class SearchIndex:
+    """持久化、可增量更新的全文索引"""
+
+    def __init__(self, roots=None, index_path=None):
+        self.roots = roots or WORKSPACE_ROOTS
+        self.index_path = index_path or DEFAULT_INDEX_PATH
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(self.index_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                workspace TEXT NOT NULL,
+                path TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                UNIQUE (workspace, path)
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS fts USING fts5(title, body);
+        """)
+        self._db.commit()
+
+    # ---------- 写入 ----------
+
+    def _full_path(self, workspace, rel_path):
+        return os.path.join(self.roots[workspace], rel_path)
+
+    def _index_file(self, workspace, rel_path, stat=None):
+        """（重新）索引单个文件，不提交事务"""
+        full_path = self._full_path(workspace, rel_path)
+        stat = stat or os.stat(full_path)
+        with open(full_path, 'r', encoding='utf-8', errors='replace') as f:
+            content = f.read()
+        title = _extract_title(content, os.path.basename(rel_path))
+        row = self._db.execute(
+            "SELECT id FROM files WHERE workspace = ? AND path = ?", (workspace, rel_path)
+        ).fetchone()
+        if row:
+            file_id = row[0]
+            self._db.execute(
+                "UPDATE files SET mtime_ns = ?, size = ?, title = ? WHERE id = ?",
+                (stat.st_mtime_ns, stat.st_size, title, file_id),
+            )
+            self._db.execute("DELETE FROM fts WHERE rowid = ?", (file_id,))
+        else:
+            file_id = self._db.execute(
+                "INSERT INTO files (workspace, path, mtime_ns, size, title) VALUES (?, ?, ?, ?, ?)",
+                (workspace, rel_path, stat.st_mtime_ns, stat.st_size, title),
+            ).lastrowid
+        self._db.execute(
+            "INSERT INTO fts (rowid, title, body) VALUES (?, ?, ?)",
+            (file_id, ' '.join(tokenize(title)), ' '.join(tokenize(content))),
+        )
+
+    def _remove(self, workspace, rel_path):
+        """删除某个文件或目录下全部文件的索引，不提交事务"""
+        ids = [r[0] for r in self._db.execute(
+            "SELECT id FROM files WHERE workspace = ? AND (path = ? OR path LIKE ? ESCAPE '\\')",
+            (workspace, rel_path, _like_prefix(rel_path)),
+        )]
+        for file_id in ids:
+            self._db.execute("DELETE FROM fts WHERE rowid = ?", (file_id,))
+            self._db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+        return len(ids)
+
+    def _walk(self, workspace, rel_dir=''):
+        """遍历目录下所有可索引文件，产出 (相对路径, stat)"""
+        full_dir = self._full_path(workspace, rel_dir) if rel_dir else self.roots[workspace]
+        try:
+            entries = list(os.scandir(full_dir))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                yield from self._walk(workspace, rel_path)
+            elif entry.name.lower().endswith(INDEXED_EXTENSIONS):
+                yield rel_path, entry.stat()
+
+    def update_path(self, workspace, rel_path):
+        """文件或目录被创建/修改后调用；路径已不存在时等同于删除"""
+        rel_path = os.path.normpath(rel_path).replace(os.sep, '/')
+        full_path = self._full_path(workspace, rel_path)
+        with self._lock:
+            try:
+                if os.path.isdir(full_path):
+                    for path, stat in self._walk(workspace, rel_path):
+                        self._index_file(workspace, path, stat)
+                elif os.path.isfile(full_path) and rel_path.lower().endswith(INDEXED_EXTENSIONS):
+                    stat = os.stat(full_path)
+                    # 同一次修改可能被 API 和文件监听各通知一次，未变化时跳过
+                    row = self._db.execute(
+                        "SELECT mtime_ns, size FROM files WHERE workspace = ? AND path = ?",
+                        (workspace, rel_path),
+                    ).fetchone()
+                    if row != (stat.st_mtime_ns, stat.st_size):
+                        self._index_file(workspace, rel_path, stat)
+                else:
+                    self._remove(workspace, rel_path)
+                self._db.commit()
+            except Exception as e:
+                self._db.rollback()
+                logger.warning("⚠️ 更新搜索索引失败 %s/%s: %s", workspace, rel_path, e)
+
+    def remove_path(self, workspace, rel_path):
+        """文件或目录被删除后调用"""
+        rel_path = os.path.normpath(rel_path).replace(os.sep, '/')
+        with self._lock:
+            try:
+                self._remove(workspace, rel_path)
+                self._db.commit()
+            except Exception as e:
+                self._db.rollback()
+                logger.warning("⚠️ 删除搜索索引失败 %s/%s: %s", workspace, rel_path, e)
+
+    def rename_path(self, workspace, old_path, new_path):
+        """文件或目录被重命名后调用：内容未变，只改写路径，不重新分词"""
+        old_path = os.path.normpath(old_path).replace(os.sep, '/')
+        new_path = os.path.normpath(new_path).replace(os.sep, '/')
+        with self._lock:
+            try:
+                # 目标路径上可能残留旧索引
+                self._remove(workspace, new_path)
+                self._db.execute(
+                    "UPDATE files SET path = ? || substr(path, ?) "
+                    "WHERE workspace = ? AND (path = ? OR path LIKE ? ESCAPE '\\')",
+                    (new_path, len(old_path) + 1, workspace, old_path, _like_prefix(old_path)),
+                )
+                self._db.commit()
+            except Exception as e:
+                self._db.rollback()
+                logger.warning("⚠️ 重命名搜索索引失败 %s/%s -> %s: %s", workspace, old_path, new_path, e)
+                return
+        # 文件扩展名变化时（例如 .txt → .md），重新判断是否需要索引
+        was_indexed = old_path.lower().endswith(INDEXED_EXTENSIONS)
+        if was_indexed != new_path.lower().endswith(INDEXED_EXTENSIONS):
+            self.update_path(workspace, new_path)
+
+    def sync(self):
+        """与磁盘对账：只索引新增或 mtime/size 变化的文件，删除已不存在的文件"""
+        started = time.time()
+        indexed = removed = 0
+        with self._lock:
+            try:
+                for workspace, root in self.roots.items():
+                    known = {
+                        path: (file_id, mtime_ns, size)
+                        for file_id, path, mtime_ns, size in self._db.execute(
+                            "SELECT id, path, mtime_ns, size FROM files WHERE workspace = ?", (workspace,)
+                        )
+                    }
+                    if os.path.isdir(root):
+                        for rel_path, stat in self._walk(workspace):
+                            current = known.pop(rel_path, None)
+                            if current and current[1] == stat.st_mtime_ns and current[2] == stat.st_size:
+                                continue
+                            try:
+                                self._index_file(workspace, rel_path, stat)
+                                indexed += 1
+                            except OSError:
+                                continue
+                    for file_id, _, _ in known.values():
+                        self._db.execute("DELETE FROM fts WHERE rowid = ?", (file_id,))
+                        self._db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+                        removed += 1
+                self._db.commit()
+            except BaseException:
+                # 不把只做了一半的对账留在连接的事务里，被下一次写入一并提交
+                self._db.rollback()
+                raise
+        logger.info("🔎 搜索索引同步完成：新增/更新 %d，删除 %d，耗时 %.2fs", indexed, removed, time.time() - started)
+        return {'indexed': indexed, 'removed': removed}
+
+    # ---------- 查询 ----------
+
+    def search(self, query, limit=10, workspace=None):
+        """BM25 检索，返回按相关度排序的结果列表"""
+        terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+        if not terms:
+            return []
+        match = ' OR '.join('"' + t.replace('"', '""') + '"' for t in terms)
+        sql = (
+            "SELECT files.workspace, files.path, files.title, bm25(fts, 3.0, 1.0) AS score "
+            "FROM fts JOIN files ON files.id = fts.rowid WHERE fts MATCH ?"
+        )
+        params = [match]
+        if workspace:
+            sql += " AND files.workspace = ?"
+            params.append(workspace)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(int(limit))
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+
+        # 原始查询中的英文单词和中文片段，用于在原文中定位摘要
+        raw_terms = [t for t in re.split(r'\s+', query.lower()) if t] + terms
+        results = []
+        for ws, path, title, score in rows:
+            try:
+                snippet = _make_snippet(_read_head(self._full_path(ws, path)), raw_terms)
+            except OSError:
+                snippet = ''
+            results.append({
+                'workspace': ws,
+                'path': path,
+                'title': title,
+                'score': round(-score, 6),
+                'snippet': snippet,
+            })
+        return results
+
+    def stats(self):
+        with self._lock:
+            count = self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        return {'files': count, 'index_path': self.index_path}
+
+
+_search_index = None
+_search_index_lock = threading.Lock()
+
+
+def get_search_index():
+    """获取全局索引实例（首次使用时创建，索引为空时先同步一次）"""
+    global _search_index
+    with _search_index_lock:
+        if _search_index is None:
+            index = SearchIndex(index_path=os.getenv("SEARCH_INDEX_PATH") or None)
+            if index.stats()['files'] == 0:
+                index.sync()
+            _search_index = index
+    return _search_index
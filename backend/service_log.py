@@ -0,0 +1,229 @@
+"""
+结构化日志
+
+两个服务共用的日志层，替代热路径上的 print：
+- 分级：LOG_LEVEL 控制输出级别（默认 INFO），逐 token 的诊断信息只在 DEBUG 级别生成
+- 关联：get_logger(name, request_id=...) 绑定的上下文字段会出现在这条请求的每一行日志中
+- 采样：逐块事件通过 RateSampler 限速，被丢弃的条数记在下一条放行的日志里
+- 异步：日志记录先放进有界队列，由后台线程格式化和写出；队列满时直接丢弃，不阻塞流式输出
+- LOG_FORMAT=json 时每行输出一个 JSON 对象，便于日志系统采集
+- fork 出的工作进程（pre-fork 模式）会自动换新队列并重启后台写出线程
+"""
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# 所有服务日志器的公共前缀
+LOGGER_NAME = "backend"
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# 每个请求每秒最多输出的逐块事件数
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "20"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+
+class RequestLogger(logging.LoggerAdapter):
+    """带上下文字段的日志器，调用时可以用 fields= 附加本条日志的结构化字段"""
+
+    def process(self, msg, kwargs):
+        context = dict(self.extra)
+        fields = kwargs.pop('fields', None)
+        if fields:
+            context.update(fields)
+        kwargs['extra'] = {**kwargs.get('extra', {}), 'context': context}
+        return msg, kwargs
+
+    def bind(self, **context):
+        """返回附加了更多上下文字段的新日志器"""
+        return RequestLogger(self.logger, {**self.extra, **context})
+
+    def sampled(self, sampler, level, msg, *args, **kwargs):
+        """经过采样器限速的日志；级别未启用时不做任何格式化"""
+        if not self.isEnabledFor(level) or not sampler.allow():
+            return
+        suppressed = sampler.take_suppressed()
+        if suppressed:
+            kwargs['fields'] = {**(kwargs.get('fields') or {}), 'suppressed': suppressed}
+        self.log(level, msg, *args, **kwargs)
+
+
+def get_logger(name, **context):
+    """获取服务日志器，context 中的字段（如 request_id、thread_id）会附加到每条日志"""
+    return RequestLogger(logging.getLogger(f"{LOGGER_NAME}.{name}"), context)
+
+
+class RateSampler:
+    """令牌桶采样：每秒最多放行 rate 条，允许 burst 条突发，并统计被丢弃的条数"""
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = LOG_SAMPLE_RATE if rate is None else rate
+        self.burst = max(burst if burst is not None else self.rate, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._suppressed = 0
+
+    def allow(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        self._suppressed += 1
+        return False
+
+    def take_suppressed(self):
+        """返回并清零自上次放行以来被丢弃的条数"""
+        suppressed, self._suppressed = self._suppressed, 0
+        return suppressed
+
+
+def _context_of(record):
+    return getattr(record, 'context', None) or {}
+
+
+def _exc_text_of(record):
+    if record.exc_text:
+        return record.exc_text
+    if record.exc_info:
+        return logging.Formatter().formatException(record.exc_info)
+    return None
+
+
+class TextFormatter(logging.Formatter):
+    """可读的单行格式：时间 级别 服务/模块 [上下文字段] 消息"""
+
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        timestamp = datetime.datetime.fromtimestamp(record.created).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        name = record.name[len(LOGGER_NAME) + 1:] if record.name.startswith(LOGGER_NAME + '.') else record.name
+        context = _context_of(record)
+        tags = ' '.join(f"{key}={value}" for key, value in context.items())
+        line = f"{timestamp} {record.levelname:<5} {self.service}/{name} "
+        if tags:
+            line += f"[{tags}] "
+        line += record.getMessage()
+        exc_text = _exc_text_of(record)
+        if exc_text:
+            line += '\n' + exc_text
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志一个 JSON 对象"""
+
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'service': self.service,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in _context_of(record).items():
+            entry.setdefault(key, value)
+        exc_text = _exc_text_of(record)
+        if exc_text:
+            entry['exc'] = exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """写入有界队列，队列满时丢弃并计数，而不是阻塞调用方"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 只有这一个处理器，不需要像父类那样复制记录；参数和异常在调用方线程展开成文本
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler = None
+_listener = None
+_configure_lock = threading.Lock()
+
+
+def configure_logging(service, level=None, fmt=None, stream=None):
+    """为服务安装异步日志处理器（幂等）；返回根日志器"""
+    global _handler, _listener
+    root = logging.getLogger(LOGGER_NAME)
+    with _configure_lock:
+        if _listener is not None:
+            return root
+        formatter = (JsonFormatter if (fmt or LOG_FORMAT) == 'json' else TextFormatter)(service)
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(formatter)
+        _handler = _DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+        _listener = logging.handlers.QueueListener(_handler.queue, output, respect_handler_level=False)
+        _listener.start()
+        atexit.register(shutdown_logging)
+        root.addHandler(_handler)
+        root.setLevel(level or LOG_LEVEL)
+        root.propagate = False
+    return root
+
+
+def shutdown_logging():
+    """写出队列中剩余的日志并停止后台线程"""
+    global _handler, _listener
+    with _configure_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        logging.getLogger(LOGGER_NAME).removeHandler(_handler)
+        _handler = None
+        _listener = None
+
+
+def _restart_after_fork():
+    """fork 出的子进程里没有后台写出线程，换一个新队列并重新启动监听器"""
+    global _configure_lock, _listener
+    _configure_lock = threading.Lock()
+    if _listener is None:
+        return
+    _handler.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _handler.dropped = 0
+    _listener = logging.handlers.QueueListener(_handler.queue, *_listener.handlers, respect_handler_level=False)
+    _listener.start()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def logging_stats():
+    if _handler is None:
+        return {"configured": False}
+    return {
+        "configured": True,
+        "level": logging.getLevelName(logging.getLogger(LOGGER_NAME).level),
+        "queued": _handler.queue.qsize(),
+        "dropped": _handler.dropped,
+    }
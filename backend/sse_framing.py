@@ -0,0 +1,161 @@
+"""
+SSE 分帧
+
+模型按 token 输出，每个 token 单独发一个 SSE 事件会带来大量的 JSON 序列化、写调用和代理刷新。
+这里把相邻的文本块按时间窗口和大小合并成一帧：
+- 空闲超过一个窗口后到达的文本块（包括第一个 token）立即发送，不增加首字延迟
+- 连续到达的文本块缓冲起来，窗口到期或缓冲超过 max_bytes 时发送
+- 上游暂停（例如调用工具）时，窗口到期后缓冲内容照常发出，不会等到下一个 token
+- coalesce_threadsafe 等待期间定期检查客户端是否已断开，断开后立即停止并关闭上游的异步流
+"""
+import asyncio
+import concurrent.futures
+import json
+import os
+import time
+from service_log import get_logger
+
+logger = get_logger("sse_framing")
+
+# 等待上游输出时检查客户端是否断开的间隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# 需要单独成帧、不能与普通文本合并的内容前缀
+_STANDALONE_PREFIXES = ('[TOOL_RESULT]',)
+
+
+def format_event(payload):
+    """编码一个 SSE data 事件"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+class FrameCoalescer:
+    """按时间窗口和字节数合并文本块"""
+
+    def __init__(self, window=0.03, max_bytes=2048):
+        self.window = window
+        self.max_bytes = max_bytes
+        self._buffer = []
+        self._size = 0
+        self._started_at = None
+        self._last_emit = None
+        self.chunks = 0
+        self.frames = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            window=int(os.getenv("SSE_COALESCE_MS", "30")) / 1000,
+            max_bytes=int(os.getenv("SSE_COALESCE_MAX_BYTES", "2048")),
+        )
+
+    def _emit(self, text, now):
+        self._last_emit = now
+        self.frames += 1
+        return text
+
+    def push(self, text, now=None):
+        """加入一个文本块，返回现在就应该发送的帧列表"""
+        now = time.monotonic() if now is None else now
+        self.chunks += 1
+        if text.startswith(_STANDALONE_PREFIXES):
+            frames = [self.take(now)] if self._buffer else []
+            return frames + [self._emit(text, now)]
+        # 空闲了一个窗口以上：立即发送
+        if not self._buffer and (self.window <= 0 or self._last_emit is None or now - self._last_emit >= self.window):
+            return [self._emit(text, now)]
+        if not self._buffer:
+            self._started_at = now
+        self._buffer.append(text)
+        self._size += len(text.encode('utf-8'))
+        if self._size >= self.max_bytes or now - self._started_at >= self.window:
+            return [self.take(now)]
+        return []
+
+    def timeout(self, now=None):
+        """距离缓冲区必须发送还剩多少秒；缓冲区为空时返回 None（无限等待）"""
+        if not self._buffer:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(self._started_at + self.window - now, 0)
+
+    def take(self, now=None):
+        """取出缓冲区中的全部文本作为一帧；缓冲区为空时返回空字符串"""
+        if not self._buffer:
+            return ''
+        text = ''.join(self._buffer)
+        self._buffer = []
+        self._size = 0
+        self._started_at = None
+        return self._emit(text, time.monotonic() if now is None else now)
+
+
+async def coalesce_async(chunks, coalescer):
+    """把异步文本流合并成帧（异步生成器）"""
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(chunks.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=coalescer.timeout())
+            if not done:
+                yield coalescer.take()
+                continue
+            task, pending = pending, None
+            try:
+                chunk = task.result()
+            except StopAsyncIteration:
+                break
+            if chunk:
+                for frame in coalescer.push(chunk):
+                    yield frame
+        rest = coalescer.take()
+        if rest:
+            yield rest
+    finally:
+        if pending is not None:
+            pending.cancel()
+            try:
+                await pending
+            except BaseException:
+                pass
+        await chunks.aclose()
+
+
+def coalesce_threadsafe(chunks, loop, coalescer, is_disconnected=None):
+    """在另一个线程的事件循环中驱动异步文本流，同步地产出合并后的帧（供 Flask 使用）
+
+    is_disconnected() 返回 True（客户端已断开）时不再等待，关闭异步流后结束。
+    """
+    future = None
+    try:
+        while True:
+            if future is None:
+                future = asyncio.run_coroutine_threadsafe(chunks.__anext__(), loop)
+            timeout = coalescer.timeout()
+            if is_disconnected is not None:
+                timeout = DISCONNECT_POLL_INTERVAL if timeout is None else min(timeout, DISCONNECT_POLL_INTERVAL)
+            try:
+                chunk = future.result(timeout=timeout)
+            except concurrent.futures.TimeoutError:
+                if is_disconnected is not None and is_disconnected():
+                    return
+                yield coalescer.take()
+                continue
+            except StopAsyncIteration:
+                future = None
+                break
+            future = None
+            if chunk:
+                yield from coalescer.push(chunk)
+        rest = coalescer.take()
+        if rest:
+            yield rest
+    finally:
+        if future is not None:
+            future.cancel()
+        try:
+            asyncio.run_coroutine_threadsafe(chunks.aclose(), loop).result(timeout=5)
+        except Exception as e:
+            # 被取消的 __anext__ 还未结束时 aclose 会失败，生成器随取消一起结束
+            logger.warning("⚠️ 关闭流时出错: %s", e)
@@ -0,0 +1,43 @@
+"""
+中英文混合分词与 token 估算
+
+笔记以中文为主，不依赖额外的分词库：
+- 英文/数字按单词切分并转小写
+- 连续的中日韩字符切成二元组（单字时保留单字），兼顾召回率和准确率
+"""
+import re
+
+# 英文单词/数字 或 连续的中日韩字符
+_TOKEN_RE = re.compile(
+    r'[a-z0-9][a-z0-9_]*'
+    r'|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+'
+)
+_CJK_RE = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]')
+
+# 常见英文停用词，中文二元组依靠 IDF 自然降权
+STOPWORDS = frozenset(
+    'a an and are as at be by for from in is it of on or that the this to was what with'.split()
+)
+
+
+def tokenize(text):
+    """把文本切分为检索用的词项列表"""
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        word = match.group()
+        if word[0].isascii():
+            if word not in STOPWORDS:
+                tokens.append(word)
+        elif len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def estimate_tokens(text):
+    """粗略估算文本的 LLM token 数：中文约 1 字 1 token，其余约 4 字符 1 token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
@@ -0,0 +1,334 @@
+"""
+请求级执行追踪与按需采样分析
+
+- 每个聊天请求生成一条 Trace：LLM 调用和工具调用（附带 langgraph_node / langgraph_step）按时间排成
+  时间线，另外记录首字、工具请求等事件，用来判断慢在模型、搜索、网页抓取还是 ReAct 轮数过多
+- 最近 TRACE_BUFFER_SIZE 条保存在环形缓冲中，通过调试接口查看
+- 采样分析器默认关闭；arm() 之后，被选中的请求在执行期间按固定间隔采样所有工作线程的调用栈，
+  结果为折叠栈格式（flamegraph.pl、speedscope 可直接读取）
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from agent_metrics import is_error_result
+
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+# 单次采样分析的最长时间，防止忘记关闭的分析器一直运行
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+
+
+class Trace:
+    """一次请求的时间线，时间均为相对请求开始的毫秒数"""
+
+    def __init__(self, request_id, thread_id, question=''):
+        self.request_id = request_id
+        self.thread_id = thread_id
+        self.question = question[:200]
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.spans = []
+        self.events = []
+        self.status = 'running'
+        self.duration_ms = None
+        self.profile = None
+
+    def now_ms(self):
+        return round((time.perf_counter() - self._t0) * 1000, 2)
+
+    def start_span(self, kind, name, **attrs):
+        span = {'kind': kind, 'name': name, 'start_ms': self.now_ms(), 'end_ms': None, **attrs}
+        self.spans.append(span)
+        return span
+
+    def end_span(self, span, status='ok', **attrs):
+        span['end_ms'] = self.now_ms()
+        span['duration_ms'] = round(span['end_ms'] - span['start_ms'], 2)
+        span['status'] = status
+        span.update(attrs)
+
+    def event(self, name, **attrs):
+        self.events.append({'name': name, 'at_ms': self.now_ms(), **attrs})
+
+    def finish(self, status='ok'):
+        if self.duration_ms is None:
+            self.duration_ms = self.now_ms()
+            self.status = status
+
+    def time_in(self, kind):
+        """某类 span 的总耗时（毫秒），尚未结束的 span 计到当前时刻"""
+        now = self.now_ms()
+        return sum((span['end_ms'] if span['end_ms'] is not None else now) - span['start_ms']
+                   for span in self.spans if span['kind'] == kind)
+
+    def interrupted_span_kind(self):
+        """最近一个尚未结束或被取消的 span 的类型（llm / tool），没有时为 None"""
+        for span in reversed(self.spans):
+            if span['end_ms'] is None or span.get('status') == 'cancelled':
+                return span['kind']
+        return None
+
+    def prompt_tokens_saved(self):
+        """本次请求各次模型调用因历史压缩少发送的 prompt token 数之和（每次调用前记一条 history 事件）"""
+        return sum(e.get('saved', 0) for e in self.events if e['name'] == 'history')
+
+    def summary(self):
+        by_kind = Counter()
+        for span in self.spans:
+            if span.get('duration_ms') is not None:
+                by_kind[span['kind']] += span['duration_ms']
+        first_token = next((e['at_ms'] for e in self.events if e['name'] == 'first_token'), None)
+        return {
+            'requestId': self.request_id,
+            'threadId': self.thread_id,
+            'question': self.question,
+            'startedAt': self.started_at,
+            'status': self.status,
+            'durationMs': self.duration_ms,
+            'firstTokenMs': first_token,
+            'llmCalls': sum(1 for span in self.spans if span['kind'] == 'llm'),
+            'toolCalls': sum(1 for span in self.spans if span['kind'] == 'tool'),
+            'timeByKindMs': {kind: round(ms, 2) for kind, ms in by_kind.items()},
+            'promptTokensSaved': self.prompt_tokens_saved(),
+            'profiled': self.profile is not None,
+        }
+
+    def to_dict(self):
+        return {
+            **self.summary(),
+            'spans': sorted(self.spans, key=lambda span: span['start_ms']),
+            'events': list(self.events),
+            'profile': {k: v for k, v in self.profile.items() if k != 'stacks'} if self.profile else None,
+        }
+
+
+class TraceStore:
+    """最近若干条 Trace 的环形缓冲"""
+
+    def __init__(self, max_traces=TRACE_BUFFER_SIZE):
+        self.max_traces = max_traces
+        self._traces = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, request_id, thread_id, question=''):
+        trace = Trace(request_id, thread_id, question)
+        with self._lock:
+            self._traces.pop(request_id, None)
+            self._traces[request_id] = trace
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+        return trace
+
+    def get(self, request_id):
+        with self._lock:
+            return self._traces.get(request_id)
+
+    def recent(self, limit=50):
+        with self._lock:
+            traces = list(self._traces.values())[-limit:]
+        return [trace.summary() for trace in reversed(traces)]
+
+
+trace_store = TraceStore()
+
+
+class TraceCallback(BaseCallbackHandler):
+    """把一次请求中的 LLM 调用和工具调用记录为 Trace 的 span"""
+
+    run_inline = True
+
+    def __init__(self, trace):
+        self.trace = trace
+        self._spans = {}
+
+    def _node_attrs(self, metadata):
+        metadata = metadata or {}
+        return {'node': metadata.get('langgraph_node'), 'step': metadata.get('langgraph_step')}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        name = (kwargs.get('invocation_params') or {}).get('model_name') or (serialized or {}).get('name') or 'llm'
+        prompt_messages = sum(len(batch) for batch in messages)
+        self._spans[run_id] = self.trace.start_span(
+            'llm', name, messages=prompt_messages, **self._node_attrs(metadata)
+        )
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+        usage = (getattr(response, 'llm_output', None) or {}).get('token_usage')
+        self.trace.end_span(span, **({'usage': usage} if usage else {}))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            self._end_with_error(span, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, metadata=None, **kwargs):
+        name = (serialized or {}).get('name') or kwargs.get('name') or 'tool'
+        self._spans[run_id] = self.trace.start_span(
+            'tool', name, input=str(input_str)[:200], **self._node_attrs(metadata)
+        )
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            content = getattr(output, 'content', output)
+            self.trace.end_span(span, 'error' if is_error_result(output) else 'ok', output_chars=len(str(content)))
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            self._end_with_error(span, error)
+
+    def _end_with_error(self, span, error):
+        # 客户端断开后运行被取消，不算作错误
+        if isinstance(error, asyncio.CancelledError):
+            self.trace.end_span(span, 'cancelled')
+        else:
+            self.trace.end_span(span, 'error', error=str(error)[:200])
+
+
+# ---------- 采样分析 ----------
+
+# 叶子帧是这些函数时认为线程处于空闲等待（事件循环空转、线程池等任务），不计入样本
+_IDLE_FRAMES = {
+    ('selectors.py', 'select'),
+    ('threading.py', 'wait'),
+    ('thread.py', '_worker'),
+    ('queue.py', 'get'),
+    ('socketserver.py', 'serve_forever'),
+}
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """定时采样所有线程的调用栈，累计为折叠栈"""
+
+    def __init__(self, interval=0.005, max_seconds=PROFILE_MAX_SECONDS):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+        # stop(on_done) 的回调；采样线程退出时调用
+        self._done_lock = threading.Lock()
+        self._on_done = None
+        self._finished = False
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        own_id = threading.get_ident()
+        deadline = self._started + self.max_seconds
+        while not self._stop.wait(self.interval) and time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+        with self._done_lock:
+            self._finished = True
+            on_done = self._on_done
+        if on_done is not None:
+            on_done(self._result())
+
+    def stop(self, on_done=None):
+        """停止采样并返回结果
+
+        传入 on_done 时不等待采样线程（最多要等一个采样间隔），立即返回 None，
+        结果在采样线程退出时交给 on_done(结果)；在事件循环上调用时应使用这种方式。
+        """
+        if on_done is not None:
+            with self._done_lock:
+                finished = self._finished or self._thread is None
+                if not finished:
+                    self._on_done = on_done
+            self._stop.set()
+            if finished:
+                on_done(self._result())
+            return None
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self._result()
+
+    def _result(self):
+        return {
+            'intervalMs': self.interval * 1000,
+            'samples': self.samples,
+            'durationMs': round((time.perf_counter() - self._started) * 1000, 2),
+            'distinctStacks': len(self.stacks),
+            'stacks': dict(self.stacks),
+        }
+
+
+def collapsed_stacks(profile):
+    """折叠栈文本：每行“帧;帧;帧 次数”"""
+    stacks = profile.get('stacks') or {}
+    return ''.join(f"{stack} {count}\n" for stack, count in sorted(stacks.items(), key=lambda item: -item[1]))
+
+
+class ProfilerControl:
+    """采样分析开关：arm() 后接下来的 count 个请求（可限定会话）会被采样"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._thread_id = None
+        self._interval = 0.005
+
+    def arm(self, count=1, thread_id=None, interval_ms=5):
+        with self._lock:
+            self._remaining = max(int(count), 0)
+            self._thread_id = thread_id or None
+            self._interval = min(max(float(interval_ms), 1.0), 1000.0) / 1000
+        return self.status()
+
+    def disarm(self):
+        return self.arm(count=0)
+
+    def claim(self, thread_id):
+        """请求开始时调用：需要采样时返回已启动的 SamplingProfiler，否则返回 None"""
+        with self._lock:
+            if self._remaining <= 0 or (self._thread_id and self._thread_id != thread_id):
+                return None
+            self._remaining -= 1
+            interval = self._interval
+        return SamplingProfiler(interval=interval).start()
+
+    def status(self):
+        with self._lock:
+            return {
+                'armed': self._remaining > 0,
+                'remaining': self._remaining,
+                'threadId': self._thread_id,
+                'intervalMs': self._interval * 1000,
+            }
+
+
+profiler_control = ProfilerControl()
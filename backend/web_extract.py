@@ -0,0 +1,525 @@
+"""
+网页内容提取（app.py 和 xhs_crawler.py 共用）
+
+- 全局复用一个带连接池的 requests.Session（keep-alive + 重试）
+- 磁盘响应缓存：遵循 Cache-Control / Expires，过期后用 ETag / Last-Modified 做条件请求，
+  总大小超过上限时按最近使用时间淘汰
+- 提取后的正文按 (URL, 内容哈希) 缓存，页面未变化时不再重复解析
+- 下载时流式读取，超过 WEB_MAX_BYTES 即截断；根据首个数据块探测字符集
+- 正文提取见 html_extract（lxml + readability 风格的正文识别）
+- extract_many 并发抓取多个 URL：全局并发上限 + 同一站点的并发数和请求间隔限制，按完成顺序返回
+- 传入 cancel_token 时，所属的聊天运行被取消后中止正在进行的下载（关闭连接），不再等到超时
+"""
+import asyncio
+import codecs
+import email.utils
+import hashlib
+import json
+import os
+import re
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import html_extract
+from cancellation import RunCancelled
+from service_log import get_logger
+
+logger = get_logger("web_extract")
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'zh-CN,zh;q=0.9',
+    'Connection': 'keep-alive'
+}
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'http')
+REQUEST_TIMEOUT = 15
+# 单个页面最多下载的字节数，超出部分丢弃
+MAX_DOWNLOAD_BYTES = int(os.getenv("WEB_MAX_BYTES", str(2 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+# 并发抓取：全局最大并发数、同一站点最大并发数、同一站点两次请求的最小间隔（秒）
+FETCH_CONCURRENCY = int(os.getenv("WEB_FETCH_CONCURRENCY", "8"))
+PER_HOST_CONCURRENCY = int(os.getenv("WEB_PER_HOST_CONCURRENCY", "2"))
+PER_HOST_INTERVAL = int(os.getenv("WEB_PER_HOST_INTERVAL_MS", "250")) / 1000
+# 单次批量抓取最多处理的 URL 数
+MAX_BATCH_URLS = int(os.getenv("EXTRACT_MAX_BATCH_URLS", "10"))
+
+# 只有 Last-Modified 时的启发式新鲜期上限（秒）
+HEURISTIC_MAX_AGE = 24 * 3600
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """获取共享的 HTTP 会话（连接池 + 重试）"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            session.headers.update(DEFAULT_HEADERS)
+            retry = Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504),
+                          allowed_methods=frozenset(['GET', 'HEAD']))
+            adapter = HTTPAdapter(
+                pool_connections=int(os.getenv("HTTP_POOL_CONNECTIONS", "32")),
+                pool_maxsize=int(os.getenv("HTTP_POOL_MAXSIZE", "64")),
+                max_retries=retry,
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+    return _session
+
+
+def _parse_cache_control(value):
+    directives = {}
+    for part in (value or '').split(','):
+        part = part.strip().lower()
+        if not part:
+            continue
+        name, _, arg = part.partition('=')
+        directives[name.strip()] = arg.strip().strip('"')
+    return directives
+
+
+def _parse_http_date(value):
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp() if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _freshness_lifetime(headers, now):
+    """根据响应头计算新鲜期（秒）；返回 None 表示不可缓存"""
+    cache_control = _parse_cache_control(headers.get('Cache-Control'))
+    if 'no-store' in cache_control:
+        return None
+    if 'no-cache' in cache_control:
+        return 0
+    for directive in ('s-maxage', 'max-age'):
+        if directive in cache_control:
+            try:
+                return max(int(cache_control[directive]), 0)
+            except ValueError:
+                return 0
+    expires = _parse_http_date(headers.get('Expires'))
+    if expires is not None:
+        return max(expires - now, 0)
+    last_modified = _parse_http_date(headers.get('Last-Modified'))
+    if last_modified is not None:
+        return min((now - last_modified) * 0.1, HEURISTIC_MAX_AGE)
+    return 0
+
+
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+_HEADER_CHARSET_RE = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.I)
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.I)
+# 常见的中文编码统一按超集 gb18030 解码
+_ENCODING_ALIASES = {'gb2312': 'gb18030', 'gbk': 'gb18030', 'x-gbk': 'gb18030'}
+_TEXT_TYPES = ('text/', 'application/xhtml', 'application/xml')
+
+
+def _normalize_encoding(name):
+    if not name:
+        return None
+    name = name.strip().lower()
+    name = _ENCODING_ALIASES.get(name, name)
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+
+def sniff_encoding(content_type, head):
+    """根据首个数据块确定字符集：BOM > 响应头 charset > <meta charset> > UTF-8 校验 > gb18030"""
+    for bom, name in _BOMS:
+        if head.startswith(bom):
+            return name
+    match = _HEADER_CHARSET_RE.search(content_type or '')
+    encoding = _normalize_encoding(match.group(1)) if match else None
+    if encoding:
+        return encoding
+    match = _META_CHARSET_RE.search(head[:4096])
+    encoding = _normalize_encoding(match.group(1).decode('ascii', 'ignore')) if match else None
+    if encoding:
+        return encoding
+    try:
+        # 末尾可能截断在多字节字符中间
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'gb18030'
+
+
+def _read_limited(response, max_bytes):
+    """流式读取响应体，返回 (字节, 是否被截断)"""
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(CHUNK_SIZE):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= max_bytes:
+            return b''.join(chunks)[:max_bytes], True
+    return b''.join(chunks), False
+
+
+def _abort_response(response):
+    """从其他线程中止正在读取的响应：关闭套接字的读写，阻塞在 recv 上的线程立即返回"""
+    # 不保持连接的响应（HTTP/1.0、Connection: close）读取时连接对象上已没有套接字，从响应的文件对象取
+    fp = getattr(getattr(response.raw, '_fp', None), 'fp', None)
+    sock = getattr(getattr(fp, 'raw', None), '_sock', None) or getattr(getattr(response.raw, '_connection', None), 'sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class HostLimiter:
+    """按站点限制并发数和请求间隔（跨线程、跨会话共享）"""
+
+    def __init__(self, max_concurrency=PER_HOST_CONCURRENCY, interval=PER_HOST_INTERVAL):
+        self.max_concurrency = max_concurrency
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._next_at = {}
+
+    def acquire(self, host):
+        with self._lock:
+            semaphore = self._semaphores.setdefault(host, threading.BoundedSemaphore(self.max_concurrency))
+        semaphore.acquire()
+        # 预约下一个可用时间片，同一站点的请求之间至少间隔 interval 秒
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_at.get(host, 0))
+            self._next_at[host] = start_at + self.interval
+        if start_at > now:
+            time.sleep(start_at - now)
+
+    def release(self, host):
+        self._semaphores[host].release()
+
+
+host_limiter = HostLimiter()
+
+
+class HttpCache:
+    """磁盘 HTTP 响应缓存，按总大小做 LRU 淘汰"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=200 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._sizes = {}
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith('.body'):
+                self._sizes[entry.name[:-5]] = entry.stat().st_size
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def _key(self, url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + '.json', base + '.body'
+
+    def load(self, url):
+        """读取缓存条目，返回 (元数据, 正文字节) 或 None"""
+        meta_path, body_path = self._paths(self._key(url))
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get('url') != url:
+            return None
+        # 用 mtime 记录最近使用时间，供淘汰使用
+        try:
+            os.utime(body_path)
+        except OSError:
+            pass
+        return meta, body
+
+    def store(self, url, meta, body):
+        key = self._key(url)
+        meta_path, body_path = self._paths(key)
+        with self._lock:
+            for path, data, mode in ((body_path, body, 'wb'), (meta_path, json.dumps(meta), 'w')):
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, mode, **({} if 'b' in mode else {'encoding': 'utf-8'})) as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            self._sizes[key] = len(body)
+            self._evict()
+
+    def update_meta(self, url, meta):
+        meta_path, _ = self._paths(self._key(url))
+        tmp_path = f"{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def _evict(self):
+        total = sum(self._sizes.values())
+        if total <= self.max_bytes:
+            return
+        entries = []
+        for key in self._sizes:
+            try:
+                entries.append((os.stat(self._paths(key)[1]).st_mtime, key))
+            except OSError:
+                entries.append((0, key))
+        for _, key in sorted(entries):
+            if total <= self.max_bytes * 0.9:
+                break
+            total -= self._sizes.pop(key)
+            for path in self._paths(key) + (os.path.join(self.cache_dir, key) + '.txt',):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def text_path(self, url):
+        return os.path.join(self.cache_dir, self._key(url)) + '.txt'
+
+
+class FetchResult:
+    """一次抓取的结果"""
+
+    __slots__ = ('url', 'body', 'encoding', 'content_hash', 'source')
+
+    def __init__(self, url, body, encoding, source):
+        self.url = url
+        self.body = body
+        self.encoding = encoding
+        self.content_hash = hashlib.sha256(body).hexdigest()
+        # 'cache'（新鲜缓存）、'revalidated'（304）或 'network'
+        self.source = source
+
+    @property
+    def text(self):
+        return self.body.decode(self.encoding or 'utf-8', errors='replace')
+
+
+_http_cache = None
+_http_cache_lock = threading.Lock()
+
+
+def get_http_cache():
+    global _http_cache
+    with _http_cache_lock:
+        if _http_cache is None:
+            _http_cache = HttpCache(
+                cache_dir=os.getenv("WEB_CACHE_DIR") or DEFAULT_CACHE_DIR,
+                max_bytes=int(os.getenv("WEB_CACHE_MAX_MB", "200")) * 1024 * 1024,
+            )
+    return _http_cache
+
+
+def fetch(url, timeout=REQUEST_TIMEOUT, max_bytes=None, cancel_token=None):
+    """带磁盘缓存和条件请求的 GET；响应体最多读取 max_bytes 字节
+
+    cancel_token 被取消时中止下载并抛出 RunCancelled（已下载的部分不写入缓存）。
+    """
+    max_bytes = max_bytes or MAX_DOWNLOAD_BYTES
+    cache = get_http_cache()
+    now = time.time()
+    cached = cache.load(url)
+    if cached and cached[0].get('truncated'):
+        # 旧版本缓存的不完整响应，不能作为条件请求的基础
+        cached = None
+    headers = {}
+    if cached:
+        meta, body = cached
+        if now < meta.get('fresh_until', 0):
+            cache.hits += 1
+            return FetchResult(url, body, meta.get('encoding'), 'cache')
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    host = urlsplit(url).hostname or ''
+    host_limiter.acquire(host)
+    try:
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        response = get_session().get(url, headers=headers, allow_redirects=True, timeout=timeout, stream=True)
+    except Exception:
+        host_limiter.release(host)
+        raise
+    abort_handle = cancel_token.on_cancel(lambda: _abort_response(response)) if cancel_token is not None else None
+    try:
+        if response.status_code == 304 and cached:
+            meta, body = cached
+            lifetime = _freshness_lifetime(response.headers, now)
+            meta['fresh_until'] = now + (lifetime or 0)
+            cache.update_meta(url, meta)
+            cache.revalidated += 1
+            return FetchResult(url, body, meta.get('encoding'), 'revalidated')
+
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '')
+        if content_type and not content_type.lower().startswith(_TEXT_TYPES):
+            raise ValueError(f"不支持的内容类型: {content_type}")
+        body, truncated = _read_limited(response, max_bytes)
+        if cancel_token is not None:
+            # 连接被关闭后读取可能表现为正常结束，不能把不完整的响应当作结果
+            cancel_token.raise_if_cancelled()
+    finally:
+        if abort_handle is not None:
+            cancel_token.remove(abort_handle)
+        # 截断时连接里还有未读数据，直接关闭而不是放回连接池
+        response.close()
+        host_limiter.release(host)
+
+    cache.misses += 1
+    encoding = sniff_encoding(content_type, body[:CHUNK_SIZE])
+    lifetime = _freshness_lifetime(response.headers, now)
+    etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+    # 只缓存完整的响应，且要么还有新鲜期、要么带校验器（之后可以用条件请求复用）；no-store 时 lifetime 为 None
+    if lifetime is not None and not truncated and (lifetime > 0 or etag or last_modified):
+        cache.store(url, {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'encoding': encoding,
+            'fresh_until': now + lifetime,
+            'stored_at': now,
+        }, body)
+    return FetchResult(url, body, encoding, 'network')
+
+
+class TextCache:
+    """提取结果缓存：内存 LRU + 与 HTTP 缓存同目录的磁盘副本，按内容哈希校验"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url, content_hash):
+        key = (url, content_hash)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        try:
+            with open(get_http_cache().text_path(url), 'r', encoding='utf-8') as f:
+                stored_hash, _, text = f.read().partition('\n')
+        except OSError:
+            return None
+        if stored_hash != content_hash:
+            return None
+        self._remember(key, text)
+        return text
+
+    def put(self, url, content_hash, text):
+        self._remember((url, content_hash), text)
+        path = get_http_cache().text_path(url)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(content_hash + '\n' + text)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("⚠️ 写入正文缓存失败: %s", e)
+
+    def _remember(self, key, text):
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+text_cache = TextCache(max_entries=int(os.getenv("WEB_TEXT_CACHE_ENTRIES", "256")))
+
+
+def extract_webpage_content(url, cancel_token=None):
+    """
+    提取网页内容的工具函数
+    """
+    try:
+        result = fetch(url, cancel_token=cancel_token)
+        # 提取算法升级后旧的正文缓存自动失效
+        cache_key = f"{html_extract.ENGINE_VERSION}:{result.content_hash}"
+        content = text_cache.get(url, cache_key)
+        if content is None:
+            content = html_extract.extract_main_text(result.text)
+            text_cache.put(url, cache_key, content)
+        return content
+
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e),
+            'url': url
+        }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """抓取专用线程池，线程数即全局并发上限"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY, thread_name_prefix="web-fetch")
+    return _executor
+
+
+def _extract_one(url, cancel_token=None):
+    content = extract_webpage_content(url, cancel_token)
+    if isinstance(content, dict):
+        return content
+    return {'success': True, 'url': url, 'content': content}
+
+
+async def extract_many(urls, cancel_token=None):
+    """并发提取多个网页，按完成顺序逐个产出结果；失败的 URL 产出与 extract_webpage_content 相同的错误结构"""
+    urls = list(dict.fromkeys(u.strip() for u in urls if u and u.strip()))
+    skipped = urls[MAX_BATCH_URLS:]
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    futures = [loop.run_in_executor(executor, _extract_one, url, cancel_token) for url in urls[:MAX_BATCH_URLS]]
+    try:
+        for future in asyncio.as_completed(futures):
+            yield await future
+    finally:
+        # 调用方提前退出时，尚未开始的抓取不再执行
+        for future in futures:
+            future.cancel()
+    for url in skipped:
+        yield {'success': False, 'error': f'一次最多提取 {MAX_BATCH_URLS} 个网页', 'url': url}
+
+
+def cache_stats():
+    """缓存命中情况"""
+    cache = get_http_cache()
+    return {
+        'http_hits': cache.hits,
+        'http_revalidated': cache.revalidated,
+        'http_misses': cache.misses,
+        'http_cache_bytes': sum(cache._sizes.values()),
+    }
@@ -1,45 +1,4 @@
-import requests
-from bs4 import BeautifulSoup
+# 网页提取逻辑已移至 web_extract.py（连接池 + 磁盘缓存），这里保留原有导入路径
+from web_extract import extract_webpage_content
 
-def extract_webpage_content(url):
-    """
-    提取网页内容的工具函数
-    """
-    try:
-        # 设置请求头
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'zh-CN,zh;q=0.9',
-            'Connection': 'keep-alive'
-        }
-        
-        # 发送请求
-        response = requests.get(url, headers=headers, allow_redirects=True, timeout=15)
-        response.raise_for_status()
-        
-        # 解析HTML
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # 移除无用标签
-        for tag in soup(["script", "style", "nav", "footer", "header"]):
-            tag.decompose()
-        
-        # 提取文本内容
-        text_content = soup.get_text()
-        lines = (line.strip() for line in text_content.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        content = ' '.join(chunk for chunk in chunks if chunk)
-        
-        return content
-        
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e),
-            'url': url
-        }
-
-
-
-    
\ No newline at end of file
+__all__ = ['extract_webpage_content']
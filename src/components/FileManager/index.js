@@ -1,10 +1,14 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { getBackendUrl } from '../../utils/apiConfig';
+import { saveFileContent } from '../../utils/fileSave';
 
 function FileManager() {
   const [fileTree, setFileTree] = useState([]);
+  const [expandedFolders, setExpandedFolders] = useState(new Set());
   const [selectedFile, setSelectedFile] = useState(null);
   const [fileContent, setFileContent] = useState('');
+  // 上次读取/保存时的内容和版本号，保存时只上传差异
+  const savedFileRef = useRef({ content: '', version: null });
   const [isLoading, setIsLoading] = useState(false);
   const [currentWorkspace, setCurrentWorkspace] = useState('docs');
   const [showCreateModal, setShowCreateModal] = useState(false);
@@ -37,17 +41,42 @@ function FileManager() {
     setNotifications(prev => prev.filter(n => n.id !== id));
   };
 
-  // 加载文件树
+  // 获取某个目录下一层的节点（文件夹的子节点按需加载）
+  const fetchTreeLevel = async (workspace, path = '') => {
+    const params = new URLSearchParams({ workspace, path, depth: '1' });
+    const response = await fetch(`${BACKEND_URL}/api/files/tree?${params}`);
+    if (!response.ok) {
+      throw new Error('Failed to load file tree');
+    }
+    const data = await response.json();
+    return data.tree || [];
+  };
+
+  // 把子节点挂到树中对应的文件夹上
+  const attachChildren = (nodes, folderPath, children) => nodes.map(node => {
+    if (node.path === folderPath) {
+      return { ...node, children };
+    }
+    if (node.children && folderPath.startsWith(`${node.path}/`)) {
+      return { ...node, children: attachChildren(node.children, folderPath, children) };
+    }
+    return node;
+  });
+
+  // 加载文件树（顶层 + 已展开的文件夹）
   const loadFileTree = async (workspace = currentWorkspace) => {
     try {
       setIsLoading(true);
-      const response = await fetch(`${BACKEND_URL}/api/files/tree?workspace=${workspace}`);
-      if (response.ok) {
-        const data = await response.json();
-        setFileTree(data.tree || []);
-      } else {
-        console.error('Failed to load file tree');
+      let tree = await fetchTreeLevel(workspace);
+      const expanded = workspace === currentWorkspace ? [...expandedFolders].sort() : [];
+      for (const folderPath of expanded) {
+        try {
+          tree = attachChildren(tree, folderPath, await fetchTreeLevel(workspace, folderPath));
+        } catch (e) {
+          // 文件夹可能已被删除，忽略
+        }
       }
+      setFileTree(tree);
     } catch (error) {
       console.error('Error loading file tree:', error);
     } finally {
@@ -55,60 +84,105 @@ function FileManager() {
     }
   };
 
-  // 读取文件内容
+  // 展开/折叠文件夹
+  const toggleFolder = async (node) => {
+    const next = new Set(expandedFolders);
+    if (next.has(node.path)) {
+      next.delete(node.path);
+      setExpandedFolders(next);
+      return;
+    }
+    next.add(node.path);
+    setExpandedFolders(next);
+    if (!node.children) {
+      try {
+        const children = await fetchTreeLevel(currentWorkspace, node.path);
+        setFileTree(prev => attachChildren(prev, node.path, children));
+      } catch (error) {
+        console.error('Error loading folder:', error);
+      }
+    }
+  };
+
+  // 读取文件内容：按页读取，第一页到达即显示，其余部分在后台继续加载
+  const READ_PAGE_BYTES = 512 * 1024;
+  const loadTokenRef = useRef(0);
+  const fileLoadedRef = useRef(true);
+
+  const fetchFilePage = async (filePath, offset) => {
+    const response = await fetch(`${BACKEND_URL}/api/files/read`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({
+        workspace: currentWorkspace,
+        path: filePath,
+        offset,
+        length: READ_PAGE_BYTES
+      })
+    });
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}`);
+    }
+    return response.json();
+  };
+
   const loadFileContent = async (filePath) => {
+    const token = ++loadTokenRef.current;
+    fileLoadedRef.current = false;
     try {
       setIsLoading(true);
-      const response = await fetch(`${BACKEND_URL}/api/files/read`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          workspace: currentWorkspace,
-          path: filePath
-        })
-      });
-      
-      if (response.ok) {
-        const data = await response.json();
-        setFileContent(data.content || '');
-        setSelectedFile(filePath);
-      } else {
-        console.error('Failed to load file content');
+      const first = await fetchFilePage(filePath, 0);
+      if (token !== loadTokenRef.current) return;
+      let content = first.content || '';
+      setFileContent(content);
+      setSelectedFile(filePath);
+      setIsLoading(false);
+
+      let nextOffset = first.nextOffset;
+      while (nextOffset !== null && nextOffset !== undefined) {
+        const page = await fetchFilePage(filePath, nextOffset);
+        // 加载期间用户切换了文件
+        if (token !== loadTokenRef.current) return;
+        content += page.content || '';
+        setFileContent(content);
+        nextOffset = page.nextOffset;
       }
+      savedFileRef.current = { content, version: first.version || null };
+      fileLoadedRef.current = true;
     } catch (error) {
       console.error('Error loading file content:', error);
     } finally {
-      setIsLoading(false);
+      if (token === loadTokenRef.current) {
+        setIsLoading(false);
+      }
     }
   };
 
   // 保存文件
   const saveFile = async () => {
     if (!selectedFile) return;
+    if (!fileLoadedRef.current) {
+      addNotification('文件仍在加载，请稍后再保存', 'error');
+      return;
+    }
     
     try {
       setIsLoading(true);
-      const response = await fetch(`${BACKEND_URL}/api/files/write`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          workspace: currentWorkspace,
-          path: selectedFile,
-          content: fileContent
-        })
+      const data = await saveFileContent(BACKEND_URL, {
+        workspace: currentWorkspace,
+        path: selectedFile,
+        content: fileContent,
+        baseContent: savedFileRef.current.content,
+        baseVersion: savedFileRef.current.version
       });
       
-      if (response.ok) {
-        const data = await response.json();
-        if (data.success) {
-          addNotification('文件保存成功！', 'success');
-        } else {
-          addNotification('保存失败', 'error');
-        }
+      if (data.success) {
+        savedFileRef.current = { content: fileContent, version: data.version || null };
+        addNotification('文件保存成功！', 'success');
+      } else if (data.conflict) {
+        addNotification('文件已被其他人修改，请重新打开后再保存', 'error');
       } else {
         addNotification('保存失败', 'error');
       }
@@ -206,16 +280,17 @@ function FileManager() {
   const renderTreeNode = (node, level = 0) => {
     const isFile = node.type === 'file';
     const isSelected = selectedFile === node.path;
+    const isExpanded = expandedFolders.has(node.path);
     
     return (
       <div key={node.path} className={styles.treeNode}>
         <div 
           className={`${styles.nodeItem} ${isSelected ? styles.selected : ''}`}
           style={{ paddingLeft: `${level * 20 + 10}px` }}
-          onClick={() => isFile && loadFileContent(node.path)}
+          onClick={() => isFile ? loadFileContent(node.path) : toggleFolder(node)}
         >
           <span className={styles.nodeIcon}>
-            {isFile ? '📄' : '📁'}
+            {isFile ? '📄' : (isExpanded ? '📂' : '📁')}
           </span>
           <span className={styles.nodeName}>{node.name}</span>
           <button 
@@ -229,7 +304,7 @@ function FileManager() {
             🗑️
           </button>
         </div>
-        {node.children && node.children.map(child => 
+        {isExpanded && node.children && node.children.map(child => 
           renderTreeNode(child, level + 1)
         )}
       </div>
@@ -237,9 +312,31 @@ function FileManager() {
   };
 
   useEffect(() => {
+    setExpandedFolders(new Set());
     loadFileTree();
   }, [currentWorkspace]);
 
+  // 订阅文件变化推送，外部修改（Agent 写入、git、编辑器）时自动刷新文件树
+  const loadFileTreeRef = useRef(loadFileTree);
+  loadFileTreeRef.current = loadFileTree;
+  useEffect(() => {
+    if (typeof window === 'undefined' || !window.EventSource) {
+      return undefined;
+    }
+    const source = new EventSource(`${BACKEND_URL}/api/files/events?workspace=${currentWorkspace}`);
+    source.addEventListener('change', (event) => {
+      try {
+        const events = JSON.parse(event.data);
+        if (events.some(e => e.type !== 'modified')) {
+          loadFileTreeRef.current();
+        }
+      } catch (e) {
+        console.warn('⚠️ 文件变化事件解析失败:', e);
+      }
+    });
+    return () => source.close();
+  }, [currentWorkspace]);
+
   return (
     <div className={styles.fileManager}>
       {/* 通知容器 */}
@@ -1,5 +1,6 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { getBackendUrl } from '../../utils/apiConfig';
+import { saveFileContent } from '../../utils/fileSave';
 import styles from './styles.module.css';
 
 function NavbarFileModal() {
@@ -8,6 +9,8 @@ function NavbarFileModal() {
   const [fileName, setFileName] = useState('');
   const [fileContent, setFileContent] = useState('');
   const [currentFilePath, setCurrentFilePath] = useState('');
+  // 上次读取/保存时的内容和版本号，保存时只上传差异
+  const savedFileRef = useRef({ content: '', version: null });
   const [loading, setLoading] = useState(false);
   const [isDefaultContent, setIsDefaultContent] = useState(false);
   const [notification, setNotification] = useState(null); // 新增通知状态
@@ -172,6 +175,7 @@ function NavbarFileModal() {
       const data = await response.json();
       if (data.success) {
         setFileContent(data.content);
+        savedFileRef.current = { content: data.content, version: data.version || null };
         setCurrentFilePath(filePath);
       } else {
         showNotification(`❌ 读取失败: ${data.error}`, 'error');
@@ -189,22 +193,20 @@ function NavbarFileModal() {
     
     setLoading(true);
     try {
-      const response = await fetch(`${getBackendUrl('file')}/api/files/write`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          workspace: 'docs',
-          path: currentFilePath,
-          content: fileContent
-        })
+      const data = await saveFileContent(getBackendUrl('file'), {
+        workspace: 'docs',
+        path: currentFilePath,
+        content: fileContent,
+        baseContent: savedFileRef.current.content,
+        baseVersion: savedFileRef.current.version
       });
 
-      const data = await response.json();
       if (data.success) {
+        savedFileRef.current = { content: fileContent, version: data.version || null };
         // showNotification('✅ 文件保存成功！', 'success'); // 注释掉这行，不显示通知
         
+      } else if (data.conflict) {
+        showNotification('❌ 文件已被其他人修改，请重新打开后再保存', 'error');
       } else {
         showNotification(`❌ 保存失败: ${data.error}`, 'error');
       }
@@ -14,6 +14,25 @@ const getBackendUrl = () => {
   return 'http://localhost:5005'; // SSR环境默认值
 };
 
+// 获取（或生成）当前浏览器的会话ID，后端按会话隔离对话历史
+const getThreadId = () => {
+  if (typeof window === 'undefined') {
+    return null;
+  }
+  try {
+    let threadId = window.localStorage.getItem('chatThreadId');
+    if (!threadId) {
+      threadId = (window.crypto && window.crypto.randomUUID)
+        ? window.crypto.randomUUID()
+        : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+      window.localStorage.setItem('chatThreadId', threadId);
+    }
+    return threadId;
+  } catch (e) {
+    return null;
+  }
+};
+
 /**
  * 主要的AI聊天函数 - 流式输出
  * @param {Array} messages - 消息历史
@@ -38,6 +57,7 @@ export async function chatWithAI(messages, onChunk, onToolResult, pagePath = nul
         content: msg.text
       })),
       pagePath: pagePath,
+      threadId: getThreadId(),
       timestamp: new Date().toISOString(),
     };
     console.log('📤 请求体:', requestBody);
@@ -53,6 +73,13 @@ export async function chatWithAI(messages, onChunk, onToolResult, pagePath = nul
     console.log('📡 响应状态:', response.status);
 
     if (!response.ok) {
+      // 服务繁忙（限流、排队已满或排队超时）：使用后端给出的原因和建议的等待时间
+      if (response.status === 429 || response.status === 503) {
+        const data = await response.json().catch(() => ({}));
+        const busyError = new Error(data.error || `Backend API error: ${response.status}`);
+        busyError.retryAfter = response.headers.get('Retry-After') || data.retryAfter;
+        throw busyError;
+      }
       throw new Error(`Backend API error: ${response.status}`);
     }
 
@@ -60,6 +87,7 @@ export async function chatWithAI(messages, onChunk, onToolResult, pagePath = nul
     const decoder = new TextDecoder();
     let fullResponse = '';
     let chunkCount = 0;
+    let buffer = '';
 
     console.log('🔄 开始读取流式数据...');
 
@@ -76,7 +104,10 @@ export async function chatWithAI(messages, onChunk, onToolResult, pagePath = nul
         const chunk = decoder.decode(value, { stream: true });
         console.log(`📦 收到chunk #${chunkCount}:`, chunk);
         
-        const lines = chunk.split('\n');
+        // 服务端会把多个 token 合并成一帧，一帧可能被拆到多次 read 中：保留最后一段不完整的行
+        buffer += chunk;
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
         
         for (const line of lines) {
           if (line.startsWith('data: ')) {
@@ -132,7 +163,9 @@ export async function chatWithAI(messages, onChunk, onToolResult, pagePath = nul
     console.error('❌ AI API调用失败:', error);
     
     const errorMessage = (() => {
-      if (error.message.includes('API key') || error.message.includes('401')) {
+      if (error.retryAfter) {
+        return `抱歉，${error.message}，请 ${error.retryAfter} 秒后再试。`;
+      } else if (error.message.includes('API key') || error.message.includes('401')) {
         return '抱歉，AI服务配置有误，请检查API密钥设置。';
       } else if (error.message.includes('quota') || error.message.includes('429')) {
         return '抱歉，AI服务配额已用完，请稍后再试。';
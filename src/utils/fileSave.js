@@ -0,0 +1,78 @@
+// 文件保存：有基准版本时只上传改动部分（/api/files/patch），否则整篇写入（/api/files/write）
+
+/**
+ * 计算从 base 到 current 的单段文本差异（公共前缀/后缀之外的部分）
+ * 偏移为 JavaScript 字符串下标（UTF-16），与后端约定一致
+ */
+export const computeTextEdit = (base, current) => {
+  if (base === current) {
+    return null;
+  }
+  const maxPrefix = Math.min(base.length, current.length);
+  let start = 0;
+  while (start < maxPrefix && base.charCodeAt(start) === current.charCodeAt(start)) {
+    start++;
+  }
+  let baseEnd = base.length;
+  let currentEnd = current.length;
+  while (baseEnd > start && currentEnd > start
+    && base.charCodeAt(baseEnd - 1) === current.charCodeAt(currentEnd - 1)) {
+    baseEnd--;
+    currentEnd--;
+  }
+  // 不要把代理对从中间切开
+  const isLowSurrogate = (code) => code >= 0xdc00 && code <= 0xdfff;
+  if (start > 0 && isLowSurrogate(base.charCodeAt(start))) {
+    start--;
+  }
+  if (baseEnd < base.length && isLowSurrogate(base.charCodeAt(baseEnd))) {
+    baseEnd++;
+    currentEnd++;
+  }
+  return { start, end: baseEnd, text: current.slice(start, currentEnd) };
+};
+
+const postJson = async (url, method, body) => {
+  const response = await fetch(url, {
+    method,
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify(body)
+  });
+  const data = await response.json().catch(() => ({ success: false, error: `HTTP ${response.status}` }));
+  return { status: response.status, data };
+};
+
+/**
+ * 保存文件
+ * @param {string} backendUrl - 文件服务地址
+ * @param {Object} options - { workspace, path, content, baseContent, baseVersion }
+ *   baseContent/baseVersion 为上次读取或保存时的内容和版本号
+ * @returns {Promise<Object>} { success, version, conflict, error }
+ */
+export const saveFileContent = async (backendUrl, { workspace, path, content, baseContent, baseVersion }) => {
+  if (baseVersion && typeof baseContent === 'string') {
+    const edit = computeTextEdit(baseContent, content);
+    const { status, data } = await postJson(`${backendUrl}/api/files/patch`, 'PATCH', {
+      workspace,
+      path,
+      baseVersion,
+      edits: edit ? [edit] : []
+    });
+    if (status === 409) {
+      return { success: false, conflict: true, version: data.version, error: data.error };
+    }
+    // 文件不存在或编辑无效时退回整篇写入
+    if (status !== 404 && status !== 400) {
+      return data;
+    }
+  }
+  const { status, data } = await postJson(`${backendUrl}/api/files/write`, 'POST', {
+    workspace,
+    path,
+    content,
+    baseVersion
+  });
+  return status === 409 ? { ...data, conflict: true } : data;
+};